@@ -0,0 +1,174 @@
+"""
+End-to-end shopping cart round trip against the in-memory Google API
+stand-in (mock_gdrive.py): builds a synthetic datastore, publishes
+a cart with store2sheet.create_shopping_cart, simulates staff picking
+new branches and imports selections with sheet2store.set_new_branch.
+Reports wall time, API calls and bytes sent/received per phase.
+
+usage:
+    python benchmarks/bench_cart.py [items] [--latency 0.2] [--picked 0.3]
+        [--seed 0]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from context import FILES  # noqa: F401, sets up import path
+from mock_gdrive import FakeGoogleBackend
+
+import datastore
+from adapters import sheet2store, store2sheet
+from adapters.gdrive import sheet_templates
+
+
+SYSTEM_ID = 2
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'rebalancer', 'data')
+REFERENCE_DATA = [
+    ('audiences.json', datastore.Audience),
+    ('branches.json', datastore.Branch),
+    ('categories.json', datastore.MatCat),
+    ('languages.json', datastore.Language),
+    ('item-types.json', datastore.ItemType),
+]
+TABS = store2sheet.CART_DATA_TABS
+
+
+def create_reference_data():
+    with datastore.session_scope() as session:
+        session.add(datastore.System(rid=1, code='BKL', label='Brooklyn'))
+        session.add(datastore.System(rid=2, code='NYP', label='NYPL'))
+        for fh, model in REFERENCE_DATA:
+            with open(os.path.join(DATA_DIR, fh), 'r') as jsonfile:
+                session.execute(model.__table__.insert(), json.load(jsonfile))
+        session.add(datastore.ShelfCode(rid=1, system_id=SYSTEM_ID, code='fc'))
+
+
+def create_items(count, rng):
+    with datastore.session_scope() as session:
+        branches = [
+            b.rid for b in session.query(datastore.Branch).filter_by(
+                system_id=SYSTEM_ID) if b.code]
+        mat_cats = [
+            m.rid for m in session.query(datastore.MatCat).filter_by(
+                system_id=SYSTEM_ID)]
+        item_types = [
+            i.rid for i in session.query(datastore.ItemType).filter_by(
+                system_id=SYSTEM_ID)]
+        langs = {
+            lang.code: lang.rid for lang in session.query(datastore.Language)
+            if lang.code}
+        world_langs = [rid for code, rid in langs.items() if code != 'eng']
+        items = []
+        for n in range(count):
+            lang_id = (
+                langs['eng'] if rng.random() < 0.85
+                else rng.choice(world_langs))
+            items.append(dict(
+                rid=n + 1, system_id=SYSTEM_ID, bib_id=10000000 + n,
+                title=f'Title {rng.randrange(count)} of the synthetic cart',
+                author=f'Author{rng.randrange(5000)}, Name',
+                call_no=f'FIC {rng.choice("ABCDEFGHIJKLMNOPRSTW")}'
+                        f'{rng.randrange(1000):03}',
+                item_id=20000000 + n, src_branch_id=rng.choice(branches),
+                src_branch_shelf_id=1, pub_date=str(rng.randrange(1990, 2020)),
+                mat_cat_id=rng.choice(mat_cats), audn_id=rng.randrange(2, 5),
+                lang_id=lang_id, item_type_id=rng.choice(item_types)))
+        session.execute(datastore.OverflowItem.__table__.insert(), items)
+        return sorted(
+            b.code for b in session.query(datastore.Branch).filter_by(
+                system_id=SYSTEM_ID) if b.code)
+
+
+def pick_branches(backend, sheet_id, branch_codes, share, rng):
+    """
+    Fills new branch column of a share of item rows, as staff would
+    """
+    picked = 0
+    for tab in TABS:
+        for row in backend.tab(sheet_id, tab)[1:]:
+            if len(row) > 6 and row[6] and rng.random() < share:
+                row.extend([''] * (8 - len(row)))
+                row[7] = rng.choice(branch_codes)
+                picked += 1
+    return picked
+
+
+def report(phase, elapsed, backend, note=''):
+    calls = sum(backend.calls.values())
+    sent = sum(backend.bytes_sent.values())
+    received = sum(backend.bytes_received.values())
+    print(
+        f'{phase:<10} {elapsed:8.2f} s  {calls:5} calls  '
+        f'sent {sent / 1e6:8.2f} MB  received {received / 1e6:8.2f} MB  '
+        f'{note}')
+    for method, count in sorted(backend.calls.items()):
+        print(
+            f'{"":<12}{method:<28} {count:5}  '
+            f'sent {backend.bytes_sent[method] / 1e6:8.2f} MB')
+    backend.reset_counts()
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('items', type=int, nargs='?', default=100000)
+    parser.add_argument(
+        '--latency', type=float, default=0.2,
+        help='seconds each Google API request takes')
+    parser.add_argument(
+        '--picked', type=float, default=0.3,
+        help='share of items staff select a new branch for')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(args)
+
+
+def run(args):
+    options = parse_args(args)
+    rng = random.Random(options.seed)
+    backend = FakeGoogleBackend(latency=options.latency)
+    backend.install()
+    store2sheet.get_access_token = lambda: None
+    store2sheet.get_gdrive_folder_id = lambda: 'rebalancing-folder'
+    sheet2store.get_access_token = lambda: None
+    sheet_templates.get_editors = lambda: {'users': ['editor@example.org']}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        datastore.dal = datastore.DataAccessLayer(
+            f'sqlite:///{os.path.join(tmp, "store.db")}', profile='ingest')
+        datastore.migrate_datastore()
+
+        start = time.perf_counter()
+        create_reference_data()
+        branch_codes = create_items(options.items, rng)
+        print(
+            f'{"seed":<10} {time.perf_counter() - start:8.2f} s  '
+            f'{options.items} items')
+
+        start = time.perf_counter()
+        store2sheet.create_shopping_cart(SYSTEM_ID)
+        elapsed = time.perf_counter() - start
+        sheet_id = next(iter(backend.spreadsheets))
+        rows = sum(
+            len(backend.tab(sheet_id, tab))
+            for tab in TABS + [store2sheet.VALIDATION_TAB])
+        report('publish', elapsed, backend, f'{rows} rows')
+
+        picked = pick_branches(
+            backend, sheet_id, branch_codes, options.picked, rng)
+
+        start = time.perf_counter()
+        selections = sheet2store.set_new_branch(TABS, sheet_id)
+        elapsed = time.perf_counter() - start
+        report(
+            'import', elapsed, backend,
+            f'{selections} selections ({picked} picked)')
+        datastore.dal.dispose()
+
+
+if __name__ == '__main__':
+    run(sys.argv[1:])
@@ -0,0 +1,50 @@
+"""
+Micro-benchmark of Sierra export date parsing: per-row cost of parsing
+bib created, item created and last checkout dates with plain strptime
+versus memoized sierra2store.string2date
+
+usage:
+    python benchmarks/bench_dates.py [export file] [repeat]
+"""
+from datetime import datetime
+import os
+import sys
+import timeit
+
+from context import FILES
+from adapters.sierra2store import parse_date, sierra_export_reader, string2date
+
+
+def strptime_date(date_string):
+    try:
+        return datetime.strptime(date_string[:10], '%m-%d-%Y').date()
+    except TypeError:
+        return
+    except ValueError:
+        return
+
+
+def parse_rows(rows, parser):
+    for row in rows:
+        parser(row.bib_created_date)
+        parser(row.item_created_date)
+        parser(row.last_out_date)
+
+
+def run(fh, repeat):
+    rows = list(sierra_export_reader(fh))
+    for label, parser in (('strptime', strptime_date),
+                          ('string2date', string2date)):
+        parse_date.cache_clear()
+        elapsed = min(timeit.repeat(
+            lambda: parse_rows(rows, parser), number=1, repeat=repeat))
+        print(f'{label:>12}: {elapsed / len(rows) * 1e6:.2f} us/row '
+              f'({len(rows)} rows)')
+    print(f'cache: {parse_date.cache_info()}')
+
+
+if __name__ == '__main__':
+    fh = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        FILES, 'nyp_test_export.txt')
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(fh, repeat)
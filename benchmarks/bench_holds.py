@@ -0,0 +1,210 @@
+"""
+Load test of Sierra hold placement against the local mock Sierra API
+(mock_sierra.py): throughput, latency percentiles and retries of
+    - raw SierraSession.hold_place_on_item requests placed by
+      adapters.sierra.holds.place_holds with varying concurrency
+    - distributor.issue_holds run end to end on a temporary datastore
+    - paged listing and concurrent deletion of the account's holds
+
+usage:
+    python benchmarks/bench_holds.py [holds] [--latency 0.05]
+        [--jitter 0.02] [--error-rate 0.01] [--throttle 50]
+        [--workers 1,4,8,16] [--rate 0]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from context import FILES  # noqa: F401, sets up import path
+from mock_sierra import MockConfig, start_server
+
+# mock API is served over plain http
+os.environ.setdefault('OAUTHLIB_INSECURE_TRANSPORT', '1')
+
+import datastore
+import distributor
+from adapters.sierra.holds import delete_account_holds, place_holds
+from adapters.sierra.session import SierraSession
+
+
+ACCOUNT_ID = 1234567
+BRANCH_CODES = ['ag', 'bc', 'ew', 'hu', 'mp']
+
+
+class TimedSierraSession(SierraSession):
+    """
+    Records duration and status of each API request
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.timings = []
+        self.timings_lock = threading.Lock()
+        SierraSession.__init__(self, *args, **kwargs)
+
+    def request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        response = SierraSession.request(self, method, url, *args, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self.timings_lock:
+            self.timings.append((elapsed, response.status_code))
+        return response
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def report(label, elapsed, timings, retries, server, count):
+    latencies = [t for t, _ in timings]
+    statuses = {}
+    for _, status in timings:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(
+        f'{label:<28} {count / elapsed:8.1f} holds/s '
+        f'{len(timings) / elapsed:8.1f} req/s  '
+        f'p50 {percentile(latencies, 50) * 1000:6.1f} ms  '
+        f'p99 {percentile(latencies, 99) * 1000:6.1f} ms  '
+        f'retries {retries:<5} throttled {server.state.counts["throttled"]:<5}'
+        f' statuses {dict(sorted(statuses.items()))}')
+
+
+def reset_counts(server):
+    with server.state.lock:
+        server.state.counts.clear()
+        server.state.window_count = 0
+
+
+def bench_place_holds(server, base_url, count, workers, rate):
+    holds = [
+        (10000000 + n, BRANCH_CODES[n % len(BRANCH_CODES)])
+        for n in range(count)]
+    with TimedSierraSession(
+            base_url, 'key', 'secret', pool_maxsize=max(workers, 1)) as s:
+        s.timings.clear()
+        reset_counts(server)
+        start = time.perf_counter()
+        outcomes = list(place_holds(
+            s, ACCOUNT_ID, holds, workers=workers, rate=rate, backoff=0.1))
+        elapsed = time.perf_counter() - start
+        retries = sum(o.attempts - 1 for o in outcomes)
+        report(
+            f'place_holds workers={workers}', elapsed, s.timings, retries,
+            server, count)
+
+
+def bench_cleanup(server, base_url, workers, rate):
+    with TimedSierraSession(
+            base_url, 'key', 'secret', pool_maxsize=max(workers, 1)) as s:
+        s.timings.clear()
+        reset_counts(server)
+        count = len(server.state.holds)
+        start = time.perf_counter()
+        deleted, failures = delete_account_holds(
+            s, ACCOUNT_ID, workers=workers, rate=rate, backoff=0.1)
+        elapsed = time.perf_counter() - start
+        report(
+            f'delete_account_holds w={workers}', elapsed, s.timings,
+            server.state.counts['throttled'], server, count)
+        print(f'{"":<28} deleted {deleted}, failed {len(failures)}')
+
+
+def seed_datastore(count):
+    with datastore.session_scope() as session:
+        session.add(datastore.System(rid=2, code='NYP', label='NYPL'))
+        session.add(datastore.Audience(rid=1, code='a', label='Adults'))
+        session.add(datastore.Language(rid=1, code='eng', label='English'))
+        session.add(datastore.MatCat(
+            rid=1, system_id=2, code='fi', label='Fiction'))
+        session.add(datastore.ShelfCode(rid=1, system_id=2, code='fc'))
+        session.add(datastore.ItemType(rid=1, system_id=2, code=0))
+        session.add(datastore.Branch(rid=1, system_id=2, code=None))
+        for rid, code in enumerate(BRANCH_CODES, start=2):
+            session.add(datastore.Branch(rid=rid, system_id=2, code=code))
+        session.add(datastore.Cart(
+            rid=1, system_id=2, shopping_cart_id='bench'))
+        session.flush()
+        session.execute(datastore.OverflowItem.__table__.insert(), [
+            dict(
+                rid=n + 1, system_id=2, cart_id=1, bib_id=n, title='T',
+                item_id=10000000 + n, src_branch_id=1, src_branch_shelf_id=1,
+                dst_branch_id=2 + n % len(BRANCH_CODES), mat_cat_id=1,
+                audn_id=1, lang_id=1, item_type_id=1)
+            for n in range(count)])
+
+
+def bench_issue_holds(server, base_url, count, workers, rate):
+    sessions = []
+
+    def session_factory(*args, **kwargs):
+        sessions.append(TimedSierraSession(*args, **kwargs))
+        return sessions[-1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        datastore.dal = datastore.DataAccessLayer(
+            f'sqlite:///{os.path.join(tmp, "store.db")}', profile='serve')
+        datastore.dal.connect()
+        datastore.Base.metadata.create_all(datastore.dal.engine)
+        seed_datastore(count)
+
+        distributor.SierraSession = session_factory
+        reset_counts(server)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            placed, failed = distributor.issue_holds(
+                base_url, 'key', 'secret', ACCOUNT_ID, cart_id=1,
+                workers=workers, rate=rate)
+        elapsed = time.perf_counter() - start
+        with datastore.session_scope() as session:
+            attempts = sum(
+                r.attempts for r in session.query(datastore.HoldRequest))
+        report(
+            f'issue_holds workers={workers}', elapsed, sessions[0].timings,
+            attempts - placed - failed, server, count)
+        print(f'{"":<28} placed {placed}, failed {failed}')
+        datastore.dal.dispose()
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('holds', type=int, nargs='?', default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--throttle', type=float, default=None)
+    parser.add_argument('--workers', default='1,4,8,16')
+    parser.add_argument(
+        '--rate', type=float, default=0,
+        help='client side requests per second, 0 disables rate limiting')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(args)
+
+
+def run(args):
+    options = parse_args(args)
+    config = MockConfig(
+        latency=options.latency, jitter=options.jitter,
+        error_rate=options.error_rate, throttle=options.throttle,
+        seed=options.seed)
+    server, base_url = start_server(config)
+    workers = [int(w) for w in options.workers.split(',')]
+    try:
+        for w in workers:
+            bench_place_holds(server, base_url, options.holds, w, options.rate)
+        bench_issue_holds(
+            server, base_url, options.holds, workers[-1], options.rate)
+        bench_cleanup(server, base_url, workers[-1], options.rate)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    run(sys.argv[1:])
@@ -0,0 +1,8 @@
+import os
+import sys
+
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(p, 'rebalancer'))
+sys.path.insert(0, p)
+
+FILES = os.path.join(p, 'tests', 'files')
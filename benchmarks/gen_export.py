@@ -0,0 +1,493 @@
+"""
+Seeded generator of synthetic Sierra exports in the layout read by
+adapters.sierra2store (RowData fields, | delimited, " qualified, ~ between
+repeated fields). Rows mimic NYPL and BPL exports: system specific location,
+item type and OPAC message codes, call numbers of every category of
+NYP_CALL_PATTERNS or BPL_CALL_PATTERNS including world language ones,
+880- vernacular titles and authors, repeated fields, stray quotes and
+malformed dates. The same system, size and seed always produce the same
+file, so generated exports serve as shared input of ingestion benchmarks.
+
+usage:
+    python benchmarks/gen_export.py nyp|bpl [rows] [--seed 0] [-o path]
+        [--force]
+
+    prints path of the export, e.g.:
+    python benchmarks/bench_dates.py $(python benchmarks/gen_export.py nyp)
+"""
+import argparse
+from collections import Counter, namedtuple
+from datetime import date
+from functools import lru_cache
+import os
+import random
+import sys
+import time
+
+from context import FILES  # noqa: F401, sets up import path
+
+from adapters.sierra2store import (
+    BPL_CALL_CLASSIFIER, BPL_CALL_PATTERNS, NYP_CALL_CLASSIFIER,
+    NYP_CALL_PATTERNS, classify_call_no)
+
+
+# rows of typical benchmark sizes
+SIZES = (10000, 100000, 1000000, 5000000)
+
+# share of rows with a quirk of real exports
+BAD_DATE_RATE = 0.005
+REPEATED_FIELD_RATE = 0.05
+STRAY_QUOTE_RATE = 0.002
+VERNACULAR_RATE = 0.6  # of bibs with world language call numbers
+UNKNOWN_BRANCH_RATE = 0.002
+# number of items of a bib drawn from
+ITEMS_PER_BIB = (1, 1, 1, 2, 2, 3, 4)
+
+# rows are written in chunks to keep memory flat for large exports
+WRITE_CHUNK = 10000
+
+FIRST_DATE = date(2005, 1, 1).toordinal()
+LAST_DATE = date(2020, 2, 29).toordinal()
+
+BAD_DATES = [
+    '', '  -  -  ', '00-00-0000', '02-30-2019', '13-01-2019', '2019-05-09',
+    '5-9-2019']
+
+# language codes of datastore's language table placed in call numbers
+WORLD_LANGS = [
+    'ALB', 'ARA', 'BEN', 'CHI', 'FRE', 'GER', 'HAT', 'HEB', 'HIN', 'HUN',
+    'ITA', 'JPN', 'KOR', 'PAN', 'POL', 'POR', 'RUS', 'SAN', 'SPA', 'UKR',
+    'URD', 'YID']
+
+SURNAMES = [
+    'ADAMS', 'ALEXANDER', 'ALLISON', 'ANDREWS', 'BALOGH', 'BERRY', 'BLACK',
+    'BROOKS', 'CABOT', 'CARLE', 'CONNOLLY', 'DEAN', 'DICAMILLO', 'FARINA',
+    'FINCH', 'FLUKE', 'GRADY', 'HANCOCK', 'HURSTON', 'JOHNSTONE', 'KAPLAN',
+    'LAURENCE', 'LINDSEY', 'MARTIN', 'MILLER', 'MOSLEY', 'MURRAY',
+    'OSBORNE', 'PEARSON', 'REYNOLDS', 'ROBB', 'ROBINSON', 'ROSS', 'SANDS',
+    'TODD', 'WADE', 'WOOD']
+GIVEN_NAMES = [
+    'Anya', 'Beverly', 'Douglas', 'Fredrik', 'Graham', 'Iain', 'Janet',
+    'Kate', 'Matt', 'Michael', 'Nora', 'Ralph', 'Toni', 'Walter', 'Zora']
+WORDS = [
+    'art', 'autumn', 'bridge', 'city', 'daughter', 'dream', 'empire',
+    'family', 'garden', 'gods', 'history', 'house', 'island', 'journey',
+    'kingdom', 'light', 'magic', 'memory', 'moon', 'night', 'ocean',
+    'river', 'science', 'secret', 'shadow', 'silence', 'story', 'summer',
+    'time', 'war', 'water', 'winter', 'world']
+VERNACULAR_WORDS = [
+    'Bozhii', 'pristani', 'rasskazy', 'zhiznʹ', 'Vtorai︠a︡', 'ispovedʹ',
+    'roman', 'novela', 'cuentos', 'Nulʹ', 'shōsetsu', 'monogatari']
+PLACES = [
+    'New York', 'Boston', 'Chicago', 'London', 'Moskva', 'Barcelona',
+    'Paris', 'Tokyo']
+PUBLISHERS = [
+    'Scribner', 'Penguin Books', 'Thomas Dunne Books', 'HarperCollins',
+    'Que', 'PublicAffairs', 'OLMA Media Grupp', 'Boslen']
+# publisher name with unescaped quotes, as they appear in exports
+QUOTED_PUBLISHER = 'Izdatelʹstvo "Sinbad"'
+
+# call number templates by category they are classified in;
+# None stands for call numbers not matching any category
+NYP_CALL_TEMPLATES = {
+    'lp': ['LG-PRINT FIC {name}', 'LG PRINT {dewey} {initial}'],
+    'ur': ['URBAN {name}'],
+    'my': ['MYSTERY {name}', '{lang} MYSTERY {name}'],
+    'we': ['WESTERN {name}'],
+    'cl': ['CLASSICS FIC {name}'],
+    'ho': ['J HOLIDAY PIC {initial}', 'J HOLIDAY {dewey} {initial}'],
+    'sf': ['SCI FI {name}', 'SCI-FI {name}'],
+    'rm': ['ROMANCE {name}'],
+    'gn': [
+        'GRAPHIC GN FIC {name}', 'J GRAPHIC GN FIC {name}',
+        '{lang} GN FIC {initial}'],
+    'pi': ['J PIC {initial}', '{lang} J PIC {initial}'],
+    'er': ['J E {name}', '{lang} J E {initial}'],
+    'yr': ['J YR FIC {name}'],
+    'fi': [
+        'FIC {name}', 'J FIC {name}', 'J READALONG FIC {name}',
+        '{lang} FIC {name}', 'Spa FIC {initial}'],
+    'bi': ['B {name} {initial}', 'J B {name} {initial}',
+           'GRAPHIC B {name} {initial}'],
+    'dv': ['DVD MOVIE {name}', 'J DVD TV {name}'],
+    'cd': ['CD {name}'],
+    'd': [
+        '{dewey} {initial}', 'J {dewey} {initial}', '{lang} {dewey} {initial}',
+        'GRAPHIC {dewey} {initial}'],
+    None: ['J PER', 'MAGAZINE'],
+}
+
+BPL_CALL_TEMPLATES = {
+    'fi': [
+        'FIC {name}', 'J FIC {name}', '{lang} FIC {name}',
+        '{lang} J FIC {initial}'],
+    'pi': ['J-E {name}', '{lang} J-E {initial}', 'J-E'],
+    'd': [
+        '{dewey} {initial}', 'J {dewey} {initial}', '{lang} {dewey} {initial}',
+        'DVD {dewey} {initial}'],
+    'bi': ['B {name} {initial}', 'J B {name} {initial}'],
+    None: ['', 'DVD J MOVIE {name}', 'DVD TV {name}', 'CD {name}', 'J PER'],
+}
+
+SystemFormat = namedtuple(
+    'SystemFormat',
+    'header, patterns, classifier, call_templates, branches, shelves, '
+    'item_types, opac_msgs, created_time, empty_last_out, last_out_time, '
+    'empty_field')
+
+NYP = SystemFormat(
+    header=(
+        '"RECORD #(BIBLIO)"|"CREATED(BIBLIO)"|"TITLE"|"AUTHOR"|"PUB INFO"|'
+        '"CALL #(BIBLIO)"|"RECORD #(ITEM)"|"CREATED(ITEM)"|"LOCATION"|'
+        '"I TYPE"|"OPACMSG"|"LOUTDATE"|"TOT CHKOUT"|"TOT RENEW"'),
+    patterns=NYP_CALL_PATTERNS,
+    classifier=NYP_CALL_CLASSIFIER,
+    call_templates=NYP_CALL_TEMPLATES,
+    branches=[
+        'ag', 'al', 'ba', 'bc', 'be', 'bl', 'br', 'bt', 'ca', 'cc', 'ch',
+        'ci', 'cl', 'cp', 'cs', 'ct', 'dh', 'dy', 'ea', 'ep', 'ew', 'fe',
+        'fw', 'fx', 'gc', 'gd', 'gk', 'hb', 'hd', 'hf', 'hg', 'hk', 'hl',
+        'hp', 'hs', 'ht', 'hu', 'in', 'jm', 'jp', 'kb', 'kp', 'lb', 'lm',
+        'ma', 'mb', 'me', 'mh', 'ml', 'mm', 'mn', 'mo', 'mp', 'mr', 'mu',
+        'my', 'nb', 'nd', 'ns', 'ot', 'pk', 'pm', 'pr', 'rd', 'ri', 'rs',
+        'rt', 'sa', 'sb', 'sc', 'sd', 'se', 'sg', 'sl', 'sn', 'ss', 'st',
+        'sv', 'tg', 'th', 'tm', 'ts', 'tv', 'vc', 'vn', 'wb', 'wf', 'wh',
+        'wk', 'wl', 'wo', 'wt', 'yv'],
+    shelves=(
+        ['0n'] * 10 + ['0f'] * 7 + ['0l'] * 4 + ['0a', '0y', '0i', 'an',
+                                                 '0h', 'lf', 'av']),
+    item_types=(
+        ['102'] * 5 + ['101'] * 5 + ['201'] * 4 + ['138'] * 3 + ['211'] * 2
+        + ['231'] * 2 + ['238'] * 2 + ['136', '117', '155', '111', '220']),
+    opac_msgs=['-'] * 12 + ['8'] * 6 + ['n'] * 2 + ['s', '5', 'e'],
+    created_time='{h}:{m:02}',
+    empty_last_out='  -  -  ',
+    last_out_time='{h:02}:{m:02}',
+    empty_field='""')
+
+BPL = SystemFormat(
+    header=(
+        'RECORD #|CREATED|TITLE|AUTHOR|PUB INFO|CALL #|RECORD #|CREATED|'
+        'LOCATION|ITEM TYPE|OPAC LABEL|UNKNOWN|TOTAL CHECKOUT|TOTAL RENEWAL'),
+    patterns=BPL_CALL_PATTERNS,
+    classifier=BPL_CALL_CLASSIFIER,
+    call_templates=BPL_CALL_TEMPLATES,
+    branches=[
+        '02', '03', '04', '11', '12', '13', '14', '16', '21', '22', '23',
+        '24', '25', '26', '27', '28', '29', '30', '31', '32', '33', '34',
+        '35', '36', '37', '38', '39', '40', '41', '42', '43', '44', '45',
+        '46', '47', '48', '49', '50', '51', '52', '53', '54', '55', '56',
+        '57', '59', '60', '61', '62', '63', '64', '65', '66', '67', '68',
+        '69', '70', '71', '72', '74', '76', '77', '78', '79', '80', '81',
+        '82', '83', '85', '87', '89', '90', '94'],
+    shelves=(
+        ['my'] * 4 + ['wl'] * 4 + ['nf'] * 4 + ['je'] * 3 + ['fc'] * 3
+        + ['pb'] * 2 + ['dv', 'sh', 'sf', 'bi', 'lp', 'nb', 'er', 'cd', '']),
+    item_types=(
+        ['1'] * 12 + ['3'] * 5 + ['2'] * 4 + ['4'] * 2 + ['39', '9', '18',
+                                                          '5', '6']),
+    opac_msgs=(
+        ['-'] * 12 + ['m'] * 4 + ['u'] * 3 + ['n'] * 2 + ['y'] * 2
+        + ['d', 'l', 's', 'j', 'k', 'e', 't', 'b', 'w', '']),
+    created_time=None,
+    empty_last_out='  -  -    ',
+    last_out_time='{h:02}:{m:02}:{s:02}.0',
+    empty_field='')
+
+SYSTEMS = dict(nyp=NYP, bpl=BPL)
+
+
+def check_digit(number):
+    """
+    Computes Sierra record number check digit
+    args:
+        number: int, record number without prefix and check digit
+    returns:
+        str
+    """
+    total = sum(
+        int(digit) * weight
+        for weight, digit in enumerate(reversed(str(number)), start=2))
+    remainder = total % 11
+    return 'x' if remainder == 10 else str(remainder)
+
+
+def record_number(prefix, number):
+    return f'{prefix}{number}{check_digit(number)}'
+
+
+def quote(value):
+    return f'"{value}"'
+
+
+def template_categories(fmt):
+    """
+    Expands call number templates into classifier categories they hit;
+    'd' templates cover all d0-d9 dewey categories
+    yields:
+        tuple: (category, template)
+    """
+    for category, templates in fmt.call_templates.items():
+        for template in templates:
+            if category == 'd':
+                for digit in range(10):
+                    yield f'd{digit}', template
+            else:
+                yield category, template
+
+
+def format_call_no(template, rng, category=None):
+    dewey = rng.randrange(1000)
+    if category and category[0] == 'd' and category[1:].isdigit():
+        dewey = int(category[1]) * 100 + dewey % 100
+    dewey = f'{dewey:03}'
+    if rng.random() < 0.5:
+        dewey = f'{dewey}.{rng.randrange(1, 1000)}'
+    name = rng.choice(SURNAMES)
+    return template.format(
+        name=name, initial=name[0], dewey=dewey,
+        lang=rng.choice(WORLD_LANGS)).strip()
+
+
+def check_templates(fmt, seed=0):
+    """
+    Verifies each call number template is classified in its category
+    and all categories of the system's call number patterns are covered
+    raises:
+        ValueError
+    """
+    rng = random.Random(seed)
+    covered = set()
+    for category, template in template_categories(fmt):
+        for _ in range(20):
+            call_no = format_call_no(template, rng, category)
+            found = classify_call_no(call_no, fmt.classifier)
+            if found != category:
+                raise ValueError(
+                    f'Call number "{call_no}" classified as "{found}", '
+                    f'expected "{category}"')
+        covered.add(category)
+    missing = set(fmt.patterns).difference(covered)
+    if missing:
+        raise ValueError(
+            f'No call number templates for categories: {sorted(missing)}')
+
+
+@lru_cache(maxsize=None)
+def date_string(ordinal):
+    d = date.fromordinal(ordinal)
+    return f'{d.month:02}-{d.day:02}-{d.year}'
+
+
+def format_date(rng, ordinal, time_format=None):
+    value = date_string(ordinal)
+    if time_format:
+        value += ' ' + time_format.format(
+            h=rng.randrange(7, 21), m=rng.randrange(60), s=rng.randrange(60))
+    return value
+
+
+def maybe_bad(value, rng):
+    if rng.random() < BAD_DATE_RATE:
+        return rng.choice(BAD_DATES)
+    return value
+
+
+def vernacular(prefix_no, text, rng, world):
+    if world and rng.random() < VERNACULAR_RATE:
+        return f'880-0{prefix_no} {text}'
+    return text
+
+
+def make_bib(fmt, rng, bib_no, categories):
+    """
+    Creates quoted bibliographic fields shared by all items of a bib
+    returns:
+        tuple: (fields, category, created date ordinal, juvenile)
+    """
+    category, template = rng.choice(categories)
+    call_no = format_call_no(template, rng, category)
+    tokens = call_no.upper().split()
+    world = any(lang in tokens for lang in WORLD_LANGS)
+    juvenile = 'J' in tokens or 'J-E' in tokens
+
+    given = rng.choice(GIVEN_NAMES)
+    surname = rng.choice(SURNAMES).title()
+    words = VERNACULAR_WORDS if world else WORDS
+    title = ' '.join(rng.choice(words) for _ in range(rng.randrange(1, 6)))
+    title = f'{title[0].upper()}{title[1:]} / {given} {surname}.'
+    title = quote(vernacular(2, title, rng, world))
+    if rng.random() < REPEATED_FIELD_RATE:
+        title += '~' + quote(f'{rng.choice(WORDS).title()} series ; 1.')
+
+    if rng.random() < 0.05:
+        author = fmt.empty_field
+    else:
+        author = f'{surname}, {given}'
+        if rng.random() < 0.5:
+            author += f', {rng.randrange(1920, 1995)}-'
+            if rng.random() < 0.6:
+                author += ' author.'
+        elif rng.random() < 0.6:
+            author += ', author.'
+        author = quote(vernacular(1, author, rng, world))
+
+    year = rng.randrange(1960, 2020)
+    pub_year = rng.choice([f'{year}.', f'[{year}]', f'c{year}.', '[n.d.]'])
+    publisher = rng.choice(PUBLISHERS)
+    if rng.random() < STRAY_QUOTE_RATE:
+        publisher = QUOTED_PUBLISHER
+    pub_info = quote(vernacular(
+        3, f'{rng.choice(PLACES)} : {publisher}, {pub_year}', rng, world))
+    if rng.random() < REPEATED_FIELD_RATE:
+        pub_info += '~' + quote(f'©{year}')
+
+    call_no = quote(call_no)
+    if fmt is NYP and rng.random() < REPEATED_FIELD_RATE / 10:
+        call_no += '~' + quote(f'{rng.choice(fmt.branches)}l CATBL')
+
+    created = rng.randrange(FIRST_DATE, LAST_DATE)
+    fields = (
+        quote(record_number('b', bib_no)),
+        quote(maybe_bad(
+            format_date(rng, created, fmt.created_time), rng)),
+        title, author, pub_info, call_no)
+    return fields, category, created, juvenile
+
+
+def make_item(fmt, rng, item_no, bib_created, juvenile):
+    branch = rng.choice(fmt.branches)
+    if rng.random() < UNKNOWN_BRANCH_RATE:
+        branch = 'zz'
+    audience = 'j' if juvenile else rng.choice('aaaaaaaay')
+    location = f'{branch}{audience}{rng.choice(fmt.shelves)}'
+
+    created = rng.randrange(bib_created, LAST_DATE + 1)
+    checkouts = 0
+    last_out = fmt.empty_last_out
+    if rng.random() < 0.65:
+        checkouts = int(rng.expovariate(0.15)) + 1
+        last_out = format_date(
+            rng, rng.randrange(created, LAST_DATE + 1), fmt.last_out_time)
+    renewals = int(checkouts * rng.random() * 3)
+
+    return (
+        quote(record_number('i', item_no)),
+        quote(maybe_bad(format_date(rng, created, fmt.created_time), rng)),
+        quote(location),
+        quote(rng.choice(fmt.item_types)),
+        quote(rng.choice(fmt.opac_msgs)),
+        quote(maybe_bad(last_out, rng)),
+        quote(checkouts),
+        quote(renewals))
+
+
+def generate_rows(system, rows, seed=0):
+    """
+    Generates export rows; items of the same bib follow each other
+    args:
+        system: str, 'nyp' or 'bpl'
+        rows: int, number of rows
+        seed: int, random seed
+    yields:
+        tuple: (export line without line break, call number category)
+    """
+    fmt = SYSTEMS[system]
+    rng = random.Random(f'{system}-{seed}')
+    categories = list(template_categories(fmt))
+    bib_no = 11000000 + rng.randrange(1000000)
+    item_no = 20000000 + rng.randrange(1000000)
+    produced = 0
+    while produced < rows:
+        bib_no += 1
+        bib, category, created, juvenile = make_bib(
+            fmt, rng, bib_no, categories)
+        items = min(rng.choice(ITEMS_PER_BIB), rows - produced)
+        for _ in range(items):
+            item_no += 1
+            item = make_item(fmt, rng, item_no, created, juvenile)
+            produced += 1
+            yield '|'.join(bib + item), category
+
+
+def write_export(fh, system, rows, seed=0):
+    """
+    Writes synthetic Sierra export file
+    args:
+        fh: str, path of the export file
+        system: str, 'nyp' or 'bpl'
+        rows: int, number of rows
+        seed: int, random seed
+    returns:
+        Counter: number of rows by call number category
+    """
+    check_templates(SYSTEMS[system])
+    categories = Counter()
+    with open(fh, 'w', encoding='utf-8', newline='\n') as file:
+        file.write(SYSTEMS[system].header + '\n')
+        chunk = []
+        for line, category in generate_rows(system, rows, seed):
+            chunk.append(line)
+            categories[category] += 1
+            if len(chunk) >= WRITE_CHUNK:
+                file.write('\n'.join(chunk) + '\n')
+                chunk = []
+        if chunk:
+            file.write('\n'.join(chunk) + '\n')
+    return categories
+
+
+def export_path(system, rows, seed=0, directory=None):
+    if directory is None:
+        directory = os.path.join(os.path.dirname(__file__), 'exports')
+    return os.path.join(directory, f'{system}_export_{rows}_{seed}.txt')
+
+
+def ensure_export(system, rows, seed=0, directory=None, force=False):
+    """
+    Returns path to generated export, creating the file only when it does
+    not exist yet, so benchmarks share the same input
+    """
+    fh = export_path(system, rows, seed, directory)
+    if force or not os.path.isfile(fh):
+        os.makedirs(os.path.dirname(fh), exist_ok=True)
+        write_export(fh + '.tmp', system, rows, seed)
+        os.replace(fh + '.tmp', fh)
+    return fh
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('system', choices=sorted(SYSTEMS))
+    parser.add_argument(
+        'rows', type=int, nargs='?', default=SIZES[0],
+        help=f'number of rows, e.g. {", ".join(str(s) for s in SIZES)}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '-o', '--output',
+        help='export file path, by default benchmarks/exports/'
+             '{system}_export_{rows}_{seed}.txt, reused when present')
+    parser.add_argument(
+        '--force', action='store_true', help='regenerate existing export')
+    return parser.parse_args(args)
+
+
+def run(args):
+    options = parse_args(args)
+    start = time.perf_counter()
+    if options.output:
+        categories = write_export(
+            options.output, options.system, options.rows, options.seed)
+        fh = options.output
+        print(
+            f'{options.rows} rows in {time.perf_counter() - start:.1f} s, '
+            f'categories: {dict(sorted(categories.items(), key=str))}',
+            file=sys.stderr)
+    else:
+        fh = ensure_export(
+            options.system, options.rows, options.seed, force=options.force)
+    print(fh)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1:])
@@ -0,0 +1,258 @@
+"""
+In-memory stand-in for the Google Sheets v4 and Drive v3 surface used by
+adapters.gdrive: spreadsheets create/get/batchUpdate, values
+append/get/batchGet/update/batchUpdate and files get/update. Cell values
+are kept per tab, so data written by the cart publisher can be read back
+by the selection importer. Requests are counted together with bytes sent
+and received, and each request waits a configurable latency.
+
+usage:
+    backend = FakeGoogleBackend(latency=0.2)
+    backend.install()    # adapters.gdrive.service builds fake clients
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+
+
+A1_RANGE = re.compile(
+    r"^'?(?P<tab>.+?)'?(?:!(?P<col>[A-Z]+)(?P<row>\d*)"
+    r"(?::(?P<end_col>[A-Z]+)(?P<end_row>\d*))?)?$")
+
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def parse_range(a1_range):
+    """
+    returns:
+        tuple: (tab, first row index, first column index,
+                last row index or None, last column index or None)
+    """
+    match = A1_RANGE.match(a1_range)
+    tab = match.group('tab')
+    col = column_index(match.group('col')) if match.group('col') else 0
+    row = int(match.group('row')) - 1 if match.group('row') else 0
+    end_col = end_row = None
+    if match.group('end_col'):
+        end_col = column_index(match.group('end_col'))
+        if match.group('end_row'):
+            end_row = int(match.group('end_row')) - 1
+    return tab, row, col, end_row, end_col
+
+
+def size(data):
+    return len(json.dumps(data, default=str).encode())
+
+
+class FakeRequest:
+    def __init__(self, backend, method, body, handler):
+        self.backend = backend
+        self.method = method
+        self.body = body
+        self.handler = handler
+
+    def execute(self, num_retries=0):
+        return self.backend.execute(self.method, self.body, self.handler)
+
+
+class FakeGoogleBackend:
+    """
+    args:
+        latency: float, seconds each request takes
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.spreadsheets = {}
+        self.parents = {}
+        self.calls = Counter()
+        self.bytes_sent = Counter()
+        self.bytes_received = Counter()
+
+    def install(self):
+        """
+        Makes adapters.gdrive.service build fake API clients
+        """
+        from adapters.gdrive import service
+
+        service.clear_services()
+        service.build_service = lambda api, version, creds: FakeService(
+            self, api)
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls.clear()
+            self.bytes_sent.clear()
+            self.bytes_received.clear()
+
+    def execute(self, method, body, handler):
+        time.sleep(self.latency)
+        with self.lock:
+            response = handler()
+            self.calls[method] += 1
+            self.bytes_sent[method] += size(body) if body is not None else 0
+            self.bytes_received[method] += size(response)
+        return response
+
+    # spreadsheet storage
+
+    def tab(self, sheet_id, tab_name):
+        return self.spreadsheets[sheet_id]['tabs'][tab_name]
+
+    def write(self, sheet_id, a1_range, values):
+        tab, row, col, _, _ = parse_range(a1_range)
+        rows = self.tab(sheet_id, tab)
+        while len(rows) < row + len(values):
+            rows.append([])
+        for n, value_row in enumerate(values):
+            target = rows[row + n]
+            while len(target) < col + len(value_row):
+                target.append('')
+            for m, value in enumerate(value_row):
+                if value is not None:
+                    target[col + m] = '' if value == '' else str(value)
+        return {
+            'updatedRange': a1_range,
+            'updatedRows': len(values),
+            'updatedCells': sum(len(r) for r in values)}
+
+    def read(self, sheet_id, a1_range):
+        tab, row, col, end_row, end_col = parse_range(a1_range)
+        rows = self.tab(sheet_id, tab)
+        last = len(rows) if end_row is None else min(end_row + 1, len(rows))
+        values = []
+        for value_row in rows[row:last]:
+            cells = value_row[col:None if end_col is None else end_col + 1]
+            while cells and cells[-1] == '':
+                cells = cells[:-1]
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        value_range = {'range': a1_range, 'majorDimension': 'ROWS'}
+        if values:
+            value_range['values'] = values
+        return value_range
+
+
+class FakeService:
+    def __init__(self, backend, api):
+        self.backend = backend
+        self.api = api
+
+    def spreadsheets(self):
+        return FakeSpreadsheets(self.backend)
+
+    def files(self):
+        return FakeFiles(self.backend)
+
+
+class FakeSpreadsheets:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def values(self):
+        return FakeValues(self.backend)
+
+    def create(self, body):
+        def handler():
+            sheet_id = uuid.uuid4().hex
+            tabs = {
+                s['properties']['title']: [] for s in body.get('sheets', [])}
+            self.backend.spreadsheets[sheet_id] = {
+                'properties': body.get('properties', {}),
+                'sheets': body.get('sheets', []),
+                'tabs': tabs}
+            self.backend.parents[sheet_id] = ['root']
+            return {'spreadsheetId': sheet_id}
+        return FakeRequest(self.backend, 'spreadsheets.create', body, handler)
+
+    def get(self, spreadsheetId, ranges=None, includeGridData=False):
+        def handler():
+            sheets = self.backend.spreadsheets[spreadsheetId]['sheets']
+            return {'spreadsheetId': spreadsheetId, 'sheets': sheets}
+        return FakeRequest(self.backend, 'spreadsheets.get', None, handler)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def handler():
+            return {
+                'spreadsheetId': spreadsheetId,
+                'replies': [{} for _ in body.get('requests', [])]}
+        return FakeRequest(
+            self.backend, 'spreadsheets.batchUpdate', body, handler)
+
+
+class FakeValues:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        def handler():
+            tab = parse_range(range)[0]
+            row_no = len(self.backend.tab(spreadsheetId, tab)) + 1
+            updates = self.backend.write(
+                spreadsheetId, f"'{tab}'!A{row_no}", body['values'])
+            return {'spreadsheetId': spreadsheetId, 'updates': updates}
+        return FakeRequest(self.backend, 'values.append', body, handler)
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        def handler():
+            return self.backend.write(spreadsheetId, range, body['values'])
+        return FakeRequest(self.backend, 'values.update', body, handler)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def handler():
+            responses = [
+                self.backend.write(spreadsheetId, r['range'], r['values'])
+                for r in body['data']]
+            return {
+                'spreadsheetId': spreadsheetId,
+                'totalUpdatedRows': sum(
+                    r['updatedRows'] for r in responses),
+                'responses': responses}
+        return FakeRequest(self.backend, 'values.batchUpdate', body, handler)
+
+    def get(self, spreadsheetId, range, **kwargs):
+        def handler():
+            return self.backend.read(spreadsheetId, range)
+        return FakeRequest(self.backend, 'values.get', None, handler)
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        def handler():
+            return {
+                'spreadsheetId': spreadsheetId,
+                'valueRanges': [
+                    self.backend.read(spreadsheetId, r) for r in ranges]}
+        return FakeRequest(
+            self.backend, 'values.batchGet', {'ranges': ranges}, handler)
+
+
+class FakeFiles:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, fileId, fields=None):
+        def handler():
+            return {'id': fileId, 'parents': self.backend.parents[fileId]}
+        return FakeRequest(self.backend, 'files.get', None, handler)
+
+    def update(
+            self, fileId, addParents=None, removeParents=None, fields=None,
+            body=None):
+        def handler():
+            parents = [
+                p for p in self.backend.parents[fileId]
+                if p not in (removeParents or '').split(',')]
+            if addParents:
+                parents.extend(addParents.split(','))
+            self.backend.parents[fileId] = parents
+            return {'id': fileId, 'parents': parents}
+        return FakeRequest(self.backend, 'files.update', body, handler)
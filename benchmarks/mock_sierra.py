@@ -0,0 +1,254 @@
+"""
+Local stand-in for Sierra API used to benchmark SierraSession and hold
+placement without touching production. Serves:
+    POST   token
+    POST   patrons/{id}/holds/requests
+    GET    patrons/{id}/holds
+    GET    patrons/holds/{id}
+    DELETE patrons/holds/{id}
+    GET    bibs/{id}
+with configurable latency, rate of injected errors and 429 throttling.
+
+usage:
+    python benchmarks/mock_sierra.py [--port 8123] [--latency 0.05]
+        [--jitter 0.02] [--error-rate 0.01] [--throttle 50] [--seed 0]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+API_PATH = '/iii/sierra-api/v5/'
+
+
+class MockConfig:
+    """
+    args:
+        latency: float, mean response time in seconds
+        jitter: float, maximum deviation from mean latency in seconds
+        error_rate: float, share of hold requests denied with Sierra
+                    XCirc error (HTTP 500)
+        throttle: float, requests per second served before responding
+                  with 429; None disables throttling
+        token_ttl: int, access token lifetime in seconds
+        seed: int, random seed of latencies and injected errors
+    """
+
+    def __init__(
+            self, latency=0.05, jitter=0.0, error_rate=0.0, throttle=None,
+            token_ttl=3600, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.token_ttl = token_ttl
+        self.seed = seed
+
+
+class MockState:
+    def __init__(self, config):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.holds = {}
+        self.next_hold_id = 1
+        self.tokens = 0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(
+                -self.config.jitter, self.config.jitter)
+        return max(self.config.latency + jitter, 0)
+
+    def throttled(self):
+        if not self.config.throttle:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            return self.window_count > self.config.throttle
+
+    def fail(self):
+        with self.lock:
+            return self.random.random() < self.config.error_rate
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+
+class MockSierraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    routes = [
+        ('POST', re.compile(r'token$'), 'token'),
+        ('POST', re.compile(r'patrons/(\d+)/holds/requests$'), 'place_hold'),
+        ('GET', re.compile(r'patrons/(\d+)/holds$'), 'get_holds'),
+        ('GET', re.compile(r'patrons/holds/(\d+)$'), 'get_hold'),
+        ('DELETE', re.compile(r'patrons/holds/(\d+)$'), 'delete_hold'),
+        ('GET', re.compile(r'bibs/(\d+)$'), 'get_bib'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path, _, query = self.path.partition('?')
+        self.query = parse_qs(query)
+        if not path.startswith(API_PATH):
+            return self.respond(404, {'code': 107, 'name': 'Not found'})
+        path = path[len(API_PATH):]
+
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            state.count('unknown')
+            return self.respond(404, {'code': 107, 'name': 'Not found'})
+
+        state.count(name)
+        time.sleep(state.delay())
+        if name != 'token' and state.throttled():
+            state.count('throttled')
+            return self.respond(
+                429, {'code': 429, 'name': 'Too many requests'},
+                headers={'Retry-After': '1'})
+        return getattr(self, name)(state, body, *match.groups())
+
+    def respond(self, status, data=None, headers=None):
+        content = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if content:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def token(self, state, body):
+        with state.lock:
+            state.tokens += 1
+            token = f'mock-token-{state.tokens}'
+        self.respond(200, {
+            'access_token': token,
+            'token_type': 'bearer',
+            'expires_in': state.config.token_ttl})
+
+    def place_hold(self, state, body, pid):
+        if state.fail():
+            state.count('errors')
+            return self.respond(500, {
+                'code': 132, 'specificCode': 2, 'httpStatus': 500,
+                'name': 'XCirc error',
+                'description': 'XCirc error : Request denied'})
+        request = json.loads(body or b'{}')
+        with state.lock:
+            hid = state.next_hold_id
+            state.next_hold_id += 1
+            state.holds[hid] = {
+                'id': f'{API_PATH}patrons/holds/{hid}',
+                'record': f'{API_PATH}items/{request.get("recordNumber")}',
+                'patron': f'{API_PATH}patrons/{pid}',
+                'pickupLocation': {'code': request.get('pickupLocation')},
+                'recordType': 'i'}
+        self.respond(204)
+
+    def get_holds(self, state, body, pid):
+        limit = int(self.query.get('limit', ['50'])[0])
+        offset = int(self.query.get('offset', ['0'])[0])
+        with state.lock:
+            holds = [
+                hold for hold in state.holds.values()
+                if hold['patron'].endswith(f'/{pid}')]
+        if not holds:
+            return self.respond(404, {'code': 107, 'name': 'Not found'})
+        self.respond(200, {
+            'total': len(holds), 'start': offset,
+            'entries': holds[offset:offset + limit]})
+
+    def get_hold(self, state, body, hid):
+        hold = state.holds.get(int(hid))
+        if hold is None:
+            return self.respond(404, {'code': 107, 'name': 'Not found'})
+        self.respond(200, hold)
+
+    def delete_hold(self, state, body, hid):
+        with state.lock:
+            hold = state.holds.pop(int(hid), None)
+        if hold is None:
+            return self.respond(404, {'code': 107, 'name': 'Not found'})
+        self.respond(204)
+
+    def get_bib(self, state, body, bid):
+        self.respond(200, {
+            'id': bid, 'title': f'Title {bid}', 'author': 'Author',
+            'deleted': False, 'suppressed': False})
+
+
+def start_server(config=None, host='127.0.0.1', port=0):
+    """
+    Starts mock Sierra API in a background thread
+    returns:
+        tuple: (server, base url of the API)
+    """
+    server = ThreadingHTTPServer((host, port), MockSierraHandler)
+    server.daemon_threads = True
+    server.state = MockState(config or MockConfig())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}{API_PATH}'
+
+
+def parse_config(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle', type=float, default=None)
+    parser.add_argument('--token-ttl', type=int, default=3600)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(args)
+    config = MockConfig(
+        options.latency, options.jitter, options.error_rate,
+        options.throttle, options.token_ttl, options.seed)
+    return options, config
+
+
+if __name__ == '__main__':
+    import sys
+
+    options, config = parse_config(sys.argv[1:])
+    server, base_url = start_server(config, port=options.port)
+    print(f'mock Sierra API at {base_url} (ctrl+c to stop)')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,137 @@
+# Google API service clients
+
+import os
+import threading
+
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+import httplib2
+
+
+# static discovery documents named after API and its version,
+# for example sheets.v4.json; if present no network fetch is needed
+DISCOVERY_DIR = os.environ.get(
+    'REBALANCER_DISCOVERY_DIR',
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))), 'data', 'discovery'))
+
+_local = threading.local()
+_documents = {}
+_documents_lock = threading.Lock()
+# discovery documents fetched by this process: {(api, version): document}
+_fetched = {}
+_fetched_lock = threading.Lock()
+
+
+def load_discovery_document(api, version):
+    """
+    Reads static discovery document of the API, if one is available
+    returns:
+        document: str, discovery document or None
+    """
+    key = (api, version)
+    with _documents_lock:
+        if key not in _documents:
+            fh = os.path.join(DISCOVERY_DIR, f'{api}.{version}.json')
+            try:
+                with open(fh, 'r', encoding='utf-8') as file:
+                    _documents[key] = file.read()
+            except FileNotFoundError:
+                _documents[key] = None
+        return _documents[key]
+
+
+def fetch_discovery_document(creds, api, version):
+    """
+    Downloads discovery document of the API from Google discovery service,
+    trying the same public endpoints as googleapiclient.discovery.build
+    returns:
+        document: str, discovery document
+    raises:
+        googleapiclient.errors.HttpError: if no endpoint has the document
+    """
+    http = AuthorizedHttp(creds, http=httplib2.Http())
+    for uri in (discovery.DISCOVERY_URI, discovery.V2_DISCOVERY_URI):
+        url = uri.format(api=api, apiVersion=version)
+        response, content = http.request(url)
+        if response.status == 200:
+            return content.decode('utf-8')
+    raise HttpError(response, content, uri=url)
+
+
+def get_discovery_document(creds, api, version):
+    """
+    Returns static discovery document of the API, or one fetched once
+    per process if DISCOVERY_DIR has none; clients built for each thread
+    reuse it, so discovery is not requested again by every worker
+    returns:
+        document: str, discovery document
+    """
+    document = load_discovery_document(api, version)
+    if document is not None:
+        return document
+    key = (api, version)
+    with _fetched_lock:
+        if key not in _fetched:
+            _fetched[key] = fetch_discovery_document(creds, api, version)
+        return _fetched[key]
+
+
+def save_discovery_document(creds, api, version):
+    """
+    Stores discovery document of the API in DISCOVERY_DIR, so later clients
+    can be built offline
+    """
+    document = fetch_discovery_document(creds, api, version)
+    os.makedirs(DISCOVERY_DIR, exist_ok=True)
+    fh = os.path.join(DISCOVERY_DIR, f'{api}.{version}.json')
+    with open(fh, 'w', encoding='utf-8') as file:
+        file.write(document)
+    with _documents_lock:
+        _documents.pop((api, version), None)
+
+
+def build_service(api, version, creds):
+    return discovery.build_from_document(
+        get_discovery_document(creds, api, version), credentials=creds)
+
+
+def get_service(api, version, creds):
+    """
+    Returns API client for the credentials, built once per thread and
+    reused afterwards; httplib2 transports are not thread-safe, so threads
+    do not share clients. Worker threads of each publish build their own
+    clients, from the discovery document read or fetched once per process
+    (see get_discovery_document)
+    args:
+        api: str, API name, 'sheets' or 'drive'
+        version: str, API version
+        creds: instance of google.oauth2.credentials.Credentials class
+    returns:
+        service: googleapiclient.discovery.Resource instance
+    """
+    try:
+        services = _local.services
+    except AttributeError:
+        services = _local.services = {}
+
+    key = (api, version, id(creds))
+    try:
+        owner, service = services[key]
+        if owner is creds:
+            return service
+    except KeyError:
+        pass
+
+    service = build_service(api, version, creds)
+    services[key] = (creds, service)
+    return service
+
+
+def clear_services():
+    """
+    Drops API clients cached by the calling thread
+    """
+    _local.services = {}
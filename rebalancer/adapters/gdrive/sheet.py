@@ -1,18 +1,46 @@
 import json
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from googleapiclient import discovery
+from googleapiclient.errors import HttpError
 
 
+from adapters.gdrive.service import get_service
 from adapters.gdrive.sheet_templates import (
     shopping_cart_data_tab_template,
     shopping_cart_validation_tab_template,
     cat_headings_formating
 )
+from adapters.pool import iter_results
+
+
+DATA_TAB_HEADER = [
+    'category', 'author', 'title', 'call number',
+    'pub date', 'link', 'item #', 'new branch'
+]
+VALIDATION_TAB = 'branch codes'
+VALIDATION_TAB_HEADER = ['branch codes']
+
+# bounds of a single values.batchUpdate payload; Google recommends
+# request bodies of at most 2 MB
+MAX_PAYLOAD_ROWS = 10000
+MAX_PAYLOAD_BYTES = 1000000
+
+WRITE_WORKERS = 4
+WRITE_RETRIES = 4
+WRITE_BACKOFF = 1.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def tab_ids(tabs):
+    return {name: tab_id for tab_id, name in enumerate(tabs)}
 
 
 def create_sheet(creds, sheet_name, tabs=[]):
     """
-    creates google spreadsheet in specified folder
+    creates google spreadsheet in specified folder;
+    each tab's sheet id is its position on the tabs list (see tab_ids)
     args:
         creds: instance of google.oauth2.credentials.Credentials class
         sheet name: string, name of Google sheet
@@ -21,12 +49,12 @@ def create_sheet(creds, sheet_name, tabs=[]):
         sheet_id: string, id of newly created Google Sheet
     """
 
-    service = discovery.build('sheets', 'v4', credentials=creds)
+    service = get_service('sheets', 'v4', creds)
     sheet_props = []
-    for name in tabs:
+    for name, tab_id in tab_ids(tabs).items():
         sheet_props.append(
             dict(
-                properties=dict(title=name)))
+                properties=dict(title=name, sheetId=tab_id)))
 
     spreadsheet_body = {
         'sheets': sheet_props,
@@ -61,7 +89,7 @@ def file2folder(creds, parent_id, file_id):
         boolean: True if operation successful, False if not
     """
 
-    service = discovery.build('drive', 'v3', credentials=creds)
+    service = get_service('drive', 'v3', creds)
     file = service.files().get(
         fileId=file_id,
         fields='parents').execute()
@@ -83,96 +111,8 @@ def file2folder(creds, parent_id, file_id):
         return False
 
 
-def append2sheet(creds, sheet_id, tab_name, data):
-    """
-    appends data to Google sheet with provided id
-    args:
-        creds: instance of google.oauth2.credentials.Credentials class
-        sheet_id: string
-        data: list of lists for each row
-    returns:
-        results: dictionary, Google API response
-    """
-
-    service = discovery.build('sheets', 'v4', credentials=creds)
-    value_input_option = 'USER_ENTERED'
-    body = {
-        'values': data,
-    }
-    result = service.spreadsheets().values().append(
-        spreadsheetId=sheet_id, range=tab_name,
-        valueInputOption=value_input_option, body=body).execute()
-
-    return result
-
-
-def customize_shopping_sheet(creds, sheet_id, tabs, branch_count):
-    """
-    applies structure and formatting to the shopping sheet
-    args:
-        creds: instance of google.oauth2.credentials.Credentials class
-        sheet_id: string, Google Sheet id
-    """
-
-    service = discovery.build('sheets', 'v4', credentials=creds)
-
-    data_header = [
-        'category', 'author', 'title', 'call number',
-        'pub date', 'link', 'item #', 'new branch'
-    ]
-    location_header = ['branch codes']
-
-    value_input_option = 'RAW'
-
-    # create tabs
-    for tab in tabs:
-        if tab == 'branch codes':
-            body = {'values': [location_header]}
-        else:
-            body = {'values': [data_header]}
-
-        service.spreadsheets().values().append(
-            spreadsheetId=sheet_id, range=tab,
-            valueInputOption=value_input_option, body=body).execute()
-
-    # get tab id and loop
-    request = service.spreadsheets().get(
-        spreadsheetId=sheet_id, ranges=tabs, includeGridData=False)
-    res = request.execute()
-    sheet_tabs = [
-        (s['properties']['title'], s['properties']['sheetId']) for s in res['sheets']]
-
-    # customize the look & behavior of each sheet
-    for tab_name, tab_id in sheet_tabs:
-        if tab_name == 'branch codes':
-            request_body = shopping_cart_validation_tab_template(tab_id)
-        else:
-            request_body = shopping_cart_data_tab_template(
-                tab_id, branch_count)
-
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=sheet_id,
-            body=request_body).execute()
-
-
-def update_categories_formatting(creds, sheet_id, tabs, row_nos):
-    service = discovery.build('sheets', 'v4', credentials=creds)
-    request = service.spreadsheets().get(
-        spreadsheetId=sheet_id, ranges=tabs, includeGridData=False)
-    response = request.execute()
-    tab_ids = [
-        sheet['properties']['sheetId'] for sheet in response['sheets']]
-
-    # customize the headings of each sheet
-    for tab_id in tab_ids:
-        request_body = cat_headings_formating(tab_id, row_nos)
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=sheet_id,
-            body=request_body).execute()
-
-
 def get_values(creds, sheet_id, values_range):
-    service = discovery.build('sheets', 'v4', credentials=creds)
+    service = get_service('sheets', 'v4', creds)
     sheet = service.spreadsheets()
 
     result = sheet.values().get(
@@ -184,10 +124,161 @@ def get_values(creds, sheet_id, values_range):
 
 
 def get_properties(creds, sheet_id, values_range):
-    service = discovery.build('sheets', 'v4', credentials=creds)
+    service = get_service('sheets', 'v4', creds)
     includeGridData = True
     request = service.spreadsheets().get(
         spreadsheetId=sheet_id, ranges=values_range,
         includeGridData=includeGridData)
     response = request.execute()
     return response
+
+
+def iter_value_payloads(
+        rows, max_rows=MAX_PAYLOAD_ROWS, max_bytes=MAX_PAYLOAD_BYTES):
+    """
+    Splits stream of rows into values.batchUpdate payloads bounded by row
+    count and approximate JSON size. Each tab's rows are written one after
+    another starting at A1 and consecutive rows of a tab in the payload
+    share an explicit A1 range, so payloads can be sent in any order.
+    args:
+        rows: iterable of tuples, (tab name, list of row values)
+        max_rows: int, maximum number of rows in a payload
+        max_bytes: int, maximum approximate size of a payload
+    yields:
+        payload: list of value ranges
+    """
+    next_row_no = {}
+    payload = []
+    value_range = None
+    current_tab = None
+    row_count = 0
+    byte_count = 0
+    for tab_name, row in rows:
+        size = len(json.dumps(row, default=str)) + 1
+        if payload and (
+                row_count + 1 > max_rows or byte_count + size > max_bytes):
+            yield payload
+            payload, value_range, row_count, byte_count = [], None, 0, 0
+
+        row_no = next_row_no.get(tab_name, 1)
+        if value_range is None or current_tab != tab_name:
+            value_range = {'range': f"'{tab_name}'!A{row_no}", 'values': []}
+            payload.append(value_range)
+            current_tab = tab_name
+        value_range['values'].append(row)
+        next_row_no[tab_name] = row_no + 1
+        row_count += 1
+        byte_count += size
+
+    if payload:
+        yield payload
+
+
+def is_retryable(exc):
+    if isinstance(exc, HttpError):
+        return exc.resp.status in RETRY_STATUSES
+    return isinstance(exc, (ConnectionError, TimeoutError, socket.timeout))
+
+
+def write_payload(
+        creds, sheet_id, payload, retries=WRITE_RETRIES,
+        backoff=WRITE_BACKOFF):
+    """
+    Writes a payload of value ranges, retrying it on rate limit, server
+    and connection errors with exponential backoff
+    returns:
+        row_count: int, number of rows written
+    """
+    service = get_service('sheets', 'v4', creds)
+    body = {'valueInputOption': 'USER_ENTERED', 'data': payload}
+    attempt = 0
+    while True:
+        try:
+            service.spreadsheets().values().batchUpdate(
+                spreadsheetId=sheet_id, body=body).execute()
+            return sum(len(r['values']) for r in payload)
+        except Exception as exc:
+            if attempt >= retries or not is_retryable(exc):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            attempt += 1
+
+
+def write_values(
+        creds, sheet_id, rows, workers=WRITE_WORKERS, progress=None,
+        max_rows=MAX_PAYLOAD_ROWS, max_bytes=MAX_PAYLOAD_BYTES):
+    """
+    Streams rows to the spreadsheet in size-bounded payloads, written
+    concurrently by a pool of threads; each payload is retried on its own.
+    At most twice as many payloads as workers are held in memory.
+    args:
+        creds: instance of google.oauth2.credentials.Credentials class
+        sheet_id: string, Google Sheet id
+        rows: iterable of tuples, (tab name, list of row values)
+        workers: int, number of concurrent writers
+        progress: callable receiving total number of rows written so far
+    returns:
+        written: int, number of rows written
+    """
+    written = 0
+    calls = (
+        (write_payload, (creds, sheet_id, payload))
+        for payload in iter_value_payloads(rows, max_rows, max_bytes))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for count in iter_results(executor, calls, workers * 2):
+            written += count
+            if progress is not None:
+                progress(written)
+    return written
+
+
+def publish_cart(
+        creds, sheet_id, tabs, branch_count, rows, workers=WRITE_WORKERS,
+        progress=None):
+    """
+    Writes headers and streamed rows of all tabs of the shopping sheet
+    (see write_values), then applies structure, validation and category
+    heading formats of all tabs in a single spreadsheets.batchUpdate
+    args:
+        creds: instance of google.oauth2.credentials.Credentials class
+        sheet_id: string, Google Sheet id
+        tabs: list, tabs of the spreadsheet in order they were created
+        branch_count: int, number of branches in the validation tab
+        rows: iterable of tuples, (tab name, row values, is heading)
+        workers: int, number of concurrent writers
+        progress: callable receiving total number of rows written so far
+    """
+    cat_heading_rows = {tab_name: [] for tab_name in tabs}
+
+    def value_rows():
+        for tab_name in tabs:
+            if tab_name == VALIDATION_TAB:
+                yield tab_name, VALIDATION_TAB_HEADER
+            else:
+                yield tab_name, DATA_TAB_HEADER
+        row_counts = dict.fromkeys(tabs, 0)
+        for tab_name, row, heading in rows:
+            row_counts[tab_name] += 1
+            if heading:
+                cat_heading_rows[tab_name].append(row_counts[tab_name])
+            yield tab_name, row
+
+    write_values(creds, sheet_id, value_rows(), workers, progress)
+
+    requests = []
+    for tab_name, tab_id in tab_ids(tabs).items():
+        if tab_name == VALIDATION_TAB:
+            template = shopping_cart_validation_tab_template(tab_id)
+        else:
+            template = shopping_cart_data_tab_template(tab_id, branch_count)
+        requests.extend(template['requests'])
+        requests.extend(cat_headings_formating(
+            tab_id, cat_heading_rows[tab_name])['requests'])
+
+    service = get_service('sheets', 'v4', creds)
+    service.spreadsheets().batchUpdate(
+        spreadsheetId=sheet_id,
+        body={
+            'requests': requests,
+            'includeSpreadsheetInResponse': False,
+            'responseIncludeGridData': False}).execute()
@@ -0,0 +1,46 @@
+# Bounded submission of calls to concurrent.futures executors
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+def iter_results(executor, calls, max_pending, ordered=False):
+    """
+    Submits calls to the executor keeping at most max_pending of them
+    in flight, so memory use does not grow with the number of calls.
+    Calls not started yet are cancelled when a call raises or the consumer
+    stops iterating.
+    args:
+        executor: concurrent.futures.Executor instance
+        calls: iterable of tuples, (callable, args)
+        max_pending: int, number of calls in flight
+        ordered: boolean, yield results in order of calls instead of
+                 order of completion
+    yields:
+        results of calls
+    """
+    max_pending = max(max_pending, 1)
+    pending = deque() if ordered else set()
+
+    def drain(limit):
+        nonlocal pending
+        while len(pending) > limit:
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    try:
+        for func, args in calls:
+            future = executor.submit(func, *args)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+            yield from drain(max_pending - 1)
+        yield from drain(0)
+    finally:
+        for future in pending:
+            future.cancel()
@@ -1,56 +1,99 @@
-from googleapiclient import discovery
-
 from adapters.gdrive.credentials import get_access_token
-from data.branches import BRANCH_CODES
-from datastore import Hold, session_scope
-from datastore_transactions import retrieve_record, update_record
+from adapters.gdrive.service import get_service
+from datastore import session_scope, Branch, Cart
+from datastore_transactions import (
+    create_code_idx,
+    retrieve_record,
+    set_items_destination)
+from errors import RebalancerError
+
+
+# shopping cart columns with item number and staff selected branch
+SELECTION_COLUMNS = 'G2:H'
+
+
+def get_selections(creds, sheet_id, tabs):
+    """
+    Reads item number and new branch columns of all tabs of the shopping
+    cart with a single values.batchGet request
+    args:
+        creds: instance of google.oauth2.credentials.Credentials class
+        sheet_id: str, google sheet id
+        tabs: list of str, list of names of google sheets in the spreadsheet
+    returns:
+        rows: list of lists, [item #, new branch] values of each row
+    """
+    service = get_service('sheets', 'v4', creds)
+    response = service.spreadsheets().values().batchGet(
+        spreadsheetId=sheet_id,
+        ranges=[f"'{tab}'!{SELECTION_COLUMNS}" for tab in tabs],
+        majorDimension='ROWS').execute()
+
+    rows = []
+    for value_range in response.get('valueRanges', []):
+        rows.extend(value_range.get('values', []))
+    return rows
+
+
+def parse_selections(rows, branch_idx):
+    """
+    Maps staff selections to destination branches; rows without item
+    number (section headings) are skipped and items with no branch
+    selected are assigned to the branch without a code
+    args:
+        rows: list of lists, [item #, new branch] values of each row
+        branch_idx: dict, branch code: branch.rid
+    returns:
+        selections: list of tuples, (item_id, dst_branch_id)
+    """
+    selections = []
+    unknown_codes = set()
+    for row in rows:
+        try:
+            iid = int(row[0])
+        except (IndexError, ValueError):
+            # row with no data (example a section heading row)
+            continue
+
+        try:
+            loc_code = row[1].strip() or None
+        except IndexError:
+            loc_code = None
+
+        try:
+            selections.append((iid, branch_idx[loc_code]))
+        except KeyError:
+            unknown_codes.add(loc_code)
+
+    if unknown_codes:
+        raise RebalancerError(
+            f'Unknown branch codes in shopping cart: '
+            f'{", ".join(sorted(unknown_codes))}')
+    return selections
 
 
 def set_new_branch(tabs, sheet_id):
     """
     Parses shopping cart with provided google sheet id and
-    updates dst_branch_id column in hold table of the datastore based on staff
-    selection
+    updates dst_branch_id column of the cart's items in overflow_item table
+    of the datastore based on staff selection; all selections are applied
+    in a single transaction
     args:
         tabs: list of str, list of names of google sheets in the spreadsheet
         sheet_id: str, google sheet id
+    returns:
+        int: number of items with recorded selection
     """
     creds = get_access_token()
-    service = discovery.build('sheets', 'v4', credentials=creds)
-    sheet = service.spreadsheets()
-    for tab in tabs:
-        results = sheet.values().get(
-            spreadsheetId=sheet_id,
-            range=tab).execute()
-
-        values = results.get('values', [])
-        for row in values[1:]:
-            iid = None
-            try:
-                iid = int(row[6])
-
-                # find row with actual data
-                if iid:
-                    try:
-                        loc_code = row[7].strip()
-                        dst_branch_id = BRANCH_CODES[loc_code][0]
-                    except IndexError:
-                        dst_branch_id = BRANCH_CODES[None][0]
-                    # print(f'dst_id:{dst_branch_id}')
-            except IndexError:
-                # row with no data (example a section heading row)
-                pass
-            except ValueError:
-                # log as error or warning
-                pass
-
-            if iid is not None:
-                with session_scope() as session:
-                    hold_rec = retrieve_record(
-                        session, Hold, item_id=iid,
-                        outstanding=False, issued=False)
-                    if hold_rec:
-                        update_record(
-                            session, Hold, hold_rec.sid,
-                            dst_branch_id=dst_branch_id,
-                            issued=True)
+    rows = get_selections(creds, sheet_id, tabs)
+
+    with session_scope() as session:
+        cart = retrieve_record(session, Cart, shopping_cart_id=sheet_id)
+        if cart is None:
+            raise RebalancerError(f'Unknown shopping cart {sheet_id}')
+        branch_idx = create_code_idx(
+            session, Branch, system_id=cart.system_id)
+        selections = parse_selections(rows, branch_idx)
+        set_items_destination(session, cart.rid, selections)
+
+    return len(selections)
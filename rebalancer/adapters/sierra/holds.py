@@ -0,0 +1,266 @@
+# Concurrent Sierra hold placement
+
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import Timeout
+
+
+from adapters.pool import iter_results
+
+
+# number of hold requests in flight
+HOLD_WORKERS = 8
+# maximum number of hold requests per second sent to Sierra API
+HOLD_RATE = 10
+# attempts repeated after transient failures, with exponential backoff
+HOLD_RETRIES = 3
+HOLD_BACKOFF = 1.0
+# Sierra reports denied holds with 500, those are not retried
+RETRY_STATUSES = {429, 502, 503, 504}
+TRANSIENT_ERRORS = (
+    RequestsConnectionError, Timeout, ConnectionError, TimeoutError)
+
+
+HoldOutcome = namedtuple(
+    'HoldOutcome', 'item_id, pickup_location, response, error, attempts')
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket spacing out calls to at most rate per second,
+    with bursts of up to burst calls
+
+    args:
+        rate: float, calls per second; None or 0 disables limiting
+        burst: int, number of calls allowed back to back
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call is allowed
+        """
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.burst,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            self.sleep(delay)
+
+
+def is_transient(response, error):
+    if error is not None:
+        return isinstance(error, TRANSIENT_ERRORS)
+    return response.status_code in RETRY_STATUSES
+
+
+def retry_delay(response, backoff, attempt):
+    delay = backoff * 2 ** (attempt - 1)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers['Retry-After']))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return delay
+
+
+def send_with_retries(request, limiter, retries, backoff):
+    """
+    Sends rate limited API request, repeating it after transient failures
+    (throttling, gateway errors, connection errors and timeouts)
+    args:
+        request: callable returning requests.models.Response instance
+        limiter: RateLimiter instance
+        retries: int, number of repeated attempts
+        backoff: float, delay in seconds before the first repeated attempt
+    returns:
+        tuple: (response or None, raised exception or None, attempts)
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        limiter.acquire()
+        response = error = None
+        try:
+            response = request()
+        except Exception as exc:
+            error = exc
+        if attempt > retries or not is_transient(response, error):
+            return response, error, attempt
+        time.sleep(retry_delay(response, backoff, attempt))
+
+
+def place_hold(
+        ils_session, account_id, item_id, pickup_location, limiter,
+        retries=HOLD_RETRIES, backoff=HOLD_BACKOFF):
+    """
+    Places a hold, repeating the request after transient failures
+    returns:
+        HoldOutcome instance
+    """
+    response, error, attempts = send_with_retries(
+        lambda: ils_session.hold_place_on_item(
+            account_id, item_id, pickup_location),
+        limiter, retries, backoff)
+    return HoldOutcome(item_id, pickup_location, response, error, attempts)
+
+
+def iter_completed(calls, workers):
+    """
+    Runs calls in a pool of threads keeping at most twice as many calls
+    as workers in flight
+    args:
+        calls: iterable of tuples, (callable, args)
+        workers: int, number of threads
+    yields:
+        results of calls in order of completion
+    """
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        yield from iter_results(executor, calls, workers * 2)
+
+
+def outcome_details(outcome):
+    """
+    Extracts HTTP status and Sierra error of the hold outcome
+    returns:
+        tuple: (succeeded, status_code, error_code, error_description)
+    """
+    if outcome.error is not None:
+        return False, None, None, repr(outcome.error)[:500]
+    response = outcome.response
+    if 200 <= response.status_code < 300:
+        return True, response.status_code, None, None
+    try:
+        error = response.json()
+        error_code = error.get('code')
+        description = error.get('description') or error.get('name')
+    except (AttributeError, ValueError):
+        error_code = None
+        description = response.text
+    return False, response.status_code, error_code, (description or '')[:500]
+
+
+def place_holds(
+        ils_session, account_id, holds, workers=HOLD_WORKERS,
+        rate=HOLD_RATE, retries=HOLD_RETRIES, backoff=HOLD_BACKOFF):
+    """
+    Places item holds concurrently through a pool of threads sharing
+    the Sierra session; requests are spaced out by a rate limiter and
+    the number of requests in flight is bounded by workers
+    args:
+        ils_session: SierraSession instance
+        account_id: int, patron account the holds are placed on
+        holds: iterable of tuples, (item_id, pickup location code)
+        workers: int, maximum number of concurrent requests
+        rate: float, maximum number of requests per second
+        retries: int, number of repeated attempts after transient failures
+        backoff: float, delay in seconds before the first repeated attempt
+    yields:
+        HoldOutcome: in order of completion; failed requests carry
+                     the raised exception as error
+    """
+    limiter = RateLimiter(rate)
+    calls = (
+        (place_hold, (
+            ils_session, account_id, item_id, pickup_location, limiter,
+            retries, backoff))
+        for item_id, pickup_location in holds)
+    yield from iter_completed(calls, workers)
+
+
+def hold_id(hold):
+    """
+    Extracts hold number from hold record's link
+    args:
+        hold: dict, Sierra API hold resource
+    returns:
+        int
+    """
+    return int(str(hold['id']).rstrip('/').rsplit('/', 1)[-1])
+
+
+def hold_item_id(hold):
+    """
+    Extracts item number from the record link of an item-level hold
+    args:
+        hold: dict, Sierra API hold resource
+    returns:
+        int or None for holds on other records (bibs, volumes)
+    """
+    kind, _, number = str(hold.get('record', '')).rstrip('/').rpartition('/')
+    if kind.endswith('/items') and number.isdigit():
+        return int(number)
+
+
+def delete_hold(ils_session, hid, limiter, retries, backoff):
+    response, error, attempts = send_with_retries(
+        lambda: ils_session.hold_delete_by_id(hid),
+        limiter, retries, backoff)
+    return hid, response, error
+
+
+def delete_holds(
+        ils_session, hids, workers=HOLD_WORKERS, rate=HOLD_RATE,
+        retries=HOLD_RETRIES, backoff=HOLD_BACKOFF, progress=None):
+    """
+    Deletes holds concurrently; holds already gone (404) count as deleted
+    args:
+        ils_session: SierraSession instance
+        hids: iterable of int, hold numbers
+        workers: int, maximum number of concurrent requests
+        rate: float, maximum number of requests per second
+        retries: int, number of repeated attempts after transient failures
+        backoff: float, delay in seconds before the first repeated attempt
+        progress: callable receiving numbers of deleted and failed holds
+    returns:
+        tuple: (number of deleted holds,
+                list of (hold number, status code or exception) failures)
+    """
+    limiter = RateLimiter(rate)
+    calls = (
+        (delete_hold, (ils_session, hid, limiter, retries, backoff))
+        for hid in hids)
+    deleted = 0
+    failures = []
+    for hid, response, error in iter_completed(calls, workers):
+        if error is not None:
+            failures.append((hid, error))
+        elif response.status_code in (200, 204, 404):
+            deleted += 1
+        else:
+            failures.append((hid, response.status_code))
+        if progress is not None:
+            progress(deleted, len(failures))
+    return deleted, failures
+
+
+def delete_account_holds(ils_session, pid, progress=None, **kwargs):
+    """
+    Deletes all holds of the account one by one, with concurrent requests.
+    Hold numbers are collected before deleting, since removing holds
+    shifts pages of the account's hold list.
+    returns:
+        tuple: (number of deleted holds, list of failures), see delete_holds
+    """
+    hids = [hold_id(hold) for hold in ils_session.hold_iter_all(pid)]
+    return delete_holds(ils_session, hids, progress=progress, **kwargs)
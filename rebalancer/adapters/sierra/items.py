@@ -0,0 +1,75 @@
+# Bulk Sierra item status checks
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# number of item ids in a single GET /items request; ids are sent in the
+# query string (up to 8 digits plus an encoded comma each, ~11 bytes), so
+# 500 ids keep the request line under the common 8 KB server limit
+ITEMS_BATCH_SIZE = 500
+ITEMS_WORKERS = 4
+AVAILABLE_STATUS = '-'
+
+
+def is_available(item):
+    """
+    Determines if item can be rebalanced: it is not deleted nor suppressed,
+    has available status, is not checked out and has no holds placed on it
+    (holdCount field of the item resource)
+    args:
+        item: dict, Sierra API item resource
+    returns:
+        boolean
+    """
+    if item.get('deleted') or item.get('suppressed'):
+        return False
+    if item.get('holdCount'):
+        return False
+    status = item.get('status') or {}
+    return status.get('code') == AVAILABLE_STATUS and 'duedate' not in status
+
+
+def get_items_batch(ils_session, iids):
+    """
+    Retrieves a batch of items; Sierra API responds with 404 when none
+    of the items is found
+    returns:
+        items: list of dicts, Sierra API item resources
+    """
+    response = ils_session.items_get_by_ids(iids)
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    return response.json().get('entries', [])
+
+
+def find_unavailable_items(
+        ils_session, iids, batch_size=ITEMS_BATCH_SIZE,
+        workers=ITEMS_WORKERS):
+    """
+    Checks status of items in batches requested concurrently. Items
+    missing from responses are reported separately; their status is
+    unknown, so they are not counted as unavailable
+    args:
+        ils_session: SierraSession instance
+        iids: list of int, Sierra item numbers
+        batch_size: int, number of items in a single request
+        workers: int, number of concurrent requests
+    returns:
+        tuple: (unavailable, missing) sets of int, numbers of items
+               returned as not available and numbers of items not returned
+    """
+    iids = list(dict.fromkeys(iids))
+    batches = [
+        iids[n:n + batch_size] for n in range(0, len(iids), batch_size)]
+    returned = set()
+    unavailable = set()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for items in executor.map(
+                lambda batch: get_items_batch(ils_session, batch), batches):
+            for item in items:
+                iid = int(item['id'])
+                returned.add(iid)
+                if not is_available(item):
+                    unavailable.add(iid)
+    return unavailable, set(iids) - returned
@@ -1,14 +1,57 @@
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
 from datetime import date, datetime, timedelta
 from urllib.parse import urljoin
 
 from oauthlib.oauth2 import BackendApplicationClient
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2.rfc6749.errors import MissingTokenError
 from requests.exceptions import ConnectionError
+from urllib3.util.retry import Retry
 
 
 TIMEOUT = 5
+# seconds before token expiration when a new token is requested
+TOKEN_EXPIRY_MARGIN = 60
+HOLDS_PAGE_SIZE = 250
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# POST is left out: Sierra reports denied hold requests with 500
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'DELETE'])
+
+
+def retry_policy(
+        total, backoff_factor=RETRY_BACKOFF_FACTOR,
+        statuses=RETRY_STATUSES, methods=RETRY_METHODS):
+    """
+    Creates urllib3 retry policy for 429 and 5xx responses that honours
+    Retry-After header; compatible with urllib3 before and after
+    method_whitelist was renamed to allowed_methods
+    args:
+        total: int, maximum number of retries
+        backoff_factor: float, exponential backoff factor in seconds
+        statuses: iterable of int, HTTP statuses to retry
+        methods: iterable of str, HTTP methods to retry
+    returns:
+        urllib3.util.retry.Retry instance
+    """
+    kwargs = dict(
+        total=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=frozenset(statuses),
+        respect_retry_after_header=True,
+        raise_on_status=False)
+    if 'allowed_methods' in inspect.signature(Retry.__init__).parameters:
+        kwargs['allowed_methods'] = frozenset(methods)
+    else:
+        kwargs['method_whitelist'] = frozenset(methods)
+    return Retry(**kwargs)
 
 
 class SierraSession(OAuth2Session):
@@ -19,6 +62,11 @@ class SierraSession(OAuth2Session):
         base_url: str, base url of your library Sierra API
         key: str, Sierra API client key
         secret: str, Sierra API client secret
+        pool_connections: int, number of connection pools to cache
+        pool_maxsize: int, maximum number of kept-alive connections
+                      in a pool, should match number of worker threads
+        retries: int or urllib3 Retry instance, opt-in retry policy for
+                 429 and 5xx responses (see retry_policy); None disables
 
     Sierra API documentation:
         https://techdocs.iii.com/sierraapi/Content/titlePage.htm
@@ -35,9 +83,16 @@ class SierraSession(OAuth2Session):
 
     Session sets default response content type to JSON.
 
+    Access token is renewed shortly before it expires (and once after
+    a 401 response), so the session can be used by long-running jobs.
+    Token renewal is serialized with a lock, and a single session can be
+    shared by worker threads.
+
     """
 
-    def __init__(self, base_url, key, secret):
+    def __init__(
+            self, base_url, key, secret, pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=POOL_MAXSIZE, retries=None):
 
         if type(base_url) is not str:
             raise TypeError('Sierra API base URL is missing')
@@ -51,9 +106,20 @@ class SierraSession(OAuth2Session):
         self.secret = secret
         self.token_url = urljoin(self.base_url, 'token')
 
+        self._token_lock = threading.RLock()
+
         client = BackendApplicationClient(client_id=key)
         OAuth2Session.__init__(self, client=client)
 
+        if isinstance(retries, int):
+            retries = retry_policy(retries)
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retries if retries is not None else 0)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
         headers = {
             "User-Agent": f"BookOps-Sierra-API-wrapper",
             "Accept": "application/json"}
@@ -85,11 +151,45 @@ class SierraSession(OAuth2Session):
         Uses basic authorization pattern to fetch access token from Sierra API.
         Updates session header with bearer authentication
         """
-        auth = HTTPBasicAuth(self.key, self.secret)
-        self.fetch_token(token_url=self.token_url, auth=auth)
-        if self.access_token is not None:
-            headers = {"Authorization": f"Bearer {self.access_token}"}
-            self.headers.update(headers)
+        with self._token_lock:
+            auth = HTTPBasicAuth(self.key, self.secret)
+            self.fetch_token(token_url=self.token_url, auth=auth)
+            if self.access_token is not None:
+                headers = {"Authorization": f"Bearer {self.access_token}"}
+                self.headers.update(headers)
+
+    def token_expires_soon(self, margin=TOKEN_EXPIRY_MARGIN):
+        expires_at = (self.token or {}).get('expires_at')
+        if expires_at is None:
+            return False
+        return float(expires_at) - margin <= time.time()
+
+    def refresh_token_if_needed(self, stale_token=None):
+        """
+        Fetches new access token if the current one is about to expire or
+        is the stale token rejected by the API; threads racing to renew
+        the token wait for the first one to do so
+        """
+        with self._token_lock:
+            if stale_token is not None:
+                if self.access_token == stale_token:
+                    self.get_token()
+            elif self.token_expires_soon():
+                self.get_token()
+
+    def request(self, method, url, *args, **kwargs):
+        if url == self.token_url:
+            kwargs['withhold_token'] = True
+            return OAuth2Session.request(self, method, url, *args, **kwargs)
+
+        self.refresh_token_if_needed()
+        token = self.access_token
+        response = OAuth2Session.request(self, method, url, *args, **kwargs)
+        if response.status_code == 401:
+            self.refresh_token_if_needed(stale_token=token)
+            response = OAuth2Session.request(
+                self, method, url, *args, **kwargs)
+        return response
 
     def bib_get_by_id(self, bid, fields='default', response_format='json'):
         """
@@ -116,6 +216,42 @@ class SierraSession(OAuth2Session):
 
         return response
 
+    def items_get_by_ids(
+            self, iids, fields='id,status,deleted,suppressed,holdCount',
+            limit=None,
+            response_format='json'):
+        """
+        Makes GET /items request - for item resources by their ids
+        args:
+            iids: list of int, Sierra item numbers (omit leading i and
+                  last character)
+            fields: str, comma-delimited list of fields to retrieve
+            limit: int, maximum number of results, defaults to number
+                   of requested items
+            response_format: str, default 'json', available 'xml'
+        returns:
+            response: requests.models.Response instance
+        """
+        if not all(isinstance(iid, int) for iid in iids):
+            raise TypeError('item numbers (iids) must be integers')
+        if not isinstance(fields, str):
+            raise TypeError('fields paramater must be a string')
+
+        url = urljoin(self.base_url, 'items')
+
+        payload = {
+            "id": ','.join(str(iid) for iid in iids),
+            "fields": fields,
+            "limit": limit or len(iids)
+        }
+
+        request_headers = self._set_response_format_header(response_format)
+
+        response = self.get(
+            url, params=payload, headers=request_headers, timeout=TIMEOUT)
+
+        return response
+
     def hold_place_on_item(
             self, pid, iid, pickup_location, needed_by='',
             note='', response_format='json'):
@@ -276,6 +412,49 @@ class SierraSession(OAuth2Session):
 
         return response
 
+    def hold_iter_all(self, pid, page_size=HOLDS_PAGE_SIZE, fields='default'):
+        """
+        Pages through all holds of the account until the reported total
+        (or a short page when total is missing); the next page is requested
+        while the current one is consumed
+        GET /patrons/{id}/holds
+
+        args:
+            pid: int, patron id
+            page_size: int, number of holds requested at a time
+            fields: str, comma-delimited list of fields to retrieve
+        yields:
+            hold: dict, Sierra API hold resource
+        raises:
+            requests.exceptions.HTTPError: if a page request fails
+        """
+
+        def get_page(offset):
+            response = self.hold_get_all(
+                pid, limit=page_size, offset=offset, fields=fields)
+            if response.status_code == 404:
+                # no holds in the account
+                return {'total': 0, 'entries': []}
+            response.raise_for_status()
+            return response.json()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            offset = 0
+            future = executor.submit(get_page, offset)
+            while future is not None:
+                page = future.result()
+                entries = page.get('entries', [])
+                offset += len(entries)
+                total = page.get('total')
+                if total is None:
+                    more = len(entries) == page_size
+                else:
+                    # the API may cap the limit below page_size, so a short
+                    # page does not mean the last one when total is known
+                    more = entries and offset < total
+                future = executor.submit(get_page, offset) if more else None
+                yield from entries
+
     def hold_delete_all(self, pid, response_format='json'):
         """
         Deletes all holds for specified patron account
@@ -28,16 +28,24 @@ note: call numbers may repeat (branch-research) and only branch ones should be
       considered
 """
 
-from collections import namedtuple, OrderedDict
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import csv
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
+import hashlib
+import os
 import re
 
 
-from datastore import (session_scope, Audience, Branch, Language,
-                       ItemType, OverflowItem, MatCat,
+from datastore import (session_scope, Audience, Branch, ExportCheckpoint,
+                       Language, ItemType, OverflowItem, MatCat,
                        ShelfCode)
-from datastore_transactions import create_code_idx, insert, retrieve_record
+from datastore_transactions import (bulk_insert, create_code_idx,
+                                    delete_item_range, insert,
+                                    retrieve_last_record, retrieve_record)
+from errors import RebalancerError
+from adapters.pool import iter_results
 
 RowData = namedtuple(
     'RowData',
@@ -45,6 +53,29 @@ RowData = namedtuple(
     'item_id, item_created_date, location, item_type, '
     'opac_msg, last_out_date, total_checkouts, total_renewals')
 
+ExportPosition = namedtuple(
+    'ExportPosition', 'offset, row_no')
+
+CodeIndexes = namedtuple(
+    'CodeIndexes',
+    'branch_idx, mat_cat_idx, audn_idx, lang_idx, lang_priority, '
+    'itemtype_idx')
+
+
+# number of overflow items written to datastore in a single statement;
+# each batch is committed together with its export checkpoint
+BATCH_SIZE = 5000
+
+# number of bytes read from the start and from the end of export file
+# to tell it apart from another export saved under the same path
+FINGERPRINT_BLOCK = 65536
+
+# number of distinct date strings remembered by string2date
+DATE_CACHE_SIZE = 4096
+
+# splits lines on carriage returns not followed by a line feed, the same
+# way text mode with newline='' does
+CR_LINE_BREAK = re.compile(rb'(?<=\r)(?!\n)')
 
 DATE_PATTERN = re.compile(r'\d{4}')
 
@@ -94,6 +125,42 @@ BPL_CALL_PATTERNS = OrderedDict(
 )
 
 
+def compile_call_patterns(patterns):
+    """
+    Combines ordered table of call number patterns into a single regex
+    with a named group for each category. The combined regex is anchored
+    at the start of a call number and its alternatives are tried in table
+    order, so a match names the first category whose own pattern would be
+    found with re.search.
+    args:
+        patterns: OrderedDict, category code: compiled pattern
+    returns:
+        classifier: compiled regex
+    """
+    alternatives = []
+    for category, pattern in patterns.items():
+        if '(' in pattern.pattern:
+            raise ValueError(
+                f'Pattern for "{category}" category must not include groups')
+        branches = []
+        for branch in pattern.pattern.split('|'):
+            if branch.startswith('^'):
+                branches.append(branch)
+            elif branch.startswith('.*'):
+                branches.append(f'(?s:.*){branch[2:]}')
+            else:
+                branches.append(f'(?s:.*?){branch}')
+        alternative = '|'.join(branches)
+        if pattern.flags & re.IGNORECASE:
+            alternative = f'(?i:{alternative})'
+        alternatives.append(f'(?P<{category}>{alternative})')
+    return re.compile('|'.join(alternatives))
+
+
+NYP_CALL_CLASSIFIER = compile_call_patterns(NYP_CALL_PATTERNS)
+BPL_CALL_CLASSIFIER = compile_call_patterns(BPL_CALL_PATTERNS)
+
+
 BPL_OPAC_MSGS = {
     'l': 'lp',
     'n': 'rm',
@@ -164,13 +231,32 @@ def parse_pub_date(pub_info):
         return
 
 
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(date_string):
+    # fast path for Sierra's fixed width MM-DD-YYYY dates,
+    # anything else is left to strptime
+    if len(date_string) == 10 and date_string[2] == '-' \
+            and date_string[5] == '-':
+        digits = date_string[:2] + date_string[3:5] + date_string[6:]
+        if digits.isascii() and digits.isdigit():
+            try:
+                return date(
+                    int(date_string[6:]),
+                    int(date_string[:2]),
+                    int(date_string[3:5]))
+            except ValueError:
+                return
+    try:
+        return datetime.strptime(date_string, '%m-%d-%Y').date()
+    except ValueError:
+        return
+
+
 def string2date(date_string):
     try:
-        return datetime.strptime(date_string[:10], '%m-%d-%Y').date()
+        return parse_date(date_string[:10])
     except TypeError:
         return
-    except ValueError:
-        return
 
 
 def parse_shelfcode(location):
@@ -183,6 +269,12 @@ def parse_shelfcode(location):
     return shelfcode
 
 
+def classify_call_no(call_no, classifier):
+    m = classifier.match(call_no)
+    if m:
+        return m.lastgroup
+
+
 def determine_bpl_mat_cat(call_no, location, opac_msg):
     mat_cat = None
     shelfcode = parse_shelfcode(location)
@@ -222,19 +314,12 @@ def determine_bpl_mat_cat(call_no, location, opac_msg):
             mat_cat = 'cd'
 
     if mat_cat is None:
-        for p, v in BPL_CALL_PATTERNS.items():
-            m = v.search(call_no)
-            if m:
-                mat_cat = p
-                break
+        mat_cat = classify_call_no(call_no, BPL_CALL_CLASSIFIER)
     return mat_cat
 
 
 def determine_nyp_mat_cat(call_no):
-    for p, v in NYP_CALL_PATTERNS.items():
-        m = v.search(call_no)
-        if m:
-            return p
+    return classify_call_no(call_no, NYP_CALL_CLASSIFIER)
 
 
 def get_mat_cat_id(call_no, location, opac_msg, system_id, mat_cat_idx):
@@ -262,14 +347,42 @@ def get_audience_id(location, audn_idx):
         return audn_idx[None]
 
 
-def get_language_id(call_no, lang_idx):
-    found = False
-    for code in lang_idx.keys():
-        if code in call_no.replace('-', ' ').lower().split(' '):
-            found = True
-            return lang_idx[code]
-    if not found:
-        return lang_idx['eng']
+def create_lang_priority(lang_idx):
+    """
+    Maps language codes to their position in the language index, which
+    decides the winner when a call number includes more than one code
+    args:
+        lang_idx: dict, language code to language.rid index
+    returns:
+        lang_priority: dict, language code: position
+    """
+    return {
+        code: position for position, code in enumerate(lang_idx)
+        if code is not None}
+
+
+def detect_language(call_no, lang_priority):
+    """
+    Finds language code among call number tokens
+    args:
+        call_no: str, call number
+        lang_priority: dict, language code: position (create_lang_priority)
+    returns:
+        code: str, matched call number token or None if no code found
+    """
+    tokens = set(call_no.replace('-', ' ').lower().split(' '))
+    matches = tokens.intersection(lang_priority)
+    if matches:
+        return min(matches, key=lang_priority.__getitem__)
+
+
+def get_language_id(call_no, lang_idx, lang_priority=None):
+    if lang_priority is None:
+        lang_priority = create_lang_priority(lang_idx)
+    code = detect_language(call_no, lang_priority)
+    if code is None:
+        code = 'eng'
+    return lang_idx[code]
 
 
 def get_itemtype_id(item_type, itemtype_idx):
@@ -286,73 +399,330 @@ def string2int(amount):
         return 0
 
 
-def get_shelfcode_id(session, location, system_id):
-    shelfcode = parse_shelfcode(location)
-
-    shelfcode_record = retrieve_record(
-        session, ShelfCode, system_id=system_id, code=shelfcode)
-
-    # add code if not found
-    if shelfcode_record is None:
-        shelfcode_record = insert(
-            session,
-            ShelfCode,
-            system_id=system_id,
-            code=shelfcode)
-        session.flush()
-
-    return shelfcode_record.rid
+def update_shelfcode_idx(session, shelfcodes, system_id, shelfcode_idx):
+    """
+    Adds shelf codes missing from the index to the datastore in one batch
+    and refreshes the index with their ids
+    args:
+        session: sqlalchemy.orm.session.Session instance
+        shelfcodes: list, shelf codes (str or None) to be resolved
+        system_id: int, datastore system id
+        shelfcode_idx: dict, shelf code to shelf_code.rid index
+    """
+    # preserve order of first appearance so ids are assigned predictably
+    missing = [
+        code for code in dict.fromkeys(shelfcodes)
+        if code not in shelfcode_idx]
+    if missing:
+        bulk_insert(
+            session, ShelfCode,
+            [dict(system_id=system_id, code=code) for code in missing])
+        shelfcode_idx.update(
+            create_code_idx(session, ShelfCode, system_id=system_id))
+
+
+def get_shelfcode_id(location, shelfcode_idx):
+    return shelfcode_idx[parse_shelfcode(location)]
+
+
+def read_export(fh, offset=0, row_no=0):
+    """
+    Streams rows of Sierra export file together with position of the row
+    that follows, which can be used to resume reading later
+    args:
+        fh: str, path to Sierra export file
+        offset: int, byte offset to start reading from; header is skipped
+                only when reading from the beginning of the file
+        row_no: int, number of rows preceding the offset
+    yields:
+        tuple: (RowData, ExportPosition)
+    """
+    with open(fh, 'rb') as file:
+        file.seek(offset)
+        position = [offset]
+
+        def lines():
+            for line in iter(file.readline, b''):
+                for part in CR_LINE_BREAK.split(line):
+                    if part:
+                        position[0] += len(part)
+                        yield part.decode('utf-8')
+
+        reader = csv.reader(lines(), delimiter='|', quotechar='"')
+
+        if offset == 0:
+            # skip header
+            next(reader, None)
+
+        for row in reader:
+            row_no += 1
+            yield RowData._make(row), ExportPosition(position[0], row_no)
 
 
 def sierra_export_reader(fh):
-    reader = csv.reader(
-        open(fh, 'r', encoding='utf-8', newline=''),
-        delimiter='|',
-        quotechar='"')
-
-    # skip header
-    next(reader)
-
-    for row in map(RowData._make, reader):
+    for row, _ in read_export(fh):
         yield row
 
 
-def save2store(fh, system_id):
-    data = sierra_export_reader(fh)
+def export_fingerprint(fh):
+    """
+    Identifies contents of export file by its size and digest of its first
+    and last blocks. The whole file is not hashed, since an interrupted
+    load resumes without reading the rows it has already committed; an edit
+    in the middle of the file that keeps its size is not detected.
+    args:
+        fh: str, path to Sierra export file
+    returns:
+        fingerprint: str
+    """
+    size = os.path.getsize(fh)
+    digest = hashlib.sha1()
+    with open(fh, 'rb') as file:
+        digest.update(file.read(FINGERPRINT_BLOCK))
+        if size > FINGERPRINT_BLOCK:
+            file.seek(max(size - FINGERPRINT_BLOCK, FINGERPRINT_BLOCK))
+            digest.update(file.read())
+    return f'{size}:{digest.hexdigest()}'
+
+
+def restart_load(session, checkpoint, fingerprint):
+    """
+    Resets checkpoint so the export is read from its beginning; rows
+    committed by an interrupted load are deleted in the same transaction
+    raises:
+        RebalancerError: when rows of the interrupted load can't be found
+    """
+    if not checkpoint.completed and checkpoint.row_no:
+        if checkpoint.first_rid is None:
+            raise RebalancerError(
+                f'Unable to restart interrupted load of {checkpoint.fh}: '
+                'its rows already saved in datastore are unknown')
+        delete_item_range(
+            session, checkpoint.system_id, checkpoint.rid,
+            checkpoint.first_rid, checkpoint.last_rid)
+    checkpoint.fingerprint = fingerprint
+    checkpoint.offset = 0
+    checkpoint.row_no = 0
+    checkpoint.first_rid = None
+    checkpoint.last_rid = None
+    checkpoint.completed = False
+
+
+def get_export_checkpoint(session, fh, system_id, resume=True):
+    """
+    Retrieves ingestion checkpoint of the export file. Checkpoints are
+    kept per path, and the fingerprint of the file tells whether the file
+    is the one the checkpoint was saved for:
+        - interrupted load of the same file continues from the checkpoint,
+          unless resume is False
+        - interrupted load is otherwise started over, its committed rows
+          are deleted
+        - completed load of the same file is returned as is, a file is not
+          loaded twice
+        - completed load of an older file is followed by a new load,
+          rows of the older file stay in the datastore
+    args:
+        session: sqlalchemy.orm.session.Session instance
+        fh: str, path to Sierra export file
+        system_id: int, datastore system id
+        resume: boolean, continue interrupted load
+    returns:
+        checkpoint: ExportCheckpoint instance
+    """
+    path = os.path.abspath(fh)
+    fingerprint = export_fingerprint(fh)
+    checkpoint = retrieve_record(
+        session, ExportCheckpoint, system_id=system_id, fh=path)
+    if checkpoint is None:
+        checkpoint = insert(
+            session, ExportCheckpoint,
+            system_id=system_id, fh=path, fingerprint=fingerprint,
+            offset=0, row_no=0, completed=False)
+    elif checkpoint.fingerprint != fingerprint or not (
+            resume or checkpoint.completed):
+        restart_load(session, checkpoint, fingerprint)
+    session.flush()
+    return checkpoint
+
+
+def store_batch(session, batch, system_id, shelfcode_idx, checkpoint_id=None):
+    """
+    Resolves shelf codes of parsed rows and writes them to the datastore
+    args:
+        session: sqlalchemy.orm.session.Session instance
+        batch: list of tuples, (location, overflow_item dict)
+        system_id: int, datastore system id
+        shelfcode_idx: dict, shelf code to shelf_code.rid index
+        checkpoint_id: int, export_checkpoint.rid of the load writing rows
+    """
+    update_shelfcode_idx(
+        session, [parse_shelfcode(loc) for loc, _ in batch],
+        system_id, shelfcode_idx)
+    overflow_items = []
+    for location, overflow_item in batch:
+        overflow_item['src_branch_shelf_id'] = get_shelfcode_id(
+            location, shelfcode_idx)
+        overflow_item['checkpoint_id'] = checkpoint_id
+        overflow_items.append(overflow_item)
+    bulk_insert(session, OverflowItem, overflow_items)
+
+
+def prep_overflow_item(element, system_id, idxs):
+    """
+    Normalizes export row into overflow_item column values;
+    shelf code id is resolved separately by the writer (see store_batch)
+    args:
+        element: RowData instance
+        system_id: int, datastore system id
+        idxs: CodeIndexes instance
+    returns:
+        overflow_item: dict
+    """
+    return dict(
+        system_id=system_id,
+        bib_id=prep_ids(element.bib_id),
+        title=prep_title(element.title),
+        author=prep_author(element.author),
+        call_no=element.call_no.strip(),
+        item_id=prep_ids(element.item_id),
+        src_branch_id=determine_branch_id(
+            element.location, idxs.branch_idx),
+        src_branch_shelf_id=None,
+        pub_date=parse_pub_date(element.pub_info),
+        bib_created_date=string2date(element.bib_created_date),
+        item_created_date=string2date(element.item_created_date),
+        mat_cat_id=get_mat_cat_id(
+            element.call_no, element.location, element.opac_msg,
+            system_id, idxs.mat_cat_idx),
+        audn_id=get_audience_id(element.location, idxs.audn_idx),
+        lang_id=get_language_id(
+            element.call_no, idxs.lang_idx, idxs.lang_priority),
+        item_type_id=get_itemtype_id(
+            element.item_type, idxs.itemtype_idx),
+        last_out_date=string2date(element.last_out_date),
+        total_checkouts=string2int(element.total_checkouts),
+        total_renewals=string2int(element.total_renewals))
+
+
+def prep_batch(chunk, system_id, idxs):
+    return [
+        (element.location, prep_overflow_item(element, system_id, idxs))
+        for element in chunk]
+
+
+# parsing context of pipeline worker processes, set by _init_worker
+_worker_context = None
+
+
+def _init_worker(system_id, idxs):
+    global _worker_context
+    _worker_context = (system_id, idxs)
+
+
+def _prep_chunk(chunk):
+    return prep_batch(chunk, *_worker_context)
+
+
+def iter_chunks(rows, size):
+    """
+    Groups rows of read_export into chunks
+    args:
+        rows: iterable of tuples, (RowData, ExportPosition)
+        size: int, maximum number of rows in a chunk
+    yields:
+        tuple: (list of RowData, ExportPosition following the chunk)
+    """
+    chunk = []
+    for row, position in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk, position
+            chunk = []
+    if chunk:
+        yield chunk, position
+
+
+def parse_batches(chunks, system_id, idxs, workers):
+    """
+    Normalizes chunks of export rows, in a pool of worker processes
+    if more than one worker is requested. Batches are yielded in the order
+    of the export and the number of chunks in flight is bounded, so memory
+    use does not grow with the size of the file.
+    args:
+        chunks: iterable of tuples, (list of RowData, ExportPosition)
+        system_id: int, datastore system id
+        idxs: CodeIndexes instance
+        workers: int, number of parsing processes
+    yields:
+        tuple: (list of (location, overflow_item dict), ExportPosition)
+    """
+    if workers <= 1:
+        for chunk, position in chunks:
+            yield prep_batch(chunk, system_id, idxs), position
+        return
+
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(system_id, idxs)) as executor:
+        positions = deque()
+
+        def calls():
+            for chunk, position in chunks:
+                positions.append(position)
+                yield _prep_chunk, (chunk,)
+
+        for batch in iter_results(
+                executor, calls(), workers * 2, ordered=True):
+            yield batch, positions.popleft()
+
+
+def save2store(
+        fh, system_id, batch_size=BATCH_SIZE, workers=1, resume=True):
+    """
+    Parses Sierra export and saves its rows in overflow_item table.
+    Rows are normalized in chunks (optionally in a process pool) and
+    written by this process, which is the only one connecting to datastore.
+    Each batch is committed with the export checkpoint, so an interrupted
+    load resumes after the last committed batch. A file already loaded is
+    skipped (see get_export_checkpoint).
+    args:
+        fh: str, path to Sierra export file
+        system_id: int, datastore system id (1: BPL, 2: NYPL)
+        batch_size: int, number of rows inserted and committed together
+        workers: int, number of parsing processes
+        resume: boolean, continue interrupted load of the same file
+    """
     with session_scope() as session:
-        branch_idx = create_code_idx(session, Branch, system_id=system_id)
-        mat_cat_idx = create_code_idx(session, MatCat, system_id=system_id)
-        audn_idx = create_code_idx(session, Audience)
         lang_idx = create_code_idx(session, Language)
-        itemtype_idx = create_code_idx(session, ItemType, system_id=system_id)
-
-        for element in data:
-            # parse source shelf code and store it
-            shelfcode_id = get_shelfcode_id(
-                session, element.location, system_id)
-
-            overflow_item = dict(
-                system_id=system_id,
-                bib_id=prep_ids(element.bib_id),
-                title=prep_title(element.title),
-                author=prep_author(element.author),
-                call_no=element.call_no.strip(),
-                item_id=prep_ids(element.item_id),
-                src_branch_id=determine_branch_id(
-                    element.location, branch_idx),
-                src_branch_shelf_id=shelfcode_id,
-                pub_date=parse_pub_date(element.pub_info),
-                bib_created_date=string2date(element.bib_created_date),
-                item_created_date=string2date(element.item_created_date),
-                mat_cat_id=get_mat_cat_id(
-                    element.call_no, element.location, element.opac_msg,
-                    system_id, mat_cat_idx),
-                audn_id=get_audience_id(element.location, audn_idx),
-                lang_id=get_language_id(element.call_no, lang_idx),
-                item_type_id=get_itemtype_id(
-                    element.item_type, itemtype_idx),
-                last_out_date=string2date(element.last_out_date),
-                total_checkouts=string2int(element.total_checkouts),
-                total_renewals=string2int(element.total_renewals))
-
-            insert(session, OverflowItem, **overflow_item)
+        idxs = CodeIndexes(
+            branch_idx=create_code_idx(session, Branch, system_id=system_id),
+            mat_cat_idx=create_code_idx(session, MatCat, system_id=system_id),
+            audn_idx=create_code_idx(session, Audience),
+            lang_idx=lang_idx,
+            lang_priority=create_lang_priority(lang_idx),
+            itemtype_idx=create_code_idx(
+                session, ItemType, system_id=system_id))
+        shelfcode_idx = create_code_idx(
+            session, ShelfCode, system_id=system_id)
+
+        checkpoint = get_export_checkpoint(session, fh, system_id, resume)
+        session.commit()
+        if checkpoint.completed:
+            return
+        data = read_export(fh, checkpoint.offset, checkpoint.row_no)
+
+        for batch, position in parse_batches(
+                iter_chunks(data, batch_size), system_id, idxs, workers):
+            store_batch(
+                session, batch, system_id, shelfcode_idx, checkpoint.rid)
+            checkpoint.last_rid = retrieve_last_record(
+                session, OverflowItem).rid
+            if checkpoint.first_rid is None:
+                checkpoint.first_rid = checkpoint.last_rid - len(batch) + 1
+            checkpoint.offset = position.offset
+            checkpoint.row_no = position.row_no
+            checkpoint.timestamp = datetime.now()
+            session.commit()
+
+        checkpoint.completed = True
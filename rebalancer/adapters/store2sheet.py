@@ -3,33 +3,38 @@
 import os
 import json
 from datetime import datetime
+from itertools import chain, groupby
 
 from datastore import (
     session_scope,
-    Audience,
     Branch, Cart,
-    MatCat,
-    OverflowItem
+    MatCat
 )
 from datastore_transactions import (
     insert,
+    cart_items_query_stmn,
     count_records,
-    get_relevant_lang_recs,
     retrieve_records_ordered_by_code
 )
 
 
 from adapters.gdrive.credentials import get_access_token
 from adapters.gdrive.sheet import (
+    VALIDATION_TAB,
     create_sheet,
     file2folder,
-    customize_shopping_sheet,
-    append2sheet,
-    update_categories_formatting)
+    publish_cart)
 from datastore_transactions import (
-    get_items4cart,
-    retrieve_records,
-    update_record)
+    assign_items2cart,
+    retrieve_records_cached)
+
+
+CART_DATA_TABS = ['Adults', 'Teens', 'Kids', 'World Lang']
+
+BIB_URLS = {
+    1: 'http://iii.brooklynpubliclibrary.org/record=b',
+    2: 'http://ilsstaff.nypl.org/record=b'
+}
 
 
 def get_gdrive_folder_id():
@@ -48,15 +53,14 @@ def name_cart():
     return f'Rebalancing Cart {datetime.now().strftime("%B %Y")}'
 
 
-def save_cart_info(sheet_id, system_id):
-    with session_scope() as session:
-        rec = insert(
-            session,
-            Cart,
-            system_id=system_id,
-            shopping_cart_id=sheet_id)
-        session.flush()
-        return(rec.rid)
+def save_cart_info(session, sheet_id, system_id):
+    rec = insert(
+        session,
+        Cart,
+        system_id=system_id,
+        shopping_cart_id=sheet_id)
+    session.flush()
+    return(rec.rid)
 
 
 def order_categories(session, system_id, tab):
@@ -66,7 +70,7 @@ def order_categories(session, system_id, tab):
         list of tuples: (mat_cat.rid, mat_cat.label)
     """
     ordered_cats = []
-    recs = retrieve_records(session, MatCat, system_id=system_id)
+    recs = retrieve_records_cached(session, MatCat, system_id=system_id)
     if tab == 'Adults':
         cats = {r.adults_order: (r.rid, r.label) for r in recs if r.adults_order is not None}
     elif tab == 'Teens':
@@ -85,99 +89,90 @@ def get_total_number_of_branches(system_id):
         return branch_count
 
 
-def audience_label_idx():
-    with session_scope() as session:
-        audn_recs = retrieve_records(session, Audience)
-        audn_idx = {a.label: a.rid for a in audn_recs}
+def get_branch_codes(session, system_id):
+    data = []
+    branch_records = retrieve_records_ordered_by_code(
+        session, Branch, system_id=system_id)
+    for record in branch_records:
+        if record.code:
+            data.append([record.code])
+    return data
 
-        return audn_idx
 
+def item_row(url, record):
+    link = f'=HYPERLINK("{url}{record.bid}", "see")'
+    return [
+        None, record.author, record.title, record.call_no,
+        record.pub_date, link, record.iid]
+
+
+def iter_cart_rows(session, system_id):
+    """
+    Streams rows of all data tabs of the shopping cart in a single pass
+    over one ordered query of unassigned items. Each material category
+    ordered for a tab gets a heading row, even if it has no items; world
+    language materials are grouped under language headings.
+    yields:
+        tuple: (tab name, row values, overflow_item rid or None for heading)
+    """
+    url = BIB_URLS[system_id]
+    records = session.execute(cart_items_query_stmn(system_id))
+    groups = groupby(
+        records,
+        key=lambda r: (r.tab, r.lang_code if r.tab == 'World Lang'
+                       else r.mat_cat_id))
+    key, group = next(groups, (None, None))
+
+    for tab in CART_DATA_TABS:
+        if tab == 'World Lang':
+            while key is not None and key[0] == tab:
+                first = next(group)
+                yield tab, [first.lang_label], None
+                for r in chain([first], group):
+                    yield tab, item_row(url, r), r.rid
+                key, group = next(groups, (None, None))
+        else:
+            for mat_cat_id, label in order_categories(
+                    session, system_id, tab):
+                yield tab, [label], None
+                if key == (tab, mat_cat_id):
+                    for r in group:
+                        yield tab, item_row(url, r), r.rid
+                    key, group = next(groups, (None, None))
+
+
+def populate_cart(
+        creds, system_id, sheet_id, tabs, branch_count, progress=None):
+    """
+    Publishes all tabs of the shopping cart, then records the cart and
+    assigns its items to it. Rows are streamed to the spreadsheet from
+    a session that only reads, so the datastore is not locked for writing
+    while the spreadsheet is published. The cart record and item assignment
+    are committed together in a short transaction afterwards.
+    returns:
+        cart_id: int, datastore cart id
+    """
+    rids = []
 
-def populate_branch_tab(creds, system_id, sheet_id):
-    data = []
     with session_scope() as session:
-        branch_records = retrieve_records_ordered_by_code(
-            session, Branch, system_id=system_id)
-        for record in branch_records:
-            if record.code:
-                data.append([record.code])
-    append2sheet(creds, sheet_id, 'branch codes', data)
-
-
-def populate_data_tab(
-    creds,
-    system_id,
-    cart_id,
-    sheet_id,
-    tab_name,
-):
 
-    data = []
-    cat_heading_rows = []
+        def cart_rows():
+            for tab, row, rid in iter_cart_rows(session, system_id):
+                if rid is not None:
+                    rids.append(rid)
+                yield tab, row, rid is None
+            for row in get_branch_codes(session, system_id):
+                yield VALIDATION_TAB, row, False
+
+        publish_cart(
+            creds, sheet_id, tabs, branch_count, cart_rows(),
+            progress=progress)
 
     with session_scope() as session:
-        row = 0
-        audn_idx = audience_label_idx()
-        if system_id == 1:
-            url = 'http://iii.brooklynpubliclibrary.org/record=b'
-        elif system_id == 2:
-            url = 'http://ilsstaff.nypl.org/record=b'
-        if tab_name == 'World Lang':
-            ordered_langs = get_relevant_lang_recs(session, system_id)
-
-            for _, lang_code, lang_label in ordered_langs:
-
-                row += 1
-                cat_heading_rows.append(row)
-                data.append([lang_label])
-                records = get_items4cart(
-                    session,
-                    system_id,
-                    None,
-                    None,
-                    lang_code=lang_code)
-
-                for r in records:
-                    row += 1
-                    link = f'=HYPERLINK("{url}{r.bid}", "see")'
-                    data.append([
-                        None, r.author, r.title, r.call_no,
-                        r.pub_date, link, r.iid])
-                    update_record(
-                        session, OverflowItem, r.rid,
-                        cart_id=cart_id)
+        cart_id = save_cart_info(session, sheet_id, system_id)
+        assign_items2cart(session, cart_id, rids)
 
-        else:
-            ordered_cats = order_categories(session, system_id, tab_name)
-            lang_code = 'eng'
-
-            for mat_cat_id, label in ordered_cats:
-                row += 1
-                cat_heading_rows.append(row)
-
-                # get and prep record
-                data.append([label])
-                audn_id = audn_idx[tab_name]
-                records = get_items4cart(
-                    session,
-                    system_id,
-                    audn_id,
-                    mat_cat_id,
-                    lang_code=lang_code)
-
-                for r in records:
-                    row += 1
-                    link = f'=HYPERLINK("{url}{r.bid}", "see")'
-                    data.append([
-                        None, r.author, r.title, r.call_no,
-                        r.pub_date, link, r.iid])
-                    update_record(
-                        session, OverflowItem, r.rid,
-                        cart_id=cart_id)
-    if data:
-        append2sheet(creds, sheet_id, tab_name, data)
-        update_categories_formatting(
-            creds, sheet_id, tab_name, cat_heading_rows)
+    return cart_id
 
 
 def create_shopping_cart(system_id):
@@ -185,17 +180,11 @@ def create_shopping_cart(system_id):
     Creates a google sheets and approabs and moves it to
     shared folder
     """
-    tabs = ['Adults', 'Teens', 'Kids', 'World Lang', 'branch codes']
+    tabs = CART_DATA_TABS + [VALIDATION_TAB]
     creds = get_access_token()
     cart_name = name_cart()
     sheet_id = create_sheet(creds, cart_name, tabs)
     folder_id = get_gdrive_folder_id()
     file2folder(creds, folder_id, sheet_id)
     branch_count = get_total_number_of_branches(system_id)
-    customize_shopping_sheet(creds, sheet_id, tabs, branch_count)
-    cart_id = save_cart_info(sheet_id, system_id)
-    for tab in tabs:
-        if tab == 'branch codes':
-            populate_branch_tab(creds, system_id, sheet_id)
-        else:
-            populate_data_tab(creds, system_id, cart_id, sheet_id, tab)
+    populate_cart(creds, system_id, sheet_id, tabs, branch_count)
@@ -4,23 +4,56 @@ Defines and initiates database
 from contextlib import contextmanager
 from datetime import datetime
 import json
+import os
 import sqlite3
+import sys
 
-from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey,
-                        Integer, String, UniqueConstraint)
+from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey, Index,
+                        Integer, String, UniqueConstraint, event, text)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.inspection import inspect
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy import create_engine
 
 
-from datastore_transactions import insert
+from datastore_transactions import insert, invalidate_reference_cache
+from errors import RebalancerError
 
 
 Base = declarative_base()
 
 DB_FH = './temp/store.db'
 
+# indexes of earlier schema versions, dropped by migrate_datastore
+OBSOLETE_INDEXES = [
+    'ix_overflow_item_unassigned_cat',
+    'ix_overflow_item_unassigned_lang']
+
+# SQLite pragmas applied to each new datastore connection;
+# negative cache_size is in KiB, mmap_size in bytes
+DB_PROFILES = {
+    'default': {},
+    # bulk loads by a single writer
+    'ingest': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -262144,
+        'mmap_size': 1073741824,
+        'temp_store': 'MEMORY'},
+    # readers working alongside a writer issuing holds
+    'serve': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000},
+}
+
+DB_PROFILE = os.environ.get('REBALANCER_DB_PROFILE', 'default')
+
 
 class System(Base):
     __tablename__ = 'system'
@@ -40,10 +73,11 @@ class Cart(Base):
     shopping_cart_id = Column(String, nullable=False)
     created = Column(DateTime, nullable=False, default=datetime.now())
 
+    # loaded on access, a cart may hold tens of thousands of items
     items = relationship(
         'OverflowItem',
         cascade='all, delete-orphan',
-        lazy='joined')
+        lazy='select')
 
     def __repr__(self):
         state = inspect(self)
@@ -148,6 +182,13 @@ class MatCat(Base):
 
 class OverflowItem(Base):
     __tablename__ = 'overflow_item'
+    __table_args__ = (
+        # partial index of items not assigned to a cart yet: finds items
+        # of the cart query and unassigned items deleted by their number
+        Index(
+            'ix_overflow_item_unassigned', 'system_id', 'item_id',
+            sqlite_where=text('cart_id IS NULL')),
+    )
     rid = Column(Integer, primary_key=True)
     timestamp = Column(DateTime, nullable=False, default=datetime.now())
     system_id = Column(Integer, ForeignKey('system.rid'), nullable=False)
@@ -171,6 +212,7 @@ class OverflowItem(Base):
     last_out_date = Column(String(20), default=None)
     total_checkouts = Column(Integer, default=0)
     total_renewals = Column(Integer, default=0)
+    checkpoint_id = Column(Integer, ForeignKey('export_checkpoint.rid'))
 
     def __repr__(self):
         state = inspect(self)
@@ -179,16 +221,140 @@ class OverflowItem(Base):
         return f'<Stats({attrs})>'
 
 
-class DataAccessLayer:
+class ExportCheckpoint(Base):
+    """
+    Tracks progress of Sierra export ingestion: byte offset and number of
+    rows of the export file already committed to overflow_item table,
+    fingerprint of the file and range of overflow_item rows written by
+    the load; the rows are also tagged with the checkpoint (checkpoint_id)
+    """
+    __tablename__ = 'export_checkpoint'
+    __table_args__ = (
+        UniqueConstraint('system_id', 'fh', name='uix_checkpoint'), )
+    rid = Column(Integer, primary_key=True)
+    system_id = Column(Integer, ForeignKey('system.rid'), nullable=False)
+    fh = Column(String, nullable=False)
+    offset = Column(Integer, nullable=False, default=0)
+    row_no = Column(Integer, nullable=False, default=0)
+    completed = Column(Boolean, nullable=False, default=False)
+    timestamp = Column(DateTime, nullable=False, default=datetime.now)
+    fingerprint = Column(String)
+    first_rid = Column(Integer)
+    last_rid = Column(Integer)
+
+    def __repr__(self):
+        state = inspect(self)
+        attrs = ', '.join([
+            f'{attr.key}={attr.loaded_value!r}' for attr in state.attrs])
+        return f'<ExportCheckpoint({attrs})>'
+
+
+class HoldRequest(Base):
+    """
+    Ledger of holds placed on cart items: outcome of the last attempt
+    and number of attempts made so far. A hold is recorded as pending
+    before its request is sent, so a hold whose outcome was never recorded
+    can be verified instead of sent again.
+    """
+    __tablename__ = 'hold_request'
+    __table_args__ = (
+        UniqueConstraint('cart_id', 'item_id', name='uix_hold_request'), )
+    rid = Column(Integer, primary_key=True)
+    cart_id = Column(Integer, ForeignKey('cart.rid'), nullable=False)
+    item_id = Column(Integer, nullable=False)
+    pickup_location = Column(String(5))
+    attempts = Column(Integer, nullable=False, default=0)
+    status_code = Column(Integer)
+    error_code = Column(Integer)
+    error_description = Column(String(500))
+    succeeded = Column(Boolean, nullable=False, default=False)
+    pending = Column(
+        Boolean, nullable=False, default=False, server_default=text('0'))
+    timestamp = Column(DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        state = inspect(self)
+        attrs = ', '.join([
+            f'{attr.key}={attr.loaded_value!r}' for attr in state.attrs])
+        return f'<HoldRequest({attrs})>'
 
-    def __init__(self):
-        self.db_path = f'sqlite:///{DB_FH}'
+
+class DataAccessLayer:
+    """
+    Owns datastore engine, its connection pool and session factory.
+    The engine is created once per process on first connect and reused
+    by all session_scope calls until disposed.
+
+    args:
+        db_path: str, database url, defaults to DB_FH sqlite file
+        pool_size: int, number of connections kept open in the pool
+        max_overflow: int, number of extra connections allowed on demand
+        profile: str, name of DB_PROFILES connection profile, defaults to
+                 REBALANCER_DB_PROFILE environment variable or 'default'
+    """
+
+    def __init__(
+            self, db_path=None, pool_size=5, max_overflow=10, profile=None):
+        if db_path is None:
+            db_path = f'sqlite:///{DB_FH}'
+        if profile is None:
+            profile = DB_PROFILE
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
         self.engine = None
         self.Session = None
+        self._pid = None
+        self.profile = None
+        self.use_profile(profile)
 
     def connect(self):
-        self.engine = create_engine(self.db_path)
+        # connections must not be shared with a forked process,
+        # so a child creates its own engine
+        if self.engine is not None and self._pid == os.getpid():
+            return
+        self.engine = create_engine(
+            self.db_path,
+            poolclass=QueuePool,
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            # pooled connections are handed to whichever thread needs them
+            connect_args={'check_same_thread': False})
+        event.listen(self.engine, 'connect', self._apply_pragmas)
         self.Session = sessionmaker(bind=self.engine)
+        self._pid = os.getpid()
+
+    def _apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in DB_PROFILES[self.profile].items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
+
+    def use_profile(self, profile):
+        """
+        Selects connection profile; open connections are closed so
+        the new profile applies to all subsequent ones
+        args:
+            profile: str, name of DB_PROFILES connection profile
+        """
+        if profile not in DB_PROFILES:
+            raise RebalancerError(
+                f'Unknown datastore profile "{profile}", available: '
+                f'{", ".join(DB_PROFILES)}')
+        if profile != self.profile:
+            self.dispose()
+            self.profile = profile
+
+    def dispose(self):
+        """
+        Closes pooled connections; next connect creates a new engine
+        """
+        if self.engine is not None and self._pid == os.getpid():
+            self.engine.dispose()
+        self.engine = None
+        self.Session = None
+        self._pid = None
+        invalidate_reference_cache()
 
 
 dal = DataAccessLayer()
@@ -212,8 +378,8 @@ def session_scope():
 def create_datastore():
     conn = sqlite3.connect(DB_FH)
     conn.close()
-    engine = create_engine(f'sqlite:///{DB_FH}')
-    Base.metadata.create_all(engine)
+    dal.connect()
+    Base.metadata.create_all(dal.engine)
 
     with session_scope() as session:
 
@@ -263,5 +429,37 @@ def create_datastore():
                     session, ItemType, **value)
 
 
+def migrate_datastore(engine=None):
+    """
+    Brings existing datastore up to date with current schema by creating
+    missing tables, and missing columns and indexes of existing tables;
+    added columns must be nullable or have a server default. Obsolete
+    indexes are dropped.
+    args:
+        engine: sqlalchemy.engine.Engine instance, defaults to dal engine
+    """
+    if engine is None:
+        dal.connect()
+        engine = dal.engine
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                engine.execute(
+                    f'ALTER TABLE {table.name} ADD COLUMN '
+                    f'{CreateColumn(column).compile(engine)}')
+        existing = {idx['name'] for idx in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+        for name in existing.intersection(OBSOLETE_INDEXES):
+            engine.execute(f'DROP INDEX {name}')
+
+
 if __name__ == '__main__':
-    create_datastore()
+    if sys.argv[1:] == ['migrate']:
+        migrate_datastore()
+    else:
+        create_datastore()
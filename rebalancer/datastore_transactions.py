@@ -2,8 +2,14 @@
 Datastore transaction methods
 """
 
-from functools import lru_cache
-
+from collections import defaultdict, namedtuple
+from itertools import chain
+import re
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 from sqlalchemy.sql import text, case
 # from pandas import read_sql
 
@@ -11,6 +17,17 @@ from sqlalchemy.sql import text, case
 from errors import RebalancerError
 
 
+# snapshots of reference data (branch, mat_cat, audience, language,
+# item_type, shelf_code) records, kept apart for each database engine:
+# {engine: {table name: {lookup key: snapshot}}}
+_reference_cache = WeakKeyDictionary()
+_snapshot_types = {}
+# table written to by a textual INSERT, UPDATE or DELETE statement
+_DML_TABLE = re.compile(
+    r'^\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|UPDATE(?:\s+OR\s+\w+)?|'
+    r'DELETE\s+FROM)\s+["`\[]?(\w+)', re.IGNORECASE)
+
+
 def count_records(session, model, **kwargs):
     record_count = session.query(model).filter_by(**kwargs).count()
     return record_count
@@ -29,11 +46,25 @@ def retrieve_records_ordered_by_code(session, model, **kwargs):
 
 
 def insert(session, model, **kwargs):
+    invalidate_reference_cache(model.__tablename__, bind=session.get_bind())
     instance = model(**kwargs)
     session.add(instance)
     return instance
 
 
+def bulk_insert(session, model, mappings):
+    """
+    Inserts many records with a single executemany statement, bypassing
+    ORM unit of work bookkeeping
+    args:
+        session: sqlalchemy.orm.session.Session instance
+        model: datastore model class
+        mappings: list of dicts, each representing a table row
+    """
+    if mappings:
+        session.execute(model.__table__.insert(), mappings)
+
+
 def create_code_idx(session, model, **kwargs):
     records = retrieve_records(
         session, model, **kwargs)
@@ -47,17 +78,252 @@ def retrieve_record(session, model, **kwargs):
     return instance
 
 
-@lru_cache(maxsize=32)
+def snapshot(instance):
+    """
+    Copies column values of ORM instance into an immutable named tuple
+    """
+    table = instance.__table__
+    try:
+        snapshot_type = _snapshot_types[table.name]
+    except KeyError:
+        snapshot_type = namedtuple(
+            f'{type(instance).__name__}Snapshot',
+            [column.key for column in table.columns])
+        _snapshot_types[table.name] = snapshot_type
+    return snapshot_type._make(
+        getattr(instance, field) for field in snapshot_type._fields)
+
+
+def reference_cache(session, table):
+    """
+    Cached snapshots of the table in the database the session is bound to
+    returns:
+        cache: dict, {lookup key: snapshot}
+    """
+    engine = session.get_bind().engine
+    try:
+        tables = _reference_cache[engine]
+    except KeyError:
+        tables = _reference_cache[engine] = defaultdict(dict)
+    return tables[table]
+
+
 def retrieve_record_cached(session, model, **kwargs):
-    instance = session.query(model).filter_by(**kwargs).first()
-    return instance
+    """
+    Retrieves reference data record as an immutable snapshot; results are
+    cached by database, model and filter values until model's table
+    is written to
+    returns:
+        snapshot: named tuple of record's column values or None
+    """
+    cache = reference_cache(session, model.__tablename__)
+    key = ('record', tuple(sorted(kwargs.items())))
+    try:
+        return cache[key]
+    except KeyError:
+        instance = retrieve_record(session, model, **kwargs)
+        if instance is not None:
+            instance = snapshot(instance)
+        cache[key] = instance
+        return instance
+
+
+def retrieve_records_cached(session, model, **kwargs):
+    """
+    Cached variant of retrieve_records, see retrieve_record_cached
+    returns:
+        snapshots: tuple of named tuples ordered by rid
+    """
+    cache = reference_cache(session, model.__tablename__)
+    key = ('records', tuple(sorted(kwargs.items())))
+    try:
+        return cache[key]
+    except KeyError:
+        instances = tuple(
+            snapshot(i) for i in retrieve_records(session, model, **kwargs))
+        cache[key] = instances
+        return instances
+
+
+def invalidate_reference_cache(*tables, bind=None):
+    """
+    Drops cached snapshots of given tables, or all of them if no table
+    is specified
+    args:
+        tables: str, table names
+        bind: sqlalchemy Engine or Connection, database whose snapshots
+              are dropped, defaults to all databases
+    """
+    if bind is None:
+        caches = list(_reference_cache.values())
+    else:
+        caches = [_reference_cache.get(bind.engine, {})]
+    for cache in caches:
+        if tables:
+            for table in tables:
+                cache.pop(table, None)
+        else:
+            cache.clear()
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_flushed_tables(session, flush_context):
+    invalidate_reference_cache(
+        *{instance.__table__.name for instance in chain(
+            session.new, session.dirty, session.deleted)},
+        bind=session.get_bind())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_after_rollback(session):
+    invalidate_reference_cache(bind=session.get_bind())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _invalidate_written_table(
+        conn, cursor, statement, parameters, context, executemany):
+    # catches Core and textual statements that bypass the ORM session
+    if context.isinsert or context.isupdate or context.isdelete:
+        table = context.compiled.statement.table.name
+    else:
+        match = _DML_TABLE.match(statement)
+        if match is None:
+            return
+        table = match.group(1)
+    invalidate_reference_cache(table, bind=conn)
 
 
 def update_record(session, model, rid, **kwargs):
+    invalidate_reference_cache(model.__tablename__, bind=session.get_bind())
     instance = session.query(model).filter_by(rid=rid).one()
     for key, value in kwargs.items():
         setattr(instance, key, value)
 
+
+def assign_items2cart(session, cart_id, rids):
+    """
+    Assigns overflow items to a cart with a single set-based UPDATE
+    joined to a temporary table of their rids
+    args:
+        session: sqlalchemy.orm.session.Session instance
+        cart_id: int, cart.rid
+        rids: list of int, overflow_item.rid of items in the cart
+    """
+    session.execute(text(
+        'CREATE TEMP TABLE IF NOT EXISTS temp_cart_item '
+        '(rid INTEGER PRIMARY KEY)'))
+    if rids:
+        session.execute(
+            text('INSERT INTO temp_cart_item (rid) VALUES (:rid)'),
+            [{'rid': rid} for rid in rids])
+    session.execute(
+        text("""
+            UPDATE overflow_item SET cart_id=:cart_id
+                WHERE rid IN (SELECT rid FROM temp_cart_item)"""),
+        {'cart_id': cart_id})
+    session.execute(text('DELETE FROM temp_cart_item'))
+
+
+def set_items_destination(session, cart_id, selections):
+    """
+    Sets destination branches of cart's items with a single set-based
+    UPDATE joined to a temporary table of staff selections
+    args:
+        session: sqlalchemy.orm.session.Session instance
+        cart_id: int, cart.rid
+        selections: list of tuples, (overflow_item.item_id, branch.rid)
+    """
+    session.execute(text(
+        'CREATE TEMP TABLE IF NOT EXISTS temp_item_dst '
+        '(item_id INTEGER PRIMARY KEY, dst_branch_id INTEGER)'))
+    if selections:
+        session.execute(
+            text(
+                'INSERT OR REPLACE INTO temp_item_dst (item_id, dst_branch_id) '
+                'VALUES (:item_id, :dst_branch_id)'),
+            [{'item_id': item_id, 'dst_branch_id': dst_branch_id}
+             for item_id, dst_branch_id in selections])
+    session.execute(
+        text("""
+            UPDATE overflow_item SET dst_branch_id=(
+                SELECT dst_branch_id FROM temp_item_dst
+                    WHERE temp_item_dst.item_id=overflow_item.item_id)
+                WHERE cart_id=:cart_id
+                    AND item_id IN (SELECT item_id FROM temp_item_dst)"""),
+        {'cart_id': cart_id})
+    session.execute(text('DELETE FROM temp_item_dst'))
+
+
+def retrieve_unassigned_item_ids(session, system_id):
+    """
+    Lists item numbers of overflow items not assigned to a cart yet
+    """
+    result = session.execute(
+        text("""
+            SELECT item_id FROM overflow_item
+                WHERE system_id=:system_id AND cart_id IS NULL"""),
+        {'system_id': system_id})
+    return [row.item_id for row in result]
+
+
+def delete_unassigned_items(session, system_id, item_ids):
+    """
+    Deletes overflow items not assigned to a cart yet with a single
+    DELETE joined to a temporary table of their item numbers
+    args:
+        session: sqlalchemy.orm.session.Session instance
+        system_id: int, system.rid
+        item_ids: iterable of int, overflow_item.item_id of items to delete
+    returns:
+        int: number of deleted items
+    """
+    session.execute(text(
+        'CREATE TEMP TABLE IF NOT EXISTS temp_item '
+        '(item_id INTEGER PRIMARY KEY)'))
+    item_ids = [{'item_id': item_id} for item_id in set(item_ids)]
+    if item_ids:
+        session.execute(
+            text('INSERT INTO temp_item (item_id) VALUES (:item_id)'),
+            item_ids)
+    result = session.execute(
+        text("""
+            DELETE FROM overflow_item
+                WHERE system_id=:system_id AND cart_id IS NULL
+                    AND item_id IN (SELECT item_id FROM temp_item)"""),
+        {'system_id': system_id})
+    session.execute(text('DELETE FROM temp_item'))
+    return result.rowcount
+
+
+def delete_item_range(session, system_id, checkpoint_id, first_rid, last_rid):
+    """
+    Deletes overflow items of the system written by the export load within
+    range of record ids; rows of other loads in the range are kept
+    args:
+        session: sqlalchemy.orm.session.Session instance
+        system_id: int, system.rid
+        checkpoint_id: int, export_checkpoint.rid of the load
+        first_rid: int, overflow_item.rid of the first deleted item
+        last_rid: int, overflow_item.rid of the last deleted item
+    returns:
+        int: number of deleted items
+    """
+    result = session.execute(
+        text("""
+            DELETE FROM overflow_item
+                WHERE system_id=:system_id
+                    AND rid BETWEEN :first_rid AND :last_rid
+                    AND checkpoint_id=:checkpoint_id"""),
+        {'system_id': system_id, 'checkpoint_id': checkpoint_id,
+         'first_rid': first_rid, 'last_rid': last_rid})
+    return result.rowcount
+
+
+def retrieve_last_record(session, model):
+    instance = session.query(model).order_by(model.rid.desc()).first()
+    return instance
+
+
 # def insert_or_ignore(session, model, **kwargs):
 #     instance = session.query(model).filter_by(**kwargs).first()
 #     if not instance:
@@ -86,100 +352,53 @@ def update_record(session, model, rid, **kwargs):
 #         model.rid).all()
 #     return instances
 
-
-# def retrieve_last_record(session, model):
-#     instance = session.query(model).order_by(model.rid.desc()).first()
-#     return instance
-
-def world_lang_query_stmn(system_id, lang_code):
-    stmn = f"""
-        SELECT overflow_item.rid as rid,
-               overflow_item.item_id as iid,
-               overflow_item.bib_id as bid,
-               overflow_item.title as title,
-               overflow_item.author as author,
-               overflow_item.call_no as call_no,
-               overflow_item.pub_date as pub_date,
-               branch.code as branch,
-               mat_cat.code as mat_cat,
-               audience.code as audn,
-               language.code as lang
-        FROM overflow_item
-        JOIN branch ON overflow_item.src_branch_id = branch.rid
-        JOIN mat_cat ON overflow_item.mat_cat_id = mat_cat.rid
-        JOIN audience ON overflow_item.audn_id = audience.rid
-        JOIN language ON overflow_item.lang_id = language.rid
-            WHERE overflow_item.cart_id IS NULL
-                AND overflow_item.system_id=:system_id
-                AND language.code=:lang_code
-            ORDER BY call_no, author, title;
+def cart_items_query_stmn(system_id):
     """
-    stmn = text(stmn)
-    stmn = stmn.bindparams(
-        system_id=system_id,
-        lang_code=lang_code)
-    return stmn
-
-
-def english_query_stmn(system_id, audn_id, mat_cat_id):
-    stmn = f"""
-        SELECT overflow_item.rid as rid,
-               overflow_item.item_id as iid,
-               overflow_item.bib_id as bid,
-               overflow_item.title as title,
-               overflow_item.author as author,
-               overflow_item.call_no as call_no,
-               overflow_item.pub_date as pub_date,
-               branch.code as branch,
-               mat_cat.code as mat_cat,
-               audience.code as audn,
-               language.code as lang
-        FROM overflow_item
-        JOIN branch ON overflow_item.src_branch_id = branch.rid
-        JOIN mat_cat ON overflow_item.mat_cat_id = mat_cat.rid
-        JOIN audience ON overflow_item.audn_id = audience.rid
-        JOIN language ON overflow_item.lang_id = language.rid
-            WHERE overflow_item.cart_id IS NULL
-                AND overflow_item.system_id=:system_id
-                AND mat_cat.rid=:mat_cat_id
-                AND audience.rid=:audn_id
-                AND language.code='eng'
-            ORDER BY call_no, author, title;
+    Selects all unassigned items of the system that belong on a shopping
+    cart, ordered by tab, material category (or language for world
+    language materials) and call number. English materials go to the tab
+    of their audience, if their category has an order set for that tab.
     """
-
-    stmn = text(stmn)
-    stmn = stmn.bindparams(
-        system_id=system_id,
-        mat_cat_id=mat_cat_id,
-        audn_id=audn_id)
-    return stmn
-
-
-def get_relevant_lang_recs(session, system_id):
     stmn = f"""
-        SELECT DISTINCT language.rid, language.code, language.label
-          FROM language
-            JOIN overflow_item ON language.rid = overflow_item.lang_id
-          WHERE overflow_item.system_id=:system_id
-            AND overflow_item.cart_id IS NULL
-            AND language.code <> 'eng'
-          ORDER BY language.code
+        SELECT * FROM (
+            SELECT overflow_item.rid as rid,
+                   overflow_item.item_id as iid,
+                   overflow_item.bib_id as bid,
+                   overflow_item.title as title,
+                   overflow_item.author as author,
+                   overflow_item.call_no as call_no,
+                   overflow_item.pub_date as pub_date,
+                   mat_cat.rid as mat_cat_id,
+                   language.code as lang_code,
+                   language.label as lang_label,
+                   CASE WHEN language.code <> 'eng' THEN 'World Lang'
+                        ELSE audience.label
+                   END as tab,
+                   CASE WHEN language.code <> 'eng' THEN 4
+                        WHEN audience.label = 'Adults' THEN 1
+                        WHEN audience.label = 'Teens' THEN 2
+                        WHEN audience.label = 'Kids' THEN 3
+                   END as tab_order,
+                   CASE WHEN language.code <> 'eng' THEN NULL
+                        WHEN audience.label = 'Adults' THEN mat_cat.adults_order
+                        WHEN audience.label = 'Teens' THEN mat_cat.teens_order
+                        WHEN audience.label = 'Kids' THEN mat_cat.kids_order
+                   END as cat_order
+            FROM overflow_item
+            JOIN branch ON overflow_item.src_branch_id = branch.rid
+            JOIN mat_cat ON overflow_item.mat_cat_id = mat_cat.rid
+            JOIN audience ON overflow_item.audn_id = audience.rid
+            JOIN language ON overflow_item.lang_id = language.rid
+                WHERE overflow_item.cart_id IS NULL
+                    AND overflow_item.system_id=:system_id
+                    AND language.code IS NOT NULL
+        )
+            WHERE tab_order IS NOT NULL
+                AND (tab_order = 4 OR cat_order IS NOT NULL)
+            ORDER BY tab_order, cat_order, lang_code, call_no, author, title,
+                rid;
     """
     stmn = text(stmn)
     stmn = stmn.bindparams(
         system_id=system_id)
-    instances = session.execute(stmn)
-    lang_recs = [(c.rid, c.code, c.label) for c in instances]
-    return lang_recs
-
-
-def get_items4cart(session, system_id, audn_id, mat_cat_id, lang_code):
-    if lang_code == 'eng':
-        # English materials
-        stmn = english_query_stmn(system_id, audn_id, mat_cat_id)
-    else:
-        # world languages
-        stmn = world_lang_query_stmn(system_id, lang_code)
-
-    instances = session.execute(stmn)
-    return instances
+    return stmn
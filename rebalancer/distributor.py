@@ -1,7 +1,12 @@
-from datastore import session_scope, Cart, Hold, Branch
-from datastore_transactions import (retrieve_last_record, retrieve_records,
-                                    retrieve_record)
+from datetime import datetime
+
+from datastore import session_scope, Cart, HoldRequest, OverflowItem, Branch
+from datastore_transactions import (insert, retrieve_last_record,
+                                    retrieve_record, retrieve_records,
+                                    retrieve_records_cached)
 from adapters.sheet2store import set_new_branch
+from adapters.sierra.holds import (HOLD_RATE, HOLD_WORKERS, hold_item_id,
+                                   outcome_details, place_holds)
 from adapters.sierra.session import SierraSession
 
 
@@ -15,28 +20,156 @@ def get_latest_cart_record():
 
 def parse_cart_selections(tabs, sheet_id=None):
     if sheet_id is None:
-        sheet_id = get_latest_cart_record().google_sheet_id
+        sheet_id = get_latest_cart_record().shopping_cart_id
     set_new_branch(tabs, sheet_id)
 
 
-def issue_holds(api_url, sierra_key, sierra_secret, account_id, cart_id=None):
+def get_cart_holds(cart_id):
+    """
+    Lists holds to be placed for cart items with selected destination,
+    leaving out holds already placed or pending according to the hold
+    ledger; destination codes are resolved once from branch index
+    returns:
+        holds: list of tuples, (item_id, pickup location code)
+        skipped: list of tuples, (item_id, dst_branch_id) of items
+                 without destination branch code
+    """
+    holds = []
+    skipped = []
+    with session_scope() as db_session:
+        branch_codes = {
+            b.rid: b.code for b in retrieve_records_cached(
+                db_session, Branch)}
+        placed = {
+            r.item_id for r in retrieve_records(
+                db_session, HoldRequest, cart_id=cart_id)
+            if r.succeeded or r.pending}
+        recs = retrieve_records(db_session, OverflowItem, cart_id=cart_id)
+        for rec in recs:
+            if rec.dst_branch_id is None or rec.item_id in placed:
+                continue
+            code = branch_codes.get(rec.dst_branch_id)
+            if code:
+                holds.append((rec.item_id, code))
+            else:
+                skipped.append((rec.item_id, rec.dst_branch_id))
+    return holds, skipped
+
+
+def mark_hold_pending(db_session, cart_id, item_id, pickup_location):
+    """
+    Records in the hold ledger that a hold request is about to be sent,
+    counting it as an attempt
+    returns:
+        rec: HoldRequest instance
+    """
+    rec = retrieve_record(
+        db_session, HoldRequest, cart_id=cart_id, item_id=item_id)
+    if rec is None:
+        rec = insert(
+            db_session, HoldRequest, cart_id=cart_id, item_id=item_id,
+            attempts=0)
+    rec.pickup_location = pickup_location
+    rec.attempts = (rec.attempts or 0) + 1
+    rec.pending = True
+    rec.timestamp = datetime.now()
+    return rec
+
+
+def record_hold_outcome(db_session, cart_id, outcome):
+    """
+    Records outcome of hold attempts in the hold ledger; the first attempt
+    of a pending hold has already been counted
+    returns:
+        rec: HoldRequest instance
+    """
+    succeeded, status_code, error_code, description = outcome_details(
+        outcome)
+    rec = retrieve_record(
+        db_session, HoldRequest, cart_id=cart_id, item_id=outcome.item_id)
+    if rec is None:
+        rec = insert(
+            db_session, HoldRequest, cart_id=cart_id,
+            item_id=outcome.item_id, attempts=0)
+    attempts = outcome.attempts - 1 if rec.pending else outcome.attempts
+    rec.pickup_location = outcome.pickup_location
+    rec.attempts = (rec.attempts or 0) + attempts
+    rec.status_code = status_code
+    rec.error_code = error_code
+    rec.error_description = description
+    rec.succeeded = succeeded
+    rec.pending = False
+    rec.timestamp = datetime.now()
+    return rec
+
+
+def verify_pending_holds(db_session, ils_session, account_id, cart_id):
+    """
+    Resolves holds left pending by an interrupted run: ones found in
+    the account's hold list are recorded as placed, others are cleared
+    to be sent again
+    returns:
+        int: number of pending holds found in the account
+    """
+    recs = retrieve_records(
+        db_session, HoldRequest, cart_id=cart_id, pending=True)
+    if not recs:
+        return 0
+    held = {
+        hold_item_id(hold) for hold in ils_session.hold_iter_all(account_id)}
+    verified = 0
+    for rec in recs:
+        rec.pending = False
+        rec.timestamp = datetime.now()
+        if rec.item_id in held:
+            rec.succeeded = True
+            rec.status_code = rec.error_code = rec.error_description = None
+            verified += 1
+    return verified
+
+
+def issue_holds(
+        api_url, sierra_key, sierra_secret, account_id, cart_id=None,
+        workers=HOLD_WORKERS, rate=HOLD_RATE):
+    """
+    Places holds for selected cart items. Each hold is committed to
+    the hold ledger as pending before its request is sent and updated with
+    the outcome as soon as it is known. An interrupted run can be repeated:
+    pending holds are verified against the account's hold list and only
+    holds that have not been placed are sent.
+    returns:
+        tuple: (number of placed holds, number of failed holds)
+    """
     if cart_id is None:
-        cart_id = get_latest_cart_record().sid
+        cart_id = get_latest_cart_record().rid
+
+    placed = failed = 0
     with SierraSession(api_url, sierra_key, sierra_secret) as ils_session:
         with session_scope() as db_session:
-            recs = retrieve_records(
-                db_session, Hold,
-                cart_id=cart_id,
-                outstanding=False,
-                issued=True)
-
-            for rec in recs:
-                if rec.dst_branch_id != 1:
-                    dst_branch = retrieve_record(
-                        db_session, Branch, sid=rec.dst_branch_id)
-                    response = ils_session.hold_place_on_item(
-                        account_id, rec.item_id, dst_branch.code)
-                    print(
-                        f'i{rec.item_id}a,{rec.dst_branch_id},{dst_branch.code},{response.status_code},{response.text}')
+            verify_pending_holds(db_session, ils_session, account_id, cart_id)
+        holds, skipped = get_cart_holds(cart_id)
+        for item_id, dst_branch_id in skipped:
+            print(f'i{item_id}a,{dst_branch_id},None,,')
+
+        with session_scope() as db_session:
+
+            def pending_holds():
+                for item_id, pickup_location in holds:
+                    mark_hold_pending(
+                        db_session, cart_id, item_id, pickup_location)
+                    db_session.commit()
+                    yield item_id, pickup_location
+
+            for outcome in place_holds(
+                    ils_session, account_id, pending_holds(), workers, rate):
+                rec = record_hold_outcome(db_session, cart_id, outcome)
+                db_session.commit()
+                if rec.succeeded:
+                    placed += 1
                 else:
-                    print(f'i{rec.item_id}a,{rec.dst_branch_id},None,,')
+                    failed += 1
+                    print(
+                        f'i{rec.item_id}a,{rec.pickup_location},'
+                        f'{rec.status_code},{rec.error_code},'
+                        f'{rec.error_description}')
+    return placed, failed
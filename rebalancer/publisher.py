@@ -1,12 +1,62 @@
+from datastore import session_scope
+from datastore_transactions import (
+    delete_unassigned_items,
+    retrieve_unassigned_item_ids)
+from adapters.sierra.credentials import get_sierra_creds
+from adapters.sierra.items import (
+    ITEMS_BATCH_SIZE,
+    ITEMS_WORKERS,
+    find_unavailable_items)
+from adapters.sierra.session import SierraSession
 from adapters.sierra2store import save2store
 from adapters.store2sheet import create_shopping_cart
 
 
-def publish_rebalancing_items(fh):
-    save2store(fh)
-    create_shopping_cart()
+def drop_unavailable_items(
+        ils_session, system_id, batch_size=ITEMS_BATCH_SIZE,
+        workers=ITEMS_WORKERS):
+    """
+    Checks current Sierra status of items waiting for a cart and removes
+    ones returned as checked out, deleted, suppressed or otherwise
+    unavailable since the export. Items Sierra did not return are kept.
+    returns:
+        tuple: (int, set of int), number of removed items and numbers of
+               items not returned by Sierra
+    """
+    with session_scope() as session:
+        item_ids = retrieve_unassigned_item_ids(session, system_id)
+    unavailable, missing = find_unavailable_items(
+        ils_session, item_ids, batch_size, workers)
+    with session_scope() as session:
+        removed = delete_unassigned_items(session, system_id, unavailable)
+    return removed, missing
+
+
+def publish_rebalancing_items(
+        fh, system_id, verify=True, batch_size=ITEMS_BATCH_SIZE,
+        workers=ITEMS_WORKERS):
+    """
+    Loads Sierra export, drops items no longer available and publishes
+    the shopping cart
+    args:
+        fh: str, path to Sierra export file
+        system_id: int, datastore system id (1: BPL, 2: NYPL)
+        verify: boolean, check current status of items in Sierra
+        batch_size: int, number of items in a single status request
+        workers: int, number of concurrent status requests
+    """
+    save2store(fh, system_id)
+    if verify:
+        base, key, secret = get_sierra_creds()
+        with SierraSession(base, key, secret) as ils_session:
+            _, missing = drop_unavailable_items(
+                ils_session, system_id, batch_size, workers)
+        if missing:
+            print(f'{len(missing)} items not returned by Sierra were kept')
+    create_shopping_cart(system_id)
 
 
 if __name__ == '__main__':
     fh = './temp/sierra-export-3.txt'
-    publish_rebalancing_items(fh)
+    system_id = 2
+    publish_rebalancing_items(fh, system_id)
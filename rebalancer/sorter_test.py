@@ -1,5 +1,6 @@
 import json
 
+from adapters.sierra.holds import delete_account_holds
 from adapters.sierra.session import SierraSession
 from adapters.sierra.credentials import get_sierra_creds
 from distributor import issue_holds, parse_cart_selections
@@ -9,18 +10,25 @@ def get_hold_data(pid):
     base, key, secret = get_sierra_creds()
 
     with SierraSession(base, key, secret) as session:
-        res = session.hold_get_all(pid, limit=300)
-        res = res.json()
+        res = list(session.hold_iter_all(pid))
         with open(f'./temp/account-{pid}-holds.json', 'w') as jsonfile:
             json.dump(res, jsonfile, indent=4)
-        print(res)
+        print(f'{len(res)} holds')
+
+
+def print_progress(deleted, failed):
+    print(f'deleted: {deleted}, failed: {failed}', end='\r')
 
 
 def delete_holds_from_account(pid):
     base, key, secret = get_sierra_creds()
     with SierraSession(base, key, secret) as session:
-        res = session.hold_delete_all(pid)
-        return res
+        deleted, failures = delete_account_holds(
+            session, pid, progress=print_progress)
+        print()
+        for hid, reason in failures:
+            print(f'failed to delete hold {hid}: {reason}')
+        return deleted, failures
 
 
 def parse_sorter_test_shopping_cart(tabs, sheet_id):
@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+from context import datastore
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite://')
+    datastore.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    """
+    Session of an empty in-memory datastore; test modules seed their own
+    records by overriding this fixture
+    """
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def fake_session_scope(session, monkeypatch):
+    """
+    Makes modules' session_scope hand out the test session
+    usage:
+        fake_session_scope(distributor)
+    """
+    @contextmanager
+    def session_scope():
+        try:
+            yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+
+    def patch(*modules):
+        for module in modules:
+            monkeypatch.setattr(module, 'session_scope', session_scope)
+
+    return patch
+
+
+@pytest.fixture
+def file_store(tmp_path, monkeypatch):
+    """
+    Points datastore used by rebalancer modules to a temporary database file
+    returns:
+        session_scope of the datastore
+    """
+    store = sys.modules['datastore']
+    dal = store.DataAccessLayer(f'sqlite:///{tmp_path / "store.db"}')
+    monkeypatch.setattr(store, 'dal', dal)
+    store.migrate_datastore()
+    yield store.session_scope
+    dal.dispose()
@@ -6,8 +6,19 @@ sys.path.insert(0, p + '\\' + p.split('\\')[-1])
 sys.path.insert(0, p)
 
 
-from rebalancer import errors
+from rebalancer import (
+    datastore,
+    datastore_transactions,
+    distributor,
+    errors,
+    publisher
+)
 from rebalancer.adapters import (
+    pool,
+    sheet2store,
     sierra2store,
     store2sheet
 )
+from rebalancer.adapters.gdrive import service, sheet
+from rebalancer.adapters.sierra import holds, items
+from rebalancer.adapters.sierra import session as sierra_session
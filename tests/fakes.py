@@ -0,0 +1,49 @@
+import threading
+
+
+class FakeResponse:
+    """
+    Stand-in for requests.models.Response returned by Sierra API calls
+    """
+
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.text = '' if body is None else str(body)
+
+    def json(self):
+        if self.body is None:
+            raise ValueError
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ConnectionError(self.status_code)
+
+
+class FakeItemsSession:
+    """
+    Answers GET /items requests with records found among given ones
+    """
+
+    def __init__(self, records, status_code=200):
+        self.records = records
+        self.status_code = status_code
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def items_get_by_ids(self, iids):
+        with self.lock:
+            self.batches.append(list(iids))
+        entries = [self.records[i] for i in iids if i in self.records]
+        if not entries and self.status_code == 200:
+            return FakeResponse(404, {'code': 107})
+        return FakeResponse(
+            self.status_code, {'total': len(entries), 'entries': entries})
+
+
+def item(iid, code='-', **kwargs):
+    status = {'code': code, 'display': 'AVAILABLE'}
+    status.update(kwargs)
+    return {'id': str(iid), 'status': status}
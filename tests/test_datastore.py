@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import text
+
+
+from context import datastore, datastore_transactions
+
+
+def test_data_access_layer_reuses_engine(tmp_path):
+    dal = datastore.DataAccessLayer(f'sqlite:///{tmp_path / "store.db"}')
+    dal.connect()
+    engine = dal.engine
+    dal.connect()
+    assert dal.engine is engine
+
+    with dal.engine.connect() as conn:
+        conn.execute('SELECT 1')
+    assert engine.pool.checkedin() == 1
+
+    dal.dispose()
+    assert dal.engine is None
+    dal.connect()
+    assert dal.engine is not engine
+    dal.dispose()
+
+
+def test_data_access_layer_pool_options(tmp_path):
+    dal = datastore.DataAccessLayer(
+        f'sqlite:///{tmp_path / "store.db"}', pool_size=2, max_overflow=0)
+    dal.connect()
+    assert dal.engine.pool.size() == 2
+    dal.dispose()
+
+
+def test_data_access_layer_applies_profile_pragmas(tmp_path):
+    dal = datastore.DataAccessLayer(
+        f'sqlite:///{tmp_path / "store.db"}', profile='ingest')
+    dal.connect()
+    with dal.engine.connect() as conn:
+        assert conn.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert conn.execute('PRAGMA synchronous').scalar() == 1
+        assert conn.execute('PRAGMA temp_store').scalar() == 2
+
+    dal.use_profile('serve')
+    assert dal.engine is None
+    dal.connect()
+    with dal.engine.connect() as conn:
+        assert conn.execute('PRAGMA busy_timeout').scalar() == 10000
+    dal.dispose()
+
+
+def test_data_access_layer_unknown_profile():
+    with pytest.raises(datastore.RebalancerError):
+        datastore.DataAccessLayer('sqlite://', profile='turbo')
+
+
+def query_plan(engine, stmn):
+    plan = engine.execute(
+        text(f'EXPLAIN QUERY PLAN {stmn.text}'), **stmn.compile().params)
+    return [row[-1] for row in plan]
+
+
+def test_cart_query_plan_searches_unassigned_items_index(engine):
+    plan = query_plan(engine, datastore_transactions.cart_items_query_stmn(1))
+    assert any(
+        'overflow_item USING INDEX ix_overflow_item_unassigned' in step
+        for step in plan)
+    assert not any(step.startswith('SCAN overflow_item') for step in plan)
+    # tabs are ordered by values of joined tables, so the single query
+    # sorts its result once
+    assert sum('TEMP B-TREE' in step for step in plan) == 1
+
+
+def test_delete_unassigned_items_query_plan_searches_index(engine):
+    engine.execute('CREATE TEMP TABLE temp_item (item_id INTEGER PRIMARY KEY)')
+    plan = engine.execute(
+        'EXPLAIN QUERY PLAN DELETE FROM overflow_item '
+        'WHERE system_id=1 AND cart_id IS NULL '
+        'AND item_id IN (SELECT item_id FROM temp_item)').fetchall()
+    assert any(
+        'ix_overflow_item_unassigned (system_id=? AND item_id=?)' in row[-1]
+        for row in plan)
+
+
+def test_migrate_datastore_adds_missing_indexes(engine):
+    engine.execute('DROP INDEX ix_overflow_item_unassigned')
+    engine.execute(
+        'CREATE INDEX ix_overflow_item_unassigned_lang '
+        'ON overflow_item (system_id, lang_id)')
+    engine.execute('DROP TABLE export_checkpoint')
+    datastore.migrate_datastore(engine)
+    indexes = {
+        row[0] for row in engine.execute(
+            "SELECT name FROM sqlite_master WHERE type='index'")}
+    assert 'ix_overflow_item_unassigned' in indexes
+    assert 'ix_overflow_item_unassigned_lang' not in indexes
+    assert engine.dialect.has_table(engine, 'export_checkpoint')
+
+
+def test_migrate_datastore_adds_missing_columns(engine):
+    engine.execute('ALTER TABLE export_checkpoint DROP COLUMN fingerprint')
+    datastore.migrate_datastore(engine)
+    columns = {
+        row[1] for row in engine.execute(
+            'PRAGMA table_info(export_checkpoint)')}
+    assert {'fingerprint', 'first_rid', 'last_rid'} <= columns
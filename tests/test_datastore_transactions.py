@@ -0,0 +1,124 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import text
+
+
+from context import datastore, datastore_transactions
+
+
+@pytest.fixture
+def session(session):
+    session.add(datastore.System(rid=1, code='BKL', label='Brooklyn'))
+    session.add(datastore.Branch(rid=1, system_id=1, code='02', label='A'))
+    session.commit()
+    datastore_transactions.invalidate_reference_cache()
+    return session
+
+
+def test_retrieve_record_cached_returns_immutable_snapshot(session):
+    rec = datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='02')
+    assert rec.rid == 1
+    assert rec.label == 'A'
+    with pytest.raises(AttributeError):
+        rec.code = '03'
+
+
+def test_retrieve_record_cached_reuses_snapshot(session):
+    first = datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, system_id=1, code='02')
+    second = datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='02', system_id=1)
+    assert first is second
+
+
+def test_retrieve_record_cached_invalidated_by_orm_writes(session):
+    assert datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='03') is None
+    datastore_transactions.insert(
+        session, datastore.Branch, rid=2, system_id=1, code='03', label='B')
+    session.commit()
+    assert datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='03').rid == 2
+
+    datastore_transactions.update_record(
+        session, datastore.Branch, 2, label='C')
+    assert datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='03').label == 'C'
+
+
+def test_retrieve_records_cached_invalidated_by_bulk_insert(session):
+    recs = datastore_transactions.retrieve_records_cached(
+        session, datastore.Branch, system_id=1)
+    assert [r.code for r in recs] == ['02']
+    datastore_transactions.bulk_insert(
+        session, datastore.Branch,
+        [dict(rid=2, system_id=1, code='03', label='B')])
+    recs = datastore_transactions.retrieve_records_cached(
+        session, datastore.Branch, system_id=1)
+    assert [r.code for r in recs] == ['02', '03']
+
+
+def test_reference_cache_cleared_on_rollback(session):
+    datastore_transactions.insert(
+        session, datastore.Branch, rid=2, system_id=1, code='03', label='B')
+    assert datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='03').rid == 2
+    session.rollback()
+    assert datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='03') is None
+
+
+def test_reference_cache_invalidated_by_core_and_text_writes(session):
+    assert datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='03') is None
+    session.execute(datastore.Branch.__table__.insert(), dict(
+        rid=2, system_id=1, code='03', label='B'))
+    assert datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='03').label == 'B'
+    session.execute(text("UPDATE branch SET label='C' WHERE rid=2"))
+    assert datastore_transactions.retrieve_record_cached(
+        session, datastore.Branch, code='03').label == 'C'
+
+
+def test_reference_cache_kept_apart_for_each_database(session):
+    other_engine = create_engine('sqlite://')
+    datastore.Base.metadata.create_all(other_engine)
+    other = sessionmaker(bind=other_engine)()
+    other.add(datastore.Branch(rid=1, system_id=1, code='02', label='Z'))
+    other.commit()
+    try:
+        assert datastore_transactions.retrieve_record_cached(
+            session, datastore.Branch, code='02').label == 'A'
+        assert datastore_transactions.retrieve_record_cached(
+            other, datastore.Branch, code='02').label == 'Z'
+    finally:
+        other.close()
+        other_engine.dispose()
+
+
+def add_overflow_items(session, items):
+    session.add(datastore.Audience(rid=1, code='a', label='Adults'))
+    session.add(datastore.Language(rid=1, code='eng', label='English'))
+    session.add(datastore.MatCat(rid=1, system_id=1, code='fi', label='Fic'))
+    session.add(datastore.ShelfCode(rid=1, system_id=1, code='fc'))
+    session.add(datastore.ItemType(rid=1, system_id=1, code=0))
+    session.add(datastore.Cart(rid=1, system_id=1, shopping_cart_id='s'))
+    for rid, item_id, cart_id in items:
+        session.add(datastore.OverflowItem(
+            rid=rid, system_id=1, cart_id=cart_id, bib_id=rid, title='T',
+            item_id=item_id, src_branch_id=1, src_branch_shelf_id=1,
+            mat_cat_id=1, audn_id=1, lang_id=1, item_type_id=1))
+    session.commit()
+
+
+def test_delete_unassigned_items(session):
+    add_overflow_items(session, [(1, 101, None), (2, 102, None), (3, 103, 1)])
+    assert sorted(datastore_transactions.retrieve_unassigned_item_ids(
+        session, 1)) == [101, 102]
+    assert datastore_transactions.delete_unassigned_items(
+        session, 1, [102, 103, 104]) == 1
+    assert datastore_transactions.delete_unassigned_items(session, 1, []) == 0
+    assert [r.item_id for r in session.query(datastore.OverflowItem).order_by(
+        datastore.OverflowItem.rid)] == [101, 103]
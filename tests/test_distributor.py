@@ -0,0 +1,147 @@
+import pytest
+
+
+from context import datastore, distributor, holds
+from fakes import FakeResponse
+
+
+@pytest.fixture
+def session(session, fake_session_scope):
+    session.add(datastore.System(rid=2, code='NYP', label='NYPL'))
+    session.add(datastore.Audience(rid=1, code='a', label='Adults'))
+    session.add(datastore.Language(rid=1, code='eng', label='English'))
+    session.add(datastore.MatCat(rid=1, system_id=2, code='fi', label='Fic'))
+    session.add(datastore.Branch(rid=1, system_id=2, code=None))
+    session.add(datastore.Branch(rid=2, system_id=2, code='ag'))
+    session.add(datastore.ShelfCode(rid=1, system_id=2, code='fc'))
+    session.add(datastore.ItemType(rid=1, system_id=2, code=0))
+    session.add(datastore.Cart(rid=1, system_id=2, shopping_cart_id='sheet'))
+    for rid, dst_branch_id in [(1, 2), (2, 2), (3, 1), (4, None)]:
+        session.add(datastore.OverflowItem(
+            rid=rid, system_id=2, cart_id=1, bib_id=rid, title='T',
+            item_id=100 + rid, src_branch_id=1, src_branch_shelf_id=1,
+            dst_branch_id=dst_branch_id, mat_cat_id=1, audn_id=1, lang_id=1,
+            item_type_id=1))
+    session.commit()
+    fake_session_scope(distributor)
+    return session
+
+
+def test_get_cart_holds(session):
+    assert distributor.get_cart_holds(1) == ([(101, 'ag'), (102, 'ag')], [
+        (103, 1)])
+
+
+def test_record_hold_outcome_accumulates_attempts(session):
+    denied = FakeResponse(500, {'code': 132, 'description': 'denied'})
+    distributor.record_hold_outcome(
+        session, 1, holds.HoldOutcome(101, 'ag', denied, None, 2))
+    session.commit()
+    distributor.record_hold_outcome(
+        session, 1, holds.HoldOutcome(101, 'ag', FakeResponse(204), None, 1))
+    session.commit()
+
+    rec = session.query(datastore.HoldRequest).one()
+    assert (rec.item_id, rec.attempts, rec.status_code, rec.error_code,
+            rec.succeeded) == (101, 3, 204, None, True)
+
+
+def test_get_cart_holds_skips_placed_holds(session):
+    distributor.record_hold_outcome(
+        session, 1, holds.HoldOutcome(101, 'ag', FakeResponse(204), None, 1))
+    distributor.record_hold_outcome(
+        session, 1, holds.HoldOutcome(102, 'ag', FakeResponse(503), None, 4))
+    session.commit()
+    assert distributor.get_cart_holds(1)[0] == [(102, 'ag')]
+
+
+class FakeHoldsApi:
+    """
+    Sierra session accepting every hold on the account and listing
+    the holds placed so far
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def __call__(self, api_url, key, secret):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def hold_place_on_item(self, pid, iid, pickup_location):
+        self.sent.append(iid)
+        return FakeResponse(204)
+
+    def hold_iter_all(self, pid):
+        base = 'https://sierra/iii/sierra-api/v5/'
+        for n, iid in enumerate(self.sent):
+            yield {'id': f'{base}patrons/holds/{n}',
+                   'record': f'{base}items/{iid}'}
+
+
+def ledger(session):
+    session.expire_all()
+    return [
+        (r.item_id, r.attempts, r.succeeded, r.pending)
+        for r in session.query(datastore.HoldRequest).order_by(
+            datastore.HoldRequest.item_id)]
+
+
+def test_issue_holds_marks_holds_pending_before_sending(
+        session, monkeypatch):
+    monkeypatch.setattr(distributor, 'SierraSession', FakeHoldsApi())
+    sent = []
+
+    def place_holds(ils_session, account_id, pending_holds, workers, rate):
+        for item_id, pickup_location in pending_holds:
+            sent.append(ledger(session))
+            yield holds.HoldOutcome(
+                item_id, pickup_location, FakeResponse(204), None, 1)
+
+    monkeypatch.setattr(distributor, 'place_holds', place_holds)
+    assert distributor.issue_holds(
+        'url', 'key', 'secret', 1, cart_id=1) == (2, 0)
+    assert sent[0] == [(101, 1, False, True)]
+    assert sent[1] == [(101, 1, True, False), (102, 1, False, True)]
+    assert ledger(session) == [(101, 1, True, False), (102, 1, True, False)]
+
+
+def test_issue_holds_verifies_pending_holds_after_crash(
+        session, monkeypatch):
+    api = FakeHoldsApi()
+    monkeypatch.setattr(distributor, 'SierraSession', api)
+    record_hold_outcome = distributor.record_hold_outcome
+
+    def crash(db_session, cart_id, outcome):
+        # process dies after Sierra accepted the hold, before the commit
+        raise SystemExit
+
+    monkeypatch.setattr(distributor, 'record_hold_outcome', crash)
+    with pytest.raises(SystemExit):
+        distributor.issue_holds(
+            'url', 'key', 'secret', 1, cart_id=1, workers=1, rate=None)
+    assert api.sent
+    assert all(pending for *_, pending in ledger(session))
+
+    monkeypatch.setattr(
+        distributor, 'record_hold_outcome', record_hold_outcome)
+    distributor.issue_holds(
+        'url', 'key', 'secret', 1, cart_id=1, workers=1, rate=None)
+    assert sorted(api.sent) == [101, 102]
+    # a hold cut off before its request went out counts one more attempt
+    assert [rec[2:] for rec in ledger(session)] == [(True, False)] * 2
+    assert ledger(session)[0] == (101, 1, True, False)
+
+
+def test_record_hold_outcome_of_pending_hold_counts_attempt_once(session):
+    distributor.mark_hold_pending(session, 1, 101, 'ag')
+    session.commit()
+    distributor.record_hold_outcome(
+        session, 1, holds.HoldOutcome(101, 'ag', FakeResponse(204), None, 2))
+    session.commit()
+    assert ledger(session) == [(101, 2, True, False)]
@@ -0,0 +1,184 @@
+import threading
+import time
+
+import pytest
+
+
+from context import holds
+from fakes import FakeResponse
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeSierraSession:
+    def __init__(self, delay=0.01, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def hold_place_on_item(self, pid, iid, pickup_location):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if iid in self.failing:
+            raise ConnectionError
+        return FakeResponse(204, (pid, iid, pickup_location))
+
+
+def test_rate_limiter_spaces_out_calls():
+    clock = FakeClock()
+    limiter = holds.RateLimiter(4, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        limiter.acquire()
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_rate_limiter_allows_burst():
+    clock = FakeClock()
+    limiter = holds.RateLimiter(2, burst=3, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == []
+    limiter.acquire()
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_rate_limiter_disabled():
+    clock = FakeClock()
+    limiter = holds.RateLimiter(None, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        limiter.acquire()
+    assert clock.sleeps == []
+
+
+def test_place_holds_concurrently():
+    session = FakeSierraSession()
+    requested = [(iid, 'ag') for iid in range(40)]
+    outcomes = list(holds.place_holds(
+        session, 1, requested, workers=4, rate=None))
+    assert sorted(o.response.body for o in outcomes) == [
+        (1, iid, 'ag') for iid in range(40)]
+    assert 1 < session.max_active <= 4
+
+
+def test_place_holds_reports_failed_requests():
+    session = FakeSierraSession(delay=0, failing=[2])
+    outcomes = {
+        o.item_id: o for o in holds.place_holds(
+            session, 1, [(1, 'ag'), (2, 'bc')], workers=2, rate=None,
+            retries=2, backoff=0)}
+    assert outcomes[1].error is None
+    assert outcomes[1].attempts == 1
+    assert outcomes[2].response is None
+    assert isinstance(outcomes[2].error, ConnectionError)
+    assert outcomes[2].attempts == 3
+
+
+class ScriptedSierraSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def hold_place_on_item(self, pid, iid, pickup_location):
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(holds.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_place_hold_retries_transient_statuses(sleeps):
+    session = ScriptedSierraSession([
+        FakeResponse(503), FakeResponse(429, headers={'Retry-After': '5'}),
+        FakeResponse(204)])
+    outcome = holds.place_hold(
+        session, 1, 10, 'ag', holds.RateLimiter(None), backoff=1)
+    assert outcome.response.status_code == 204
+    assert outcome.attempts == 3
+    assert sleeps == [1, 5]
+
+
+def test_place_hold_does_not_retry_denied_hold(sleeps):
+    session = ScriptedSierraSession([FakeResponse(500), FakeResponse(204)])
+    outcome = holds.place_hold(session, 1, 10, 'ag', holds.RateLimiter(None))
+    assert outcome.response.status_code == 500
+    assert outcome.attempts == 1
+    assert sleeps == []
+
+
+def test_outcome_details():
+    denied = FakeResponse(500, {
+        'code': 132, 'specificCode': 2, 'httpStatus': 500,
+        'name': 'XCirc error',
+        'description': 'XCirc error : Request denied - already on hold'})
+    assert holds.outcome_details(
+        holds.HoldOutcome(1, 'ag', denied, None, 1)) == (
+            False, 500, 132, 'XCirc error : Request denied - already on hold')
+    assert holds.outcome_details(
+        holds.HoldOutcome(1, 'ag', FakeResponse(204), None, 1)) == (
+            True, 204, None, None)
+    assert holds.outcome_details(
+        holds.HoldOutcome(1, 'ag', None, TimeoutError(), 4)) == (
+            False, None, None, 'TimeoutError()')
+
+
+class FakeHoldsSession:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.deleted = []
+        self.lock = threading.Lock()
+
+    def hold_iter_all(self, pid):
+        for hid in self.statuses:
+            yield {'id': f'https://sierra/iii/sierra-api/v5/patrons/holds/{hid}'}
+
+    def hold_delete_by_id(self, hid):
+        with self.lock:
+            self.deleted.append(hid)
+        status = self.statuses[hid]
+        if isinstance(status, Exception):
+            raise status
+        return FakeResponse(status)
+
+
+def test_hold_id():
+    assert holds.hold_id(
+        {'id': 'https://sierra/iii/sierra-api/v5/patrons/holds/123'}) == 123
+
+
+def test_hold_item_id():
+    base = 'https://sierra/iii/sierra-api/v5/'
+    assert holds.hold_item_id({'record': f'{base}items/1234567'}) == 1234567
+    assert holds.hold_item_id({'record': f'{base}bibs/1234567'}) is None
+    assert holds.hold_item_id({'id': f'{base}patrons/holds/1'}) is None
+
+
+def test_delete_account_holds(sleeps):
+    session = FakeHoldsSession(
+        {1: 204, 2: 404, 3: 500, 4: ValueError('bad'), 5: 204})
+    progress = []
+    deleted, failures = holds.delete_account_holds(
+        session, 1, workers=2, rate=None,
+        progress=lambda d, f: progress.append((d, f)))
+    assert deleted == 3
+    assert sorted(session.deleted) == [1, 2, 3, 4, 5]
+    assert sorted(f[0] for f in failures) == [3, 4]
+    assert progress[-1] == (3, 2) and len(progress) == 5
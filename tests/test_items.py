@@ -0,0 +1,37 @@
+import pytest
+
+
+from context import items
+from fakes import FakeItemsSession, item
+
+
+def test_is_available():
+    assert items.is_available(item(1))
+    assert not items.is_available(item(1, duedate='2020-03-01T08:00:00Z'))
+    assert not items.is_available(item(1, code='t'))
+    assert not items.is_available(dict(item(1), deleted=True))
+    assert not items.is_available(dict(item(1), suppressed=True))
+    assert not items.is_available({'id': '1'})
+    assert not items.is_available(dict(item(1), holdCount=1))
+    assert items.is_available(dict(item(1), holdCount=0))
+
+
+def test_find_unavailable_items():
+    session = FakeItemsSession({
+        1: item(1), 2: item(2, code='m'), 3: item(3), 5: item(5, code='!')})
+    unavailable, missing = items.find_unavailable_items(
+        session, [1, 2, 3, 4, 5, 6, 1], batch_size=2, workers=2)
+    assert unavailable == {2, 5}
+    assert missing == {4, 6}
+    assert sorted(session.batches) == [[1, 2], [3, 4], [5, 6]]
+
+
+def test_find_unavailable_items_raises_api_errors():
+    session = FakeItemsSession({1: item(1)}, status_code=500)
+    with pytest.raises(ConnectionError):
+        items.find_unavailable_items(session, [1])
+
+
+def test_find_unavailable_items_none_returned():
+    session = FakeItemsSession({})
+    assert items.find_unavailable_items(session, [1, 2]) == (set(), {1, 2})
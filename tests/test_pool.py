@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+from context import pool
+
+
+def test_iter_results_in_order_of_calls():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        calls = [(pow, (n, 2)) for n in range(20)]
+        results = pool.iter_results(executor, calls, 8, ordered=True)
+        assert list(results) == [n ** 2 for n in range(20)]
+
+
+def test_iter_results_in_order_of_completion():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        calls = [(pow, (n, 2)) for n in range(20)]
+        results = pool.iter_results(executor, calls, 8)
+        assert sorted(results) == [n ** 2 for n in range(20)]
+
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_iter_results_bounds_calls_in_flight(ordered):
+    submitted = []
+
+    def calls():
+        for n in range(20):
+            submitted.append(n)
+            yield abs, (n,)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = pool.iter_results(executor, calls(), 4, ordered=ordered)
+        next(results)
+        assert len(submitted) <= 4
+        results.close()
+
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_iter_results_cancels_pending_calls_on_error(ordered):
+    release = threading.Event()
+    started = []
+
+    def blocked(n):
+        started.append(n)
+        release.wait(5)
+        return n
+
+    def fail():
+        raise ValueError
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        calls = [(fail, ())] + [(blocked, (n,)) for n in range(5)]
+        with pytest.raises(ValueError):
+            for _ in pool.iter_results(
+                    executor, calls, 3, ordered=ordered):
+                pass
+        release.set()
+    # only the call already running when the error surfaced completes
+    assert len(started) <= 1
@@ -0,0 +1,47 @@
+import pytest
+
+
+from context import datastore, publisher
+from fakes import FakeItemsSession, item
+
+
+@pytest.fixture
+def session(session):
+    session.add(datastore.Cart(rid=1, system_id=1, shopping_cart_id='s'))
+    for rid, item_id, cart_id in [
+            (1, 101, None), (2, 102, None), (3, 103, None), (4, 104, None),
+            (5, 105, 1)]:
+        session.add(datastore.OverflowItem(
+            rid=rid, system_id=1, cart_id=cart_id, bib_id=rid, title='T',
+            item_id=item_id, src_branch_id=1, src_branch_shelf_id=1,
+            mat_cat_id=1, audn_id=1, lang_id=1, item_type_id=1))
+    session.commit()
+    return session
+
+
+def stored_item_ids(session):
+    return sorted(r.item_id for r in session.query(datastore.OverflowItem))
+
+
+def test_drop_unavailable_items(session, fake_session_scope):
+    fake_session_scope(publisher)
+    ils_session = FakeItemsSession({
+        101: item(101), 102: item(102, code='m'),
+        103: dict(item(103), holdCount=1),
+        105: item(105, code='m')})
+    removed, missing = publisher.drop_unavailable_items(
+        ils_session, 1, batch_size=2, workers=2)
+    assert removed == 2
+    assert missing == {104}
+    assert stored_item_ids(session) == [101, 104, 105]
+    assert sorted(ils_session.batches) == [[101, 102], [103, 104]]
+
+
+def test_drop_unavailable_items_keeps_items_not_returned(
+        session, fake_session_scope):
+    fake_session_scope(publisher)
+    removed, missing = publisher.drop_unavailable_items(
+        FakeItemsSession({}), 1)
+    assert removed == 0
+    assert missing == {101, 102, 103, 104}
+    assert stored_item_ids(session) == [101, 102, 103, 104, 105]
@@ -0,0 +1,111 @@
+import threading
+
+import httplib2
+import pytest
+
+
+from context import service
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    built = []
+
+    def build_service(api, version, creds):
+        built.append((api, version, creds))
+        return object()
+
+    monkeypatch.setattr(service, 'build_service', build_service)
+    service.clear_services()
+    yield built
+    service.clear_services()
+
+
+def test_get_service_reuses_client_per_credentials(builds):
+    creds = object()
+    sheets = service.get_service('sheets', 'v4', creds)
+    assert service.get_service('sheets', 'v4', creds) is sheets
+    assert service.get_service('drive', 'v3', creds) is not sheets
+    assert service.get_service('sheets', 'v4', object()) is not sheets
+    assert len(builds) == 3
+
+
+def test_get_service_builds_client_per_thread(builds):
+    creds = object()
+    clients = [service.get_service('sheets', 'v4', creds)]
+    thread = threading.Thread(
+        target=lambda: clients.append(
+            service.get_service('sheets', 'v4', creds)))
+    thread.start()
+    thread.join()
+    assert clients[0] is not clients[1]
+
+
+def test_load_discovery_document(tmp_path, monkeypatch):
+    (tmp_path / 'sheets.v4.json').write_text('{"name": "sheets"}')
+    monkeypatch.setattr(service, 'DISCOVERY_DIR', str(tmp_path))
+    monkeypatch.setattr(service, '_documents', {})
+    assert service.load_discovery_document('sheets', 'v4') == (
+        '{"name": "sheets"}')
+    assert service.load_discovery_document('drive', 'v3') is None
+
+
+class FakeHttp:
+    """
+    Answers discovery requests with queued (status, content) pairs
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.urls = []
+
+    def request(self, url):
+        self.urls.append(url)
+        status, content = self.responses.pop(0)
+        return httplib2.Response({'status': status}), content
+
+
+def test_fetch_discovery_document_falls_back_to_v2_endpoint(monkeypatch):
+    fake_http = FakeHttp([(404, b''), (200, b'{"name": "sheets"}')])
+    monkeypatch.setattr(
+        service, 'AuthorizedHttp', lambda creds, **kwargs: fake_http)
+    assert service.fetch_discovery_document(None, 'sheets', 'v4') == (
+        '{"name": "sheets"}')
+    assert fake_http.urls == [
+        'https://www.googleapis.com/discovery/v1/apis/sheets/v4/rest',
+        'https://sheets.googleapis.com/$discovery/rest?version=v4']
+
+
+def test_get_discovery_document_fetched_once_per_process(
+        tmp_path, monkeypatch):
+    fetched = []
+
+    def fetch_discovery_document(creds, api, version):
+        fetched.append((api, version))
+        return '{"name": "sheets"}'
+
+    monkeypatch.setattr(service, 'DISCOVERY_DIR', str(tmp_path))
+    monkeypatch.setattr(service, '_documents', {})
+    monkeypatch.setattr(service, '_fetched', {})
+    monkeypatch.setattr(
+        service, 'fetch_discovery_document', fetch_discovery_document)
+    threads = [
+        threading.Thread(target=service.get_discovery_document,
+                         args=(object(), 'sheets', 'v4'))
+        for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fetched == [('sheets', 'v4')]
+
+
+def test_save_discovery_document(tmp_path, monkeypatch):
+    monkeypatch.setattr(service, 'DISCOVERY_DIR', str(tmp_path))
+    monkeypatch.setattr(service, '_documents', {})
+    monkeypatch.setattr(
+        service, 'fetch_discovery_document',
+        lambda creds, api, version: '{"name": "drive"}')
+    service.save_discovery_document(None, 'drive', 'v3')
+    assert service.load_discovery_document('drive', 'v3') == (
+        '{"name": "drive"}')
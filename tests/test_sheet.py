@@ -0,0 +1,166 @@
+import threading
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+
+from context import sheet
+
+
+class FakeService:
+    """
+    Records values.batchUpdate and batchUpdate bodies; failures is a list
+    of exceptions raised by consecutive values.batchUpdate calls
+    """
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.values_bodies = []
+        self.update_bodies = []
+        self.lock = threading.Lock()
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchUpdate(self, spreadsheetId, body):
+        return FakeRequest(self, body)
+
+
+class FakeRequest:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        with self.service.lock:
+            if 'valueInputOption' not in self.body:
+                self.service.update_bodies.append(self.body)
+                return {}
+            if self.service.failures:
+                raise self.service.failures.pop(0)
+            self.service.values_bodies.append(self.body)
+            return {}
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'')
+
+
+@pytest.fixture
+def service(monkeypatch):
+    fake = FakeService()
+    monkeypatch.setattr(sheet, 'get_service', lambda api, version, creds: fake)
+    monkeypatch.setattr(sheet.time, 'sleep', lambda seconds: None)
+    return fake
+
+
+def test_tab_ids():
+    assert sheet.tab_ids(['Adults', 'Kids', 'branch codes']) == {
+        'Adults': 0, 'Kids': 1, 'branch codes': 2}
+
+
+def test_iter_value_payloads_single_payload():
+    payloads = list(sheet.iter_value_payloads([
+        ('Adults', ['h1', 'h2']), ('branch codes', ['branch codes']),
+        ('Adults', ['a', 'b']), ('branch codes', ['ag'])]))
+    assert payloads == [[
+        {'range': "'Adults'!A1", 'values': [['h1', 'h2']]},
+        {'range': "'branch codes'!A1", 'values': [['branch codes']]},
+        {'range': "'Adults'!A2", 'values': [['a', 'b']]},
+        {'range': "'branch codes'!A2", 'values': [['ag']]}]]
+
+
+def test_iter_value_payloads_splits_at_row_limit():
+    rows = [[n, n] for n in range(5)]
+    payloads = list(sheet.iter_value_payloads(
+        [('Adults', r) for r in rows] + [('Kids', ['k'])], max_rows=2))
+    assert payloads == [
+        [{'range': "'Adults'!A1", 'values': rows[:2]}],
+        [{'range': "'Adults'!A3", 'values': rows[2:4]}],
+        [{'range': "'Adults'!A5", 'values': rows[4:]},
+         {'range': "'Kids'!A1", 'values': [['k']]}]]
+
+
+def test_iter_value_payloads_splits_at_byte_limit():
+    rows = [('Adults', ['x' * 10]) for _ in range(4)]
+    payloads = list(sheet.iter_value_payloads(rows, max_bytes=40))
+    assert [len(p[0]['values']) for p in payloads] == [2, 2]
+    assert [p[0]['range'] for p in payloads] == [
+        "'Adults'!A1", "'Adults'!A3"]
+
+
+def test_write_payload_retries_transient_errors(service):
+    service.failures = [http_error(429), ConnectionError()]
+    payload = [{'range': "'Adults'!A1", 'values': [['a'], ['b']]}]
+    assert sheet.write_payload(None, 'sheet-id', payload) == 2
+    assert service.values_bodies == [
+        {'valueInputOption': 'USER_ENTERED', 'data': payload}]
+
+
+def test_write_payload_does_not_retry_bad_request(service):
+    service.failures = [http_error(400)]
+    with pytest.raises(HttpError):
+        sheet.write_payload(None, 'sheet-id', [])
+    assert service.failures == []
+
+
+def test_write_payload_gives_up_after_retries(service):
+    service.failures = [http_error(503)] * 3
+    with pytest.raises(HttpError):
+        sheet.write_payload(None, 'sheet-id', [], retries=2)
+
+
+def test_write_values_reports_progress(service):
+    progress = []
+    rows = [('Adults', [n]) for n in range(25)]
+    written = sheet.write_values(
+        None, 'sheet-id', rows, workers=3, progress=progress.append,
+        max_rows=10)
+    assert written == 25
+    assert sorted(progress)[-1] == 25 and len(progress) == 3
+    ranges = sorted(
+        (body['data'][0]['range'], len(body['data'][0]['values']))
+        for body in service.values_bodies)
+    assert ranges == [
+        ("'Adults'!A1", 10), ("'Adults'!A11", 10), ("'Adults'!A21", 5)]
+
+
+def test_write_values_raises_failed_payload(service):
+    service.failures = [http_error(400)]
+    with pytest.raises(HttpError):
+        sheet.write_values(
+            None, 'sheet-id', [('Adults', [n]) for n in range(5)],
+            workers=1, max_rows=1)
+
+
+def test_publish_cart(service, monkeypatch):
+    monkeypatch.setattr(
+        sheet, 'shopping_cart_data_tab_template',
+        lambda tab_id, branch_count: {'requests': [('data', tab_id)]})
+    monkeypatch.setattr(
+        sheet, 'shopping_cart_validation_tab_template',
+        lambda tab_id: {'requests': [('validation', tab_id)]})
+    rows = [
+        ('Adults', ['Fiction'], True), ('Adults', [None, 'a'], False),
+        ('Adults', ['800s'], True), ('branch codes', ['ag'], False)]
+    sheet.publish_cart(
+        None, 'sheet-id', ['Adults', 'Kids', 'branch codes'], 1, rows)
+
+    assert len(service.values_bodies) == 1
+    assert service.values_bodies[0]['data'] == [
+        {'range': "'Adults'!A1", 'values': [sheet.DATA_TAB_HEADER]},
+        {'range': "'Kids'!A1", 'values': [sheet.DATA_TAB_HEADER]},
+        {'range': "'branch codes'!A1",
+         'values': [sheet.VALIDATION_TAB_HEADER]},
+        {'range': "'Adults'!A2",
+         'values': [['Fiction'], [None, 'a'], ['800s']]},
+        {'range': "'branch codes'!A2", 'values': [['ag']]}]
+    assert len(service.update_bodies) == 1
+    assert service.update_bodies[0]['requests'] == [
+        ('data', 0),
+        *sheet.cat_headings_formating(0, [1, 3])['requests'],
+        ('data', 1), ('validation', 2)]
@@ -0,0 +1,80 @@
+import pytest
+
+
+from context import datastore, sheet2store
+
+
+@pytest.fixture
+def session(session):
+    session.add(datastore.System(rid=2, code='NYP', label='NYPL'))
+    session.add(datastore.Audience(rid=1, code='a', label='Adults'))
+    session.add(datastore.Language(rid=1, code='eng', label='English'))
+    session.add(datastore.MatCat(rid=1, system_id=2, code='fi', label='Fic'))
+    session.add(datastore.Branch(rid=1, system_id=2, code=None))
+    session.add(datastore.Branch(rid=2, system_id=2, code='ag'))
+    session.add(datastore.Branch(rid=3, system_id=2, code='bc'))
+    session.add(datastore.ShelfCode(rid=1, system_id=2, code='fc'))
+    session.add(datastore.ItemType(rid=1, system_id=2, code=0))
+    session.add(datastore.Cart(rid=1, system_id=2, shopping_cart_id='old'))
+    session.add(datastore.Cart(rid=2, system_id=2, shopping_cart_id='new'))
+    for rid, cart_id in [(1, 2), (2, 2), (3, 2), (4, 1)]:
+        session.add(datastore.OverflowItem(
+            rid=rid, system_id=2, cart_id=cart_id, bib_id=rid, title='T',
+            item_id=100 + rid % 4, src_branch_id=1, src_branch_shelf_id=1,
+            mat_cat_id=1, audn_id=1, lang_id=1, item_type_id=1))
+    session.commit()
+    return session
+
+
+class FakeService:
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchGet(self, **kwargs):
+        self.requests.append(kwargs)
+        return self
+
+    def execute(self):
+        return self.response
+
+
+def test_parse_selections():
+    rows = [
+        ['item #', 'new branch'], [], ['101', 'ag '], ['102'], ['103', ''],
+        ['104', 'bc']]
+    assert sheet2store.parse_selections(rows, {None: 1, 'ag': 2, 'bc': 3}) == [
+        (101, 2), (102, 1), (103, 1), (104, 3)]
+
+
+def test_parse_selections_unknown_branch_code():
+    with pytest.raises(datastore.RebalancerError):
+        sheet2store.parse_selections([['101', 'zz']], {None: 1, 'ag': 2})
+
+
+def test_set_new_branch(session, fake_session_scope, monkeypatch):
+    service = FakeService({'valueRanges': [
+        {'range': "'Adults'!G2:H4", 'values': [[], ['101', 'ag'], ['102']]},
+        {'range': "'Kids'!G2:H2", 'values': [['103', 'bc']]},
+        {'range': "'Teens'!G2:H2"}]})
+    fake_session_scope(sheet2store)
+    monkeypatch.setattr(sheet2store, 'get_access_token', lambda: None)
+    monkeypatch.setattr(
+        sheet2store, 'get_service', lambda api, version, creds: service)
+
+    assert sheet2store.set_new_branch(['Adults', 'Kids', 'Teens'], 'new') == 3
+    assert service.requests == [{
+        'spreadsheetId': 'new',
+        'ranges': ["'Adults'!G2:H", "'Kids'!G2:H", "'Teens'!G2:H"],
+        'majorDimension': 'ROWS'}]
+    items = session.query(datastore.OverflowItem).order_by(
+        datastore.OverflowItem.rid)
+    # item 100 (rid 4) belongs to another cart
+    assert [(i.item_id, i.dst_branch_id) for i in items] == [
+        (101, 2), (102, 1), (103, 3), (100, None)]
@@ -1,7 +1,18 @@
-from datetime import date
+from collections import Counter
+from datetime import date, datetime
+import itertools
+import json
+import os
+import shutil
 
+import pytest
 
-from context import sierra2store
+
+from context import datastore, sierra2store
+
+
+FILES = os.path.join(os.path.dirname(__file__), 'files')
+DATA = os.path.join(os.path.dirname(__file__), '..', 'rebalancer', 'data')
 
 
 def test_parse_ids_positive():
@@ -92,6 +103,19 @@ def test_string2date_when_date_str_invalid():
         '2019-03-02') is None
 
 
+def test_string2date_matches_strptime():
+    samples = [
+        '03-02-2019', '3-2-2019', '12-31-1999 23:59:01.0', '02-30-2019',
+        '13-01-2019', '00-00-0000', '01-01-0001', '  -  -  ', '03/02/2019',
+        '03-02-19 11', '\uff10\uff13-02-2019', '', 'a']
+    for sample in samples:
+        try:
+            expected = datetime.strptime(sample[:10], '%m-%d-%Y').date()
+        except ValueError:
+            expected = None
+        assert sierra2store.string2date(sample) == expected, sample
+
+
 def test_get_audn_id():
     audn_idx = {
         None: 1,
@@ -134,6 +158,28 @@ def test_get_language_id():
         'ARA J-E ADAMS', lang_idx) == 2
 
 
+def test_get_language_id_tie_break_follows_index_order():
+    lang_idx = {
+        None: 1,
+        'spa': 19,
+        'chi': 4,
+        'eng': 5}
+    assert sierra2store.get_language_id(
+        'CHI SPA FIC A', lang_idx) == 19
+    lang_priority = sierra2store.create_lang_priority(lang_idx)
+    assert sierra2store.get_language_id(
+        'CHI SPA FIC A', lang_idx, lang_priority) == 19
+
+
+def test_detect_language_reports_matched_token():
+    lang_priority = sierra2store.create_lang_priority(
+        {None: 1, 'ara': 2, 'spa': 19})
+    assert sierra2store.detect_language(
+        'J-Spa 630.78 R', lang_priority) == 'spa'
+    assert sierra2store.detect_language(
+        'J PIC ANDERSON', lang_priority) is None
+
+
 def test_get_itemtype_id():
     itemtype_idx = {
         0: 46,
@@ -574,3 +620,348 @@ def test_parse_shelfcode_when_none():
 def test_parse_shelfcode_when_empty_string():
     assert sierra2store.parse_shelfcode(
         '') is None
+
+
+def test_get_shelfcode_id():
+    shelfcode_idx = {
+        None: 1,
+        'nf': 2,
+        'fc': 3}
+    assert sierra2store.get_shelfcode_id(
+        '14anf', shelfcode_idx) == 2
+    assert sierra2store.get_shelfcode_id(
+        '14', shelfcode_idx) == 1
+
+
+def test_parse_batches_in_worker_pool_preserves_order():
+    idxs = sierra2store.CodeIndexes(
+        branch_idx={None: 1},
+        mat_cat_idx={c: c for c in [None, *sierra2store.NYP_CALL_PATTERNS]},
+        audn_idx={None: 1, 'a': 2, 'j': 3, 'y': 4},
+        lang_idx={None: 1, 'eng': 5, 'spa': 19},
+        lang_priority={'eng': 1, 'spa': 2},
+        itemtype_idx={0: 0})
+    rows = list(sierra2store.read_export(
+        os.path.join(FILES, 'nyp_test_export.txt')))
+
+    single = sierra2store.parse_batches(
+        sierra2store.iter_chunks(rows, 100), 2, idxs, workers=1)
+    pooled = sierra2store.parse_batches(
+        sierra2store.iter_chunks(rows, 100), 2, idxs, workers=2)
+    assert list(pooled) == list(single)
+
+
+def search_call_patterns(call_no, patterns):
+    # reference implementation: ordered cascade of re.search calls
+    for category, pattern in patterns.items():
+        if pattern.search(call_no):
+            return category
+
+
+def call_number_corpus():
+    corpus = []
+    for fh in ('bpl_test_export.txt', 'nyp_test_export.txt'):
+        corpus.extend(
+            row.call_no for row in sierra2store.sierra_export_reader(
+                os.path.join(FILES, fh)))
+    prefixes = ['', 'J ', 'SPA ', 'rus j ', 'LG PRINT ', 'LG-PRINT ', 'GRAPHIC ',
+                ' ', 'J-E ', 'CHI\n']
+    stems = ['FIC', 'GN FIC', 'PIC', 'E', 'YR', 'B', 'DVD', 'CD', 'SCI FI',
+             'SCI-FI', 'MYSTERY', 'ROMANCE', 'URBAN', 'WESTERN', 'CLASSICS',
+             'HOLIDAY PIC', 'J-E', '005.1', '158', '299.7', '306', '428',
+             '597.95', '641', '782', '822.33-H', '943', 'PER', 'fic', '']
+    suffixes = ['', ' ADAMS', ' B', ' J-E', ' 811 X', ' DVD TV', '\tFIC ']
+    for prefix, stem, suffix in itertools.product(prefixes, stems, suffixes):
+        corpus.append(f'{prefix}{stem}{suffix}')
+    return corpus
+
+
+def test_nyp_call_classifier_matches_pattern_cascade():
+    for call_no in call_number_corpus():
+        assert sierra2store.classify_call_no(
+            call_no, sierra2store.NYP_CALL_CLASSIFIER) == search_call_patterns(
+                call_no, sierra2store.NYP_CALL_PATTERNS), call_no
+
+
+def test_bpl_call_classifier_matches_pattern_cascade():
+    for call_no in call_number_corpus():
+        assert sierra2store.classify_call_no(
+            call_no, sierra2store.BPL_CALL_CLASSIFIER) == search_call_patterns(
+                call_no, sierra2store.BPL_CALL_PATTERNS), call_no
+
+
+def test_read_export_resumes_from_position():
+    fh = os.path.join(FILES, 'bpl_test_export.txt')
+    rows = list(sierra2store.read_export(fh))
+    assert rows[-1][1].offset == os.path.getsize(fh)
+    assert rows[-1][1].row_no == len(rows)
+
+    position = rows[99][1]
+    resumed = list(sierra2store.read_export(
+        fh, position.offset, position.row_no))
+    assert resumed == rows[100:]
+
+
+def test_read_export_splits_lines_on_carriage_returns(tmp_path):
+    fields = '|'.join(['"x"'] * 13)
+    fh = tmp_path / 'export.txt'
+    fh.write_bytes(
+        f'HEADER\r"b1"|{fields}\r\n"b2"|{fields}\r"b3"|{fields}\n'.encode())
+    rows = list(sierra2store.read_export(str(fh)))
+    assert [row.bib_id for row, _ in rows] == ['b1', 'b2', 'b3']
+    assert rows[-1][1].offset == len(fh.read_bytes())
+
+
+@pytest.fixture
+def store(file_store):
+    with file_store() as session:
+        session.add(datastore.System(rid=1, code='BKL', label='Brooklyn'))
+        session.add(datastore.System(rid=2, code='NYP', label='NYPL'))
+        for fh, model in [
+                ('audiences.json', datastore.Audience),
+                ('branches.json', datastore.Branch),
+                ('categories.json', datastore.MatCat),
+                ('languages.json', datastore.Language),
+                ('item-types.json', datastore.ItemType)]:
+            with open(os.path.join(DATA, fh), 'r') as jsonfile:
+                session.execute(model.__table__.insert(), json.load(jsonfile))
+    return file_store
+
+
+def export_item_ids(fh):
+    return Counter(
+        sierra2store.prep_ids(row.item_id)
+        for row in sierra2store.sierra_export_reader(fh))
+
+
+def stored_item_ids(session_scope):
+    with session_scope() as session:
+        return Counter(
+            item_id for item_id, in session.query(
+                datastore.OverflowItem.item_id))
+
+
+def retrieve_checkpoint(session_scope):
+    with session_scope() as session:
+        checkpoint = session.query(datastore.ExportCheckpoint).one()
+        session.expunge(checkpoint)
+        return checkpoint
+
+
+def fail_on_batch(monkeypatch, batch_no):
+    """
+    Makes storing of the batch_no-th batch fail once
+    """
+    calls = []
+    store_batch = sierra2store.store_batch
+
+    def failing_store_batch(*args):
+        calls.append(args)
+        if len(calls) == batch_no:
+            raise RuntimeError('crash')
+        store_batch(*args)
+
+    monkeypatch.setattr(sierra2store, 'store_batch', failing_store_batch)
+
+
+@pytest.fixture
+def export(tmp_path):
+    fh = str(tmp_path / 'sierra-export.txt')
+    shutil.copy(os.path.join(FILES, 'bpl_test_export.txt'), fh)
+    return fh
+
+
+def test_save2store_resumes_interrupted_load(store, export, monkeypatch):
+    fail_on_batch(monkeypatch, 3)
+    with pytest.raises(RuntimeError):
+        sierra2store.save2store(export, 1, batch_size=1000)
+    assert sum(stored_item_ids(store).values()) == 2000
+    checkpoint = retrieve_checkpoint(store)
+    assert (checkpoint.row_no, checkpoint.completed) == (2000, False)
+
+    sierra2store.save2store(export, 1, batch_size=1000)
+    assert stored_item_ids(store) == export_item_ids(export)
+    checkpoint = retrieve_checkpoint(store)
+    assert (checkpoint.row_no, checkpoint.completed) == (5911, True)
+    assert checkpoint.last_rid - checkpoint.first_rid + 1 == 5911
+
+    # completed export is not loaded again
+    sierra2store.save2store(export, 1, batch_size=1000)
+    sierra2store.save2store(export, 1, batch_size=1000, resume=False)
+    assert stored_item_ids(store) == export_item_ids(export)
+
+
+def test_save2store_restart_deletes_rows_of_interrupted_load(
+        store, export, monkeypatch):
+    fail_on_batch(monkeypatch, 2)
+    with pytest.raises(RuntimeError):
+        sierra2store.save2store(export, 1, batch_size=1000)
+
+    sierra2store.save2store(export, 1, batch_size=1000, resume=False)
+    assert stored_item_ids(store) == export_item_ids(export)
+    assert retrieve_checkpoint(store).completed
+
+
+def test_save2store_restart_keeps_rows_of_other_loads(
+        store, export, tmp_path, monkeypatch):
+    other = str(tmp_path / 'other-export.txt')
+    with open(export, 'rb') as src:
+        lines = src.readlines()
+    with open(other, 'wb') as dst:
+        dst.writelines(lines[:101])
+    store_batch = sierra2store.store_batch
+    calls = []
+
+    def interleaved_store_batch(*args):
+        if args[-1] != 1:
+            # rows of the other load
+            return store_batch(*args)
+        calls.append(args)
+        if len(calls) == 2:
+            # other load commits between batches of the first one
+            sierra2store.save2store(other, 1)
+        elif len(calls) == 3:
+            raise RuntimeError('crash')
+        store_batch(*args)
+
+    monkeypatch.setattr(sierra2store, 'store_batch', interleaved_store_batch)
+    with pytest.raises(RuntimeError):
+        sierra2store.save2store(export, 1, batch_size=1000)
+    assert sum(stored_item_ids(store).values()) == 2100
+
+    sierra2store.save2store(export, 1, batch_size=1000, resume=False)
+    assert stored_item_ids(store) == (
+        export_item_ids(export) + export_item_ids(other))
+
+
+def test_save2store_starts_over_when_export_is_replaced(
+        store, export, tmp_path, monkeypatch):
+    with open(export, 'rb') as src:
+        lines = src.readlines()
+    with open(export, 'wb') as dst:
+        dst.writelines(lines[:1] + lines[3000:])
+    fail_on_batch(monkeypatch, 2)
+    with pytest.raises(RuntimeError):
+        sierra2store.save2store(export, 1, batch_size=1000)
+
+    # next export saved under the same path
+    shutil.copy(os.path.join(FILES, 'bpl_test_export.txt'), export)
+    sierra2store.save2store(export, 1, batch_size=1000)
+    assert stored_item_ids(store) == export_item_ids(export)
+
+
+def test_save2store_loads_replaced_export_after_completed_one(
+        store, export):
+    with open(export, 'rb') as src:
+        lines = src.readlines()
+    with open(export, 'wb') as dst:
+        dst.writelines(lines[:101])
+    sierra2store.save2store(export, 1)
+    first = export_item_ids(export)
+
+    shutil.copy(os.path.join(FILES, 'bpl_test_export.txt'), export)
+    sierra2store.save2store(export, 1)
+    assert stored_item_ids(store) == first + export_item_ids(export)
+
+
+# overflow_item rows saved by the loader before batched writes
+# (row-by-row inserts), rid: column values of BASELINE_COLUMNS; rows
+# sit on both sides of 97 and 300 rows batch boundaries
+BASELINE_COLUMNS = [
+    'bib_id', 'title', 'author', 'call_no', 'item_id', 'src_branch_id',
+    'shelf_code', 'pub_date', 'bib_created_date', 'item_created_date',
+    'mat_cat_id', 'audn_id', 'lang_id', 'item_type_id', 'last_out_date',
+    'total_checkouts', 'total_renewals']
+BASELINE_ITEMS = {
+    'nyp_test_export.txt': {
+        1: (21800029, 'Magicians of the gods', 'Hancock, Graham',
+            '001.94 H', 37102791, 159, '0n', '2017', date(2019, 5, 9),
+            date(2019, 6, 12), 40, 2, 5, 102, None, 0, 0),
+        97: (21644185, 'Almost everything : notes on hope', 'Lamott, Anne',
+             '170.44 L', 36581273, 117, '0n', '2018', date(2018, 8, 29),
+             date(2018, 10, 26), 41, 2, 5, 117, '2019-01-02', 3, 10),
+        98: (20284238,
+             'The quest for a moral compass : a global history of ethics',
+             'Malik, Kenan, 1960-', '170.9 M', 32075549, 113, '0n', '2014',
+             date(2014, 8, 28), date(2014, 9, 23), 41, 2, 5, 138,
+             '2018-06-18', 12, 40),
+        300: (21711558,
+              'The storm before the storm : the beginning of the end of '
+              'the Roman Republic',
+              'Duncan, Mike (Podcaster)', '937.05 D', 35603632, 88, '0n',
+              '2017', date(2018, 12, 19), date(2017, 10, 20), 49, 2, 5, 138,
+              '2019-08-07', 12, 2),
+        301: (19823441, 'The swerve : how the world became modern',
+              'Greenblatt, Stephen, 1943-', '940.21 G', 31873531, 81, '0n',
+              '2012', date(2013, 5, 21), date(2014, 7, 22), 49, 2, 5, 102,
+              '2018-08-13', 18, 55),
+        1251: (20903333, 'What you always wanted : an If only novel',
+               'Rae, Kristin', 'FIC RAE', 34043402, 120, '0a', '2016',
+               date(2016, 2, 23), date(2016, 5, 6), 27, 3, 5, 169,
+               '2018-10-27', 5, 0),
+    },
+    'bpl_test_export.txt': {
+        1: (11769867, 'Bozhii pristani : rasskazy palomnikov.', None,
+            'RUS FIC B', 23725548, 13, 'wl', '2013', date(2014, 1, 27),
+            date(2014, 2, 12), 2, 2, 17, 2, '2017-09-14', 10, 15),
+        97: (12244085, 'In the shadow of Vesuvius',
+             'Alexander, Tasha, 1969-', 'FIC ALEXANDER', 27344551, 34, 'my',
+             '2020', date(2019, 11, 6), date(2020, 1, 9), 3, 2, 5, 2,
+             '2020-01-23', 2, 6),
+        98: (12244085, 'In the shadow of Vesuvius',
+             'Alexander, Tasha, 1969-', 'FIC ALEXANDER', 27344552, 43, 'my',
+             '2020', date(2019, 11, 6), date(2020, 1, 9), 3, 2, 5, 2, None,
+             1, 2),
+        300: (12243471, 'Murder at Icicle Lodge', 'Griffo, J. D',
+              'FIC GRIFFO', 27382888, 71, 'my', '2019', date(2019, 11, 4),
+              date(2020, 2, 4), 3, 2, 5, 3, None, 0, 0),
+        301: (12243471, 'Murder at Icicle Lodge', 'Griffo, J. D',
+              'FIC GRIFFO', 27382889, 70, 'my', '2019', date(2019, 11, 4),
+              date(2020, 2, 4), 3, 2, 5, 3, None, 0, 0),
+        5911: (12259285, 'Dinosaur surprise', 'Baruzzi, Agnese',
+               'J-E BARUZZI', 27421070, 71, 'je', '2019', date(2020, 1, 6),
+               date(2020, 2, 27), 9, 3, 5, 4, None, 0, 0),
+    },
+}
+# shelf codes in order of their shelf_code.rid assigned by the same loader
+BASELINE_SHELF_CODES = {
+    'nyp_test_export.txt': [
+        '0n', '0f', 'an', '2n', '0l', 'av', 'af', '0a', '01', '0v', '0i',
+        '0h', 'ln', 'lf', '0y'],
+    'bpl_test_export.txt': [
+        'wl', 'sf', 'fc', 'dk', 'my', None, 'lp', 'pb', 'au', 'nb', 'sh',
+        'je', 'nf', 'bi', 'dv'],
+}
+
+
+def stored_items(session_scope, rids):
+    item = datastore.OverflowItem
+    shelf = datastore.ShelfCode
+    columns = [
+        shelf.code if c == 'shelf_code' else getattr(item, c)
+        for c in BASELINE_COLUMNS]
+    with session_scope() as session:
+        return {
+            rid: tuple(values) for rid, *values in session.query(
+                item.rid, *columns).join(
+                shelf, shelf.rid == item.src_branch_shelf_id).filter(
+                item.rid.in_(rids))}
+
+
+@pytest.mark.parametrize('fh,system_id,count', [
+    ('nyp_test_export.txt', 2, 1251), ('bpl_test_export.txt', 1, 5911)])
+@pytest.mark.parametrize('batch_size,workers', [
+    (sierra2store.BATCH_SIZE, 1), (97, 1), (300, 2)])
+def test_save2store_stores_same_items_as_baseline_loader(
+        store, fh, system_id, count, batch_size, workers):
+    sierra2store.save2store(
+        os.path.join(FILES, fh), system_id, batch_size=batch_size,
+        workers=workers)
+
+    expected = BASELINE_ITEMS[fh]
+    assert stored_items(store, list(expected)) == expected
+    with store() as session:
+        assert session.query(datastore.OverflowItem).count() == count
+        assert [r.code for r in session.query(datastore.ShelfCode).filter_by(
+            system_id=system_id).order_by(datastore.ShelfCode.rid)] == (
+            BASELINE_SHELF_CODES[fh])
@@ -0,0 +1,206 @@
+import json
+import threading
+
+import pytest
+from requests.adapters import BaseAdapter
+from requests.models import Response
+
+
+from context import sierra_session
+
+
+BASE_URL = 'https://sierra.example.org/iii/sierra-api/v5/'
+
+
+class FakeAdapter(BaseAdapter):
+    """
+    Serves token requests and answers other requests with queued
+    statuses (204 by default)
+    """
+
+    def __init__(self, pool_connections, pool_maxsize, max_retries):
+        super().__init__()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.expires_in = 3600
+        self.statuses = []
+        self.tokens_issued = 0
+        self.requests = []
+        self.urls = []
+        self.holds = 0
+        self.max_limit = None
+        self.total = None
+        self.report_total = True
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        response = Response()
+        response.request = request
+        response.url = request.url
+        with self.lock:
+            if request.url.endswith('/token'):
+                self.tokens_issued += 1
+                response.status_code = 200
+                response._content = json.dumps({
+                    'access_token': f'token-{self.tokens_issued}',
+                    'token_type': 'bearer',
+                    'expires_in': self.expires_in}).encode()
+            elif '/holds?' in request.url:
+                self.urls.append(request.url)
+                response.status_code = 200
+                offset = int(request.url.split('offset=')[1].split('&')[0])
+                limit = int(request.url.split('limit=')[1].split('&')[0])
+                if self.max_limit is not None:
+                    limit = min(limit, self.max_limit)
+                entries = [
+                    {'id': f'{BASE_URL}patrons/holds/{n}'}
+                    for n in range(offset, min(offset + limit, self.holds))]
+                page = {'start': offset, 'entries': entries}
+                if self.report_total:
+                    page['total'] = (
+                        self.holds if self.total is None else self.total)
+                response._content = json.dumps(page).encode()
+            else:
+                self.requests.append(
+                    (request.method, request.headers['Authorization']))
+                self.urls.append(request.url)
+                response.status_code = (
+                    self.statuses.pop(0) if self.statuses else 204)
+                response._content = b''
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def adapters(monkeypatch):
+    created = []
+
+    def adapter(**kwargs):
+        created.append(FakeAdapter(**kwargs))
+        return created[-1]
+
+    monkeypatch.setattr(sierra_session, 'HTTPAdapter', adapter)
+    return created
+
+
+def test_session_pool_options(adapters):
+    with sierra_session.SierraSession(
+            BASE_URL, 'key', 'secret', pool_maxsize=16) as session:
+        adapter = session.get_adapter(BASE_URL)
+        assert adapter.pool_maxsize == 16
+        assert adapter.max_retries == 0
+        assert session.headers['Authorization'] == 'Bearer token-1'
+
+
+def test_session_opt_in_retry_policy(adapters):
+    with sierra_session.SierraSession(
+            BASE_URL, 'key', 'secret', retries=3) as session:
+        retry = session.get_adapter(BASE_URL).max_retries
+        assert retry.total == 3
+        assert 429 in retry.status_forcelist
+        assert 503 in retry.status_forcelist
+
+
+def test_retry_policy_leaves_out_post():
+    retry = sierra_session.retry_policy(2)
+    assert retry.is_retry('GET', 503)
+    assert retry.is_retry('GET', 429)
+    assert not retry.is_retry('POST', 500)
+
+
+def test_session_refreshes_token_before_expiry(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        adapter = adapters[0]
+        session.hold_delete_by_id(1)
+        assert adapter.tokens_issued == 1
+        session.token['expires_at'] = sierra_session.time.time() + 10
+        session.hold_delete_by_id(2)
+        assert adapter.tokens_issued == 2
+        assert adapter.requests == [
+            ('DELETE', 'Bearer token-1'), ('DELETE', 'Bearer token-2')]
+
+
+def test_session_renews_token_rejected_by_api(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        adapter = adapters[0]
+        adapter.statuses = [401]
+        response = session.hold_delete_by_id(1)
+        assert response.status_code == 204
+        assert adapter.tokens_issued == 2
+        assert adapter.requests[-1] == ('DELETE', 'Bearer token-2')
+
+
+def test_session_shared_by_threads_renews_token_once(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        adapter = adapters[0]
+        session.token['expires_at'] = sierra_session.time.time() + 10
+        threads = [
+            threading.Thread(target=session.hold_delete_by_id, args=(n,))
+            for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert adapter.tokens_issued == 2
+        assert len(adapter.requests) == 8
+
+
+def test_items_get_by_ids(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        session.items_get_by_ids([101, 102])
+        assert adapters[0].urls == [
+            f'{BASE_URL}items?id=101%2C102'
+            '&fields=id%2Cstatus%2Cdeleted%2Csuppressed%2CholdCount'
+            '&limit=2']
+        with pytest.raises(TypeError):
+            session.items_get_by_ids(['i101'])
+
+
+def test_hold_iter_all_pages_through_holds(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        adapters[0].holds = 7
+        holds = list(session.hold_iter_all(1, page_size=3))
+        assert [h['id'].rsplit('/', 1)[-1] for h in holds] == [
+            str(n) for n in range(7)]
+        assert [u.split('?')[1] for u in adapters[0].urls] == [
+            'limit=3&offset=0&fields=default',
+            'limit=3&offset=3&fields=default',
+            'limit=3&offset=6&fields=default']
+
+
+def test_hold_iter_all_stops_at_total(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        adapters[0].holds = 6
+        assert len(list(session.hold_iter_all(1, page_size=3))) == 6
+        assert len(adapters[0].urls) == 2
+
+
+def test_hold_iter_all_pages_by_total_when_server_caps_limit(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        adapters[0].holds = 7
+        adapters[0].max_limit = 2
+        holds = list(session.hold_iter_all(1, page_size=3))
+        assert [h['id'].rsplit('/', 1)[-1] for h in holds] == [
+            str(n) for n in range(7)]
+        assert [u.split('offset=')[1].split('&')[0]
+                for u in adapters[0].urls] == ['0', '2', '4', '6']
+
+
+def test_hold_iter_all_stops_on_empty_page(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        adapters[0].holds = 4
+        adapters[0].total = 10
+        adapters[0].max_limit = 2
+        assert len(list(session.hold_iter_all(1, page_size=3))) == 4
+        assert len(adapters[0].urls) == 3
+
+
+def test_hold_iter_all_without_total_stops_at_short_page(adapters):
+    with sierra_session.SierraSession(BASE_URL, 'key', 'secret') as session:
+        adapters[0].holds = 7
+        adapters[0].report_total = False
+        assert len(list(session.hold_iter_all(1, page_size=3))) == 7
+        assert len(adapters[0].urls) == 3
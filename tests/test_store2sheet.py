@@ -1,8 +1,152 @@
 from datetime import datetime
 
+import pytest
 
-from context import store2sheet
+
+from context import datastore, store2sheet
+
+
+@pytest.fixture
+def session(session):
+    session.add(datastore.System(rid=2, code='NYP', label='NYPL'))
+    for rid, code, label in [
+            (1, None, 'NONE'), (2, 'a', 'Adults'), (3, 'j', 'Kids'),
+            (4, 'y', 'Teens')]:
+        session.add(datastore.Audience(rid=rid, code=code, label=label))
+    for rid, code, label in [
+            (1, None, 'NONE'), (5, 'eng', 'English'), (9, 'fre', 'French'),
+            (19, 'spa', 'Spanish')]:
+        session.add(datastore.Language(rid=rid, code=code, label=label))
+    session.add(datastore.MatCat(
+        rid=1, system_id=2, code='fi', label='Fiction',
+        adults_order=2, teens_order=1, kids_order=None, wls_order=1))
+    session.add(datastore.MatCat(
+        rid=2, system_id=2, code='d8', label='800s',
+        adults_order=1, teens_order=None, kids_order=1, wls_order=2))
+    session.add(datastore.Branch(rid=1, system_id=2, code='ag'))
+    session.add(datastore.ShelfCode(rid=1, system_id=2, code='fc'))
+    session.add(datastore.ItemType(rid=1, system_id=2, code=0))
+    items = [
+        # rid, mat_cat_id, audn_id, lang_id, call_no
+        (1, 1, 2, 5, 'FIC B'),
+        (2, 1, 2, 5, 'FIC A'),
+        (3, 2, 2, 5, '811 A'),
+        (4, 1, 3, 5, 'J FIC A'),  # kids fiction not ordered for the tab
+        (5, 1, 4, 5, 'FIC C'),
+        (6, 2, 1, 5, '811 X'),  # no audience
+        (7, 1, 3, 19, 'SPA J FIC A'),
+        (8, 2, 2, 9, 'FRE 811 A'),
+    ]
+    for rid, mat_cat_id, audn_id, lang_id, call_no in items:
+        session.add(datastore.OverflowItem(
+            rid=rid, system_id=2, bib_id=rid, title=f'T{rid}',
+            author='Author', call_no=call_no, item_id=100 + rid,
+            src_branch_id=1, src_branch_shelf_id=1, mat_cat_id=mat_cat_id,
+            audn_id=audn_id, lang_id=lang_id, item_type_id=1))
+    session.commit()
+    return session
 
 
 def test_name_cart():
     assert store2sheet.name_cart() == f'Rebalancing Cart {datetime.now().strftime("%B %Y")}'
+
+
+def test_iter_cart_rows(session):
+    rows = [
+        (tab, row[0] or row[3], rid)
+        for tab, row, rid in store2sheet.iter_cart_rows(session, 2)]
+    assert rows == [
+        ('Adults', '800s', None),
+        ('Adults', '811 A', 3),
+        ('Adults', 'Fiction', None),
+        ('Adults', 'FIC A', 2),
+        ('Adults', 'FIC B', 1),
+        ('Teens', 'Fiction', None),
+        ('Teens', 'FIC C', 5),
+        ('Kids', '800s', None),
+        ('World Lang', 'French', None),
+        ('World Lang', 'FRE 811 A', 8),
+        ('World Lang', 'Spanish', None),
+        ('World Lang', 'SPA J FIC A', 7),
+    ]
+
+
+def test_iter_cart_rows_item_row(session):
+    rows = [
+        row for _, row, rid in store2sheet.iter_cart_rows(session, 2)
+        if rid == 3]
+    assert rows == [[
+        None, 'Author', 'T3', '811 A', None,
+        '=HYPERLINK("http://ilsstaff.nypl.org/record=b3", "see")', 103]]
+
+
+@pytest.fixture
+def cart_session(session, fake_session_scope, monkeypatch):
+    sheets = {}
+    fake_session_scope(store2sheet)
+
+    def publish_cart(creds, sheet_id, tabs, branch_count, rows, progress):
+        # nothing is written to the datastore while the sheet is published
+        assert not (session.new or session.dirty)
+        assert session.query(datastore.Cart).count() == 0
+        for tab, row, heading in rows:
+            data, cat_heading_rows = sheets.setdefault(tab, ([], []))
+            data.append(row)
+            if heading:
+                cat_heading_rows.append(len(data))
+
+    monkeypatch.setattr(store2sheet, 'publish_cart', publish_cart)
+    yield session, sheets
+
+
+def assigned_items(session):
+    return [
+        (r.rid, r.cart_id) for r in session.query(
+            datastore.OverflowItem).order_by(datastore.OverflowItem.rid)]
+
+
+def test_populate_cart_assigns_items_to_cart(cart_session):
+    session, sheets = cart_session
+    cart_id = store2sheet.populate_cart(None, 2, 'sheet-id', [], 1)
+    assert session.query(datastore.Cart).one().shopping_cart_id == 'sheet-id'
+    assert assigned_items(session) == [
+        (1, cart_id), (2, cart_id), (3, cart_id), (4, None), (5, cart_id),
+        (6, None), (7, cart_id), (8, cart_id)]
+    data, cat_heading_rows = sheets['Adults']
+    assert len(data) == 5
+    assert cat_heading_rows == [1, 3]
+    assert sheets['branch codes'] == ([['ag']], [])
+
+
+def test_populate_cart_rolls_back_cart_when_publishing_fails(
+        cart_session, monkeypatch):
+    session, _ = cart_session
+
+    def failed_publish(creds, sheet_id, tabs, branch_count, rows, progress):
+        next(rows)
+        raise ConnectionError
+
+    monkeypatch.setattr(store2sheet, 'publish_cart', failed_publish)
+    with pytest.raises(ConnectionError):
+        store2sheet.populate_cart(None, 2, 'sheet-id', [], 1)
+    assert session.query(datastore.Cart).count() == 0
+    assert all(cart_id is None for _, cart_id in assigned_items(session))
+
+
+def test_populate_cart_leaves_datastore_writable_while_publishing(
+        file_store, monkeypatch):
+    def publish_cart(creds, sheet_id, tabs, branch_count, rows, progress):
+        list(rows)
+        # another writer, e.g. issue_holds, commits during the publish
+        with file_store() as other:
+            other.execute(
+                "INSERT INTO branch (system_id, code) VALUES (2, 'zz')")
+
+    monkeypatch.setattr(store2sheet, 'publish_cart', publish_cart)
+    cart_id = store2sheet.populate_cart(None, 2, 'sheet-id', [], 1)
+    with file_store() as session:
+        assert session.execute(
+            'SELECT shopping_cart_id FROM cart WHERE rid=:rid',
+            {'rid': cart_id}).scalar() == 'sheet-id'
+        assert session.execute(
+            "SELECT count(*) FROM branch WHERE code='zz'").scalar() == 1